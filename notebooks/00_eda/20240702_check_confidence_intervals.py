@@ -5,7 +5,7 @@
 #       extension: .py
 #       format_name: percent
 #       format_version: '1.3'
-#       jupytext_version: 1.13.1
+#       jupytext_version: 1.16.0
 #   kernelspec:
 #     display_name: onebase
 #     language: python
@@ -14,6 +14,9 @@
 
 # %% [markdown]
 # # Plot confidence interval changes
+#
+# Compares the living tree confidence intervals of the DBH outlier strategies and parameter variants.
+# All variants are run in one process on the same raw inventory, see `run_variants` in src/variants.py.
 
 # %% [markdown]
 # # Imports and Set-up
@@ -27,120 +30,84 @@ import sys
 import numpy as np
 import pandas as pd
 
-# Google Cloud Imports
-import pandas_gbq
-
 # %%
 # Util imports
 sys.path.append("../../")  # include parent directory
-from src.settings import DATA_DIR
+from src.settings import PC_PLOT_LOOKUP_CSV, TMP_OUT_DIR
+from src.loaders import load_table
+from src.carbon_stock import plot_area_index
+from src.variants import attach_wood_density, run_variants
+
+# %%
+# Variables
+# Trees with wood density, from the living trees notebook. Only the wood densities are used:
+# the variants run on the raw DBH of the trees table, before any outlier handling
+TREES_WD_CSV = TMP_OUT_DIR / "trees_with_wood_density.csv"
+# Partition filters for the carbon pool tables, e.g. [("campaign", "=", "763932")]
+POOL_FILTERS = None
+
+# Variants to compare, see OUTLIER_STRATEGIES in src/outliers.py and LIVING_TREE_PARAMS in src/carbon_stock.py
+VARIANTS = {
+    "avg_substitution": {"outliers": "get_ave"},
+    "remove_trees_150": {"outliers": "drop_outliers"},
+    "capped_150": {"outliers": "eq_150"},
+    "percentile_99": {"outliers": {"strategy": "percentile", "q": 0.99}},
+    "mad": {"outliers": "mad"},
+}
+BASELINE = "avg_substitution"
 
 # %% [markdown]
 # ## Load data
 
-# %% [markdown]
-# ### Trees data
-
 # %%
-if TREES_CSV.exists():
-    trees = pd.read_csv(TREES_CSV)
-else:
-    query = f"""
-    SELECT
-        *
-    FROM {GCP_PROJ_ID}.{DATASET_ID}.trees"""
-
-    # Read the BigQuery table into a dataframe
-    trees = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    trees.to_csv(TREES_CSV, index=False)
-
-import glob
+plot_info = load_table("plot_info", filters=POOL_FILTERS)
+plot_index = plot_area_index(plot_info)
 
 # %%
-import pandas as pd
-
-csv_files = glob.glob(
-    "/Users/renflores/Documents/OneBase/data/csv/test_confidence_intervals/*.csv"
+plot_lookup = plot_info[["unique_id", "plot_code_nmbr"]].merge(
+    pd.read_csv(PC_PLOT_LOOKUP_CSV), on="unique_id", how="left"
 )
-dataframes = {}
-
-for file in csv_files:
-    file_name = file.split("/")[-1].split(".")[
-        0
-    ]  # Extract the file name without extension
-    df = pd.read_csv(file)
-    dataframes[file_name] = df
-
-# %%
-ci_avg_substitution = dataframes["ci_avg_substitution"]
-
-# %%
-ci_avg_substitution
 
 # %%
-ci_avg_substitution.drop(columns=["Unnamed: 0"], inplace=True)
+trees = load_table("trees", filters=POOL_FILTERS)
+trees = trees.rename(columns={"species_name": "code_species", "family_name": "code_family"})
+trees.loc[trees["code_species"] == 999, "code_species"] = np.nan
 
 # %%
-ci_avg_substitution.drop(columns=["carbon_type"]).groupby("Strata").mean().reset_index()
+# wood densities by subplot and species, see attach_wood_density in src/variants.py
+trees = attach_wood_density(trees, pd.read_csv(TREES_WD_CSV))
+trees = trees.merge(plot_lookup[["unique_id", "Strata"]], on="unique_id", how="left")
 
 # %%
-ci_avg_substitution.sort_values(by="Strata")
+trees.info()
 
 # %% [markdown]
-# # droping trees >150
-
-# %%
-dataframes.keys()
-
-# %%
-csv_files
-
-# %%
-ci_remove_trees_150 = pd.read_csv(
-    "/Users/renflores/Documents/OneBase/data/csv/test_confidence_intervals/ci_remove_trees_150.csv"
-)
-
-# %%
-ci_remove_trees_150.drop(columns=["Unnamed: 0"], inplace=True)
-
-# %%
-ci_remove_trees_150.drop(columns=["carbon_type"]).groupby("Strata").mean().reset_index()
+# # Run variants
 
 # %%
-merged_df = ci_remove_trees_150.merge(
-    ci_avg_substitution,
-    on=["Strata", "carbon_type"],
-    suffixes=("_remove_trees_150", "_avg_substitution"),
-)
-
-# %%
-(
-    merged_df["margin_err_perc_95_remove_trees_150"]
-    - merged_df["margin_err_perc_95_avg_substitution"]
-)
+statistics, outlier_reports = run_variants(trees, plot_index, plot_lookup, VARIANTS)
 
 # %%
-ci_capped_150 = dataframes["ci_capped_150"]
+outlier_reports
 
 # %%
-merged_df = merged_df.merge(ci_capped_150, on=["Strata", "carbon_type"])
+statistics.drop(columns=["tCO2e_per_ha"]).groupby(["variant", "Strata"]).mean().reset_index()
 
-# %%
-merged_df["margin_err_perc_95"] - merged_df["margin_err_perc_95_avg_substitution"]
-
-# %%
-dataframes["ci_capped_150"]
+# %% [markdown]
+# # Compare margins of error
 
 # %%
-dataframes.keys()
+uncertainty = statistics.pivot_table(
+    index=["Strata", "tCO2e_per_ha"], columns="variant", values="uncertainty_95"
+)[list(VARIANTS)]
 
 # %%
-ef_avg_substitution = dataframes[
-    "emission_factors_biomass_inventories_avg_substitution"
-]
+uncertainty
 
 # %%
-ef_avg_substitution.drop(columns=["Unnamed: 0"], inplace=True)
+# change in margin of error (% of the mean) against the baseline variant
+uncertainty.sub(uncertainty[BASELINE], axis=0).drop(columns=[BASELINE])
 
 # %%
-ef_avg_substitution.columns
+# variant with the smallest margin of error per strata and pool
+uncertainty.idxmin(axis=1)
@@ -23,13 +23,15 @@ from geowrangler.validation import GeometryValidation
 # %%
 # Util imports
 sys.path.append("../../")  # include parent directory
-from src.settings import GEOJSON_DATA_DIR, PARQUET_DATA_DIR, GPKG_DATA_DIR
+from src.settings import GEOJSON_DATA_DIR, PARQUET_DATA_DIR, GPKG_DATA_DIR, TMP_OUT_DIR
 from src.duckdb_utils import create_default_connection
 
 # %%
 # Variables
 SILUP_DIR = GEOJSON_DATA_DIR / "SILUP"
 STRATA_DIR = PARQUET_DATA_DIR / "pre-strata"
+# The activity_area and caraga_strata tables are kept here for the uncertainty notebook
+ACTIVITY_AREA_DB = TMP_OUT_DIR / "activity_area.db"
 
 # GCS Variables
 STRATA_GCS_DIR = "gs://00_extract_vectors/"
@@ -227,7 +229,7 @@ activity_area_df["geometry"] = activity_area_gdf["geometry"].to_wkt()
 # ## Initialize duckdb and load data
 
 # %%
-db = create_default_connection()
+db = create_default_connection(str(ACTIVITY_AREA_DB))
 
 # %%
 query = """ 
@@ -0,0 +1,162 @@
+# ---
+# jupyter:
+#   jupytext:
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.16.0
+#   kernelspec:
+#     display_name: onebase
+#     language: python
+#     name: python3
+# ---
+
+# %% [markdown]
+# # Benchmark the fused living tree kernel
+# Compares `living_tree_stock` against the step by step chain of the living trees notebook on synthetic inventories of 10^6 to 10^7 trees, and checks that both give the same per hectare values.
+
+# %% [markdown]
+# # Imports and Set-up
+
+# %%
+# Standard Imports
+import sys
+import time
+import pandas as pd
+import numpy as np
+
+# %%
+# Util imports
+sys.path.append("../../")  # include parent directory
+from src.biomass_equations import (
+    calculate_tree_height,
+    allometric_tropical_tree,
+    allometric_peatland_tree,
+    vmd0001_eq1,
+    vmd0001_eq2a,
+    vmd0001_eq2b,
+    vmd0001_eq5,
+)
+from src.carbon_stock import living_tree_stock, plot_area_index
+
+# %%
+# Variables
+N_TREES = [1_000_000, 10_000_000]
+N_SUBPLOTS = 3_000
+SEED = 42
+
+# %% [markdown]
+# ## Synthetic inventory
+
+# %%
+def make_inventory(n_trees, n_subplots, seed=SEED):
+    rng = np.random.default_rng(seed)
+    unique_ids = np.array([f"{i}A1" for i in range(n_subplots)])
+    slope_radians = np.arctan(rng.uniform(0, 60, n_subplots) / 100)
+    plot_info = pd.DataFrame(
+        {
+            "unique_id": unique_ids,
+            "corrected_plot_area_n2_m2": np.pi * (5 / np.cos(slope_radians)) ** 2,
+            "corrected_plot_area_n3_m2": np.pi * (15 / np.cos(slope_radians)) ** 2,
+            "corrected_plot_area_n4_m2": np.pi * (20 / np.cos(slope_radians)) ** 2,
+        }
+    )
+    plot_strata = pd.DataFrame(
+        {"unique_id": unique_ids, "Strata": rng.integers(1, 7, n_subplots)}
+    )
+    trees = pd.DataFrame(
+        {
+            "unique_id": unique_ids[rng.integers(0, n_subplots, n_trees)],
+            "nest": rng.integers(2, 5, n_trees),
+            "scientific_name": "Shorea sp.",
+            "family_name": "Dipterocarpaceae",
+            "DBH": rng.lognormal(3, 0.5, n_trees),
+            "wood_density": rng.uniform(0.3, 0.9, n_trees),
+        }
+    )
+    trees = trees.merge(plot_strata, on="unique_id", how="left")
+    return trees, plot_info
+
+# %% [markdown]
+# ## Current notebook chain
+
+# %%
+def notebook_chain(trees, plot_info):
+    plot_info_subset = plot_info[
+        [
+            "unique_id",
+            "corrected_plot_area_n2_m2",
+            "corrected_plot_area_n3_m2",
+            "corrected_plot_area_n4_m2",
+        ]
+    ].copy()
+    plot_info_subset.dropna(inplace=True)
+    plot_info_subset.drop_duplicates(subset=["unique_id"], inplace=True)
+    area_lookup = plot_info_subset.set_index("unique_id")
+
+    trees = calculate_tree_height(trees, "DBH")
+    tropical_trees = allometric_tropical_tree(
+        trees.loc[trees["Strata"].isin([1, 2, 3])].copy(),
+        "wood_density",
+        "DBH",
+        "height",
+    )
+    peatland_trees = allometric_peatland_tree(
+        trees.loc[trees["Strata"].isin([4, 5, 6])].copy(), "DBH"
+    )
+    trees = pd.concat([tropical_trees, peatland_trees])
+    trees["aboveground_biomass"] = trees["aboveground_biomass"] / 1000
+    trees = vmd0001_eq1(trees, 0.47)
+    trees = vmd0001_eq5(trees)
+
+    results = []
+    for pool in ["aboveground", "belowground"]:
+        agg = vmd0001_eq2a(trees, ["unique_id", "nest"], f"{pool}_carbon_tonnes")
+        # the notebook looks up the area row by row; a keyed lookup is used here so
+        # that the benchmark measures the equations rather than the dict scan
+        agg["corrected_area_m2"] = [
+            area_lookup.at[uid, f"corrected_plot_area_n{nest}_m2"]
+            for uid, nest in zip(agg["unique_id"], agg["nest"])
+        ]
+        agg = vmd0001_eq2b(agg, f"{pool}_carbon_tonnes", "corrected_area_m2")
+        agg["CO2e_per_ha"] = agg["CO2e_per_ha"] * 10_000
+        agg["tC_per_ha"] = (
+            agg[f"{pool}_carbon_tonnes"] / agg["corrected_area_m2"]
+        ) * 10_000
+        agg = agg.groupby("unique_id")[["CO2e_per_ha", "tC_per_ha"]].mean()
+        results.append(agg.add_prefix(f"{pool}_"))
+
+    return pd.concat(results, axis=1).reset_index()
+
+# %% [markdown]
+# ## Benchmark
+
+# %%
+timings = []
+for n_trees in N_TREES:
+    trees, plot_info = make_inventory(n_trees, N_SUBPLOTS)
+
+    start = time.perf_counter()
+    expected = notebook_chain(trees, plot_info)
+    chain_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = living_tree_stock(trees, plot_area_index(plot_info))
+    kernel_seconds = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(
+        actual, expected[actual.columns], check_exact=False, rtol=1e-10
+    )
+    timings.append(
+        {
+            "n_trees": n_trees,
+            "chain_seconds": chain_seconds,
+            "kernel_seconds": kernel_seconds,
+            "speedup": chain_seconds / kernel_seconds,
+        }
+    )
+    del trees, expected, actual
+
+# %%
+pd.DataFrame(timings)
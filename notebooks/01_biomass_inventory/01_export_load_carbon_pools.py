@@ -38,7 +38,8 @@ import pandas_gbq
 # %%
 # Util imports
 sys.path.append("../../")  # include parent directory
-from src.settings import DATA_DIR, GCP_PROJ_ID, CARBON_POOLS_OUTDIR
+from src.settings import DATA_DIR, GCP_PROJ_ID
+from src.pool_storage import write_pool_table
 from src.odk_data_parsing import (
     extract_trees,
     extract_stumps,
@@ -54,6 +55,7 @@ from src.odk_data_parsing import (
 URL = "https://api.ona.io/api/v1/data/763932.csv"
 FILE_RAW = DATA_DIR / "csv" / "biomass_inventory_raw.csv"
 NESTS = [2, 3, 4]
+CAMPAIGN = "763932"  # ONA form id of the inventory campaign
 
 # BigQuery Variables
 DATASET_ID = "biomass_inventory"
@@ -427,9 +429,10 @@ plot_info.info(), plot_info.head(2)
 # ## Export data and upload to BQ
 
 # %%
-# Export CSV
+# Export partitioned parquet
+plot_info["campaign"] = CAMPAIGN
 if len(plot_info) != 0:
-    plot_info.to_csv(CARBON_POOLS_OUTDIR / "plot_info.csv", index=False)
+    write_pool_table(plot_info, "plot_info")
 
 # %%
 # Upload to BQ
@@ -503,9 +506,10 @@ ntv.info(), ntv.head(2)
 # ## Export data and upload to BQ
 
 # %%
-# Export CSV
+# Export partitioned parquet
+ntv["campaign"] = CAMPAIGN
 if len(ntv) != 0:
-    ntv.to_csv(CARBON_POOLS_OUTDIR / "saplings_ntv_litter.csv", index=False)
+    write_pool_table(ntv, "saplings_ntv_litter")
 
 # %%
 # Upload to BQ
@@ -533,8 +537,9 @@ trees.describe()
 # ## Export data and upload to BQ
 
 # %%
-# Export to CSV
-trees.to_csv(CARBON_POOLS_OUTDIR / "trees.csv", index=False)
+# Export partitioned parquet
+trees["campaign"] = CAMPAIGN
+write_pool_table(trees, "trees")
 
 # %%
 # Upload to BQ
@@ -561,8 +566,9 @@ stumps.describe()
 # ## Export data and upload to BQ
 
 # %%
-# Export to CSV
-stumps.to_csv(CARBON_POOLS_OUTDIR / "stumps.csv", index=False)
+# Export partitioned parquet
+stumps["campaign"] = CAMPAIGN
+write_pool_table(stumps, "stumps")
 
 # %%
 # Upload to BQ
@@ -630,9 +636,10 @@ dead_trees.info(), dead_trees.head(2)
 # ## Export data and upload to BQ
 
 # %%
-# Export CSV
+# Export partitioned parquet
+dead_trees["campaign"] = CAMPAIGN
 if len(dead_trees) != 0:
-    dead_trees.to_csv(CARBON_POOLS_OUTDIR / "dead_trees.csv", index=False)
+    write_pool_table(dead_trees, "dead_trees")
 
 # %%
 # Upload to BQ
@@ -657,9 +664,10 @@ ldw_hollow.info(), ldw_hollow.head(2)
 # ## Export data and upload to BQ
 
 # %%
-# Export CSV
+# Export partitioned parquet
+ldw_hollow["campaign"] = CAMPAIGN
 if len(ldw_hollow) != 0:
-    ldw_hollow.to_csv(CARBON_POOLS_OUTDIR / "lying_deadwood_hollow.csv", index=False)
+    write_pool_table(ldw_hollow, "lying_deadwood_hollow")
 
 # %%
 # Upload to BQ
@@ -684,11 +692,10 @@ ldw_wo_hollow.info(), ldw_wo_hollow.head(2)
 # ## Export data and upload to BQ
 
 # %%
-# Export CSV
+# Export partitioned parquet
+ldw_wo_hollow["campaign"] = CAMPAIGN
 if len(ldw_wo_hollow) != 0:
-    ldw_wo_hollow.to_csv(
-        CARBON_POOLS_OUTDIR / "lying_deadwood_wo_hollow.csv", index=False
-    )
+    write_pool_table(ldw_wo_hollow, "lying_deadwood_wo_hollow")
 
 # %%
 # Upload to BQ
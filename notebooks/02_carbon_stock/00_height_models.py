@@ -0,0 +1,92 @@
+# ---
+# jupyter:
+#   jupytext:
+#     text_representation:
+#       extension: .py
+#       format_name: percent
+#       format_version: '1.3'
+#       jupytext_version: 1.16.0
+#   kernelspec:
+#     display_name: onebase
+#     language: python
+#     name: python3
+# ---
+
+# %% [markdown]
+# # Fit Local Height-Diameter Models
+#
+# The measured heights of the tall standing dead trees are used to fit a height-diameter model per strata. The living trees and deadwood notebooks read the fits from `HEIGHT_MODELS_CSV` when their `USE_LOCAL_HEIGHT_MODELS` is set, so this notebook runs before both of them.
+
+# %% [markdown]
+# # Imports and Set-up
+
+# %%
+# Standard Imports
+import sys
+import pandas as pd
+
+# %%
+# Util imports
+sys.path.append("../../")  # include parent directory
+from src.settings import PC_PLOT_LOOKUP_CSV, TMP_OUT_DIR
+from src.loaders import load_table
+
+from src.biomass_equations import calculate_tree_height
+from src.cache import TableCache
+from src.height_models import fit_height_models
+
+# %%
+# Variables
+# Partition filters for the carbon pool tables, e.g. [("campaign", "=", "763932")]
+POOL_FILTERS = None
+
+# Options: "michaelis_menten", "weibull", "loglog", see HEIGHT_MODELS in src/height_models.py
+HEIGHT_MODEL = "michaelis_menten"
+HEIGHT_MODELS_CSV = TMP_OUT_DIR / "height_models.csv"
+
+# %% [markdown]
+# ## Load data
+
+# %%
+dead_trees = load_table("dead_trees", filters=POOL_FILTERS)
+
+# %%
+plot_strata = pd.read_csv(PC_PLOT_LOOKUP_CSV)
+
+# %% [markdown]
+# ## Measured heights of the tall standing dead trees
+
+# %%
+tall_trees = dead_trees.loc[
+    (dead_trees["class"] == 2) & (dead_trees["subclass"] == "tall")
+].copy()
+
+# %%
+# height from the distance and the slopes (%) to the top and base of the tree;
+# impossible geometries (e.g. top below base) give NaN and are left out of the fit
+tall_trees = calculate_tree_height(
+    tall_trees,
+    trig_leveling=True,
+    dist_col="dist_t_tall",
+    slope_b_col="slope_b_tall",
+    slope_t_col="slope_t_tall",
+    slope_units="percent",
+)
+
+# %%
+tall_trees = tall_trees.merge(plot_strata[["unique_id", "Strata"]], on="unique_id", how="left")
+
+# %% [markdown]
+# ## Fit a model per strata
+# Strata with too few measured heights use Feldpausch, et al. (2011). The fits are cached by the
+# hash of the measurements of each strata (the data_hash column), so a re-run only fits the
+# strata whose measurements changed.
+
+# %%
+height_models = fit_height_models(
+    tall_trees, "db_tall", "height", model=HEIGHT_MODEL, cache=TableCache()
+)
+height_models.to_csv(HEIGHT_MODELS_CSV, index=False)
+
+# %%
+height_models
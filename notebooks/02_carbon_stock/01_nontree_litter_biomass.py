@@ -21,7 +21,6 @@
 # %%
 # Standard Imports
 import sys
-import pandas as pd
 
 # Google Cloud Imports
 import pandas_gbq
@@ -29,17 +28,17 @@ import pandas_gbq
 # %%
 # Util imports
 sys.path.append("../../")  # include parent directory
-from src.settings import GCP_PROJ_ID, CARBON_POOLS_OUTDIR, CARBON_STOCK_OUTDIR
+from src.settings import GCP_PROJ_ID, CARBON_STOCK_OUTDIR
+from src.loaders import load_table
 
 from src.biomass_equations import vmd0003_eq1
 
 # %%
 # Variables
-NTV_LITTER_CSV = CARBON_POOLS_OUTDIR / "saplings_ntv_litter.csv"
-PLOT_INFO_CSV = CARBON_POOLS_OUTDIR / "plot_info.csv"
+# Partition filters for the carbon pool tables, e.g. [("campaign", "=", "763932")]
+POOL_FILTERS = None
 
 # BigQuery Variables
-SRC_DATASET_ID = "biomass_inventory"
 DATASET_ID = "carbon_stock"
 IF_EXISTS = "replace"
 
@@ -47,33 +46,13 @@ IF_EXISTS = "replace"
 # ## Load data
 
 # %%
-if PLOT_INFO_CSV.exists():
-    plot_info = pd.read_csv(PLOT_INFO_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.plot_info"""
-
-    # Read the BigQuery table into a dataframe
-    plot_info = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    plot_info.to_csv(PLOT_INFO_CSV, index=False)
+plot_info = load_table("plot_info", filters=POOL_FILTERS)
 
 # %%
 plot_info.info()
 
 # %%
-if NTV_LITTER_CSV.exists():
-    ntv_litter = pd.read_csv(NTV_LITTER_CSV)
-else:
-    query = f"""
-    SELECT 
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.saplings_ntv_litter"""
-
-    # Read the BigQuery table into a dataframe
-    ntv_litter = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    ntv_litter.to_csv(PLOT_INFO_CSV, index=False)
+ntv_litter = load_table("saplings_ntv_litter", filters=POOL_FILTERS)
 
 # %%
 ntv_litter.info()
@@ -20,6 +20,7 @@
 
 # %%
 # Standard Imports
+import subprocess
 import sys
 import pandas as pd
 import numpy as np
@@ -32,38 +33,44 @@ import pandas_gbq
 sys.path.append("../../")  # include parent directory
 from src.settings import (
     GCP_PROJ_ID,
-    CARBON_POOLS_OUTDIR,
     CARBON_STOCK_OUTDIR,
     TMP_OUT_DIR,
     SPECIES_LOOKUP_CSV,
     PC_PLOT_LOOKUP_CSV,
+    SRC_DIR,
 )
+from src.loaders import load_table
 
-from src.biomass_equations import (
-    calculate_tree_height,
-    allometric_tropical_tree,
-    allometric_peatland_tree,
-    vmd0001_eq1,
-    vmd0001_eq2a,
-    vmd0001_eq2b,
-    vmd0001_eq5,
-)
+from src.biomass_equations import vmd0001_eq1, vmd0001_eq2b
+from src.carbon_stock import living_tree_stock, plot_area_index
+from src.outliers import handle_outliers
+from src.monte_carlo import monte_carlo_living_trees
+from src.stand_structure import stand_structure
+from src.cache import TableCache, cache_key
 
 # %%
 # Variables
-TREES_CSV = CARBON_POOLS_OUTDIR / "trees.csv"
-SAPLING_CSV = CARBON_POOLS_OUTDIR / "saplings_ntv_litter.csv"
-PLOT_INFO_CSV = CARBON_POOLS_OUTDIR / "plot_info.csv"
 TREES_SPECIES_CSV = TMP_OUT_DIR / "trees_with_names.csv"
 TREES_WD_CSV = TMP_OUT_DIR / "trees_with_wood_density.csv"
+# Partition filters for the carbon pool tables, e.g. [("campaign", "=", "763932")]
+POOL_FILTERS = None
 
 # BigQuery Variables
-SRC_DATASET_ID = "biomass_inventory"
 DATASET_ID = "carbon_stock"
 IF_EXISTS = "replace"
 
 # Processing Conditions
-OUTLIER_REMOVAL = "get_ave"  # Options: "get_ave", "drop_outliers", "eq_150"
+OUTLIER_REMOVAL = "get_ave"  # Options: "get_ave", "drop_outliers", "eq_150", "percentile", "mad"
+# Use the height-diameter models fitted per strata in the height models notebook (00_height_models)
+# instead of Feldpausch
+USE_LOCAL_HEIGHT_MODELS = False
+HEIGHT_MODELS_CSV = TMP_OUT_DIR / "height_models.csv"
+# Monte Carlo draws of the allometric, wood density and height errors per tree (0 to skip), see src/monte_carlo.py
+MONTE_CARLO_DRAWS = 0
+MONTE_CARLO_JOBS = 1
+MONTE_CARLO_SEED = 42
+MONTE_CARLO_CSV = TMP_OUT_DIR / "living_trees_monte_carlo.csv"
+STAND_STRUCTURE_CSV = TMP_OUT_DIR / "stand_structure.csv"
 
 # %% [markdown]
 # ## Load data
@@ -72,53 +79,23 @@ OUTLIER_REMOVAL = "get_ave"  # Options: "get_ave", "drop_outliers", "eq_150"
 # ### Plot Data
 
 # %%
-if PLOT_INFO_CSV.exists():
-    plot_info = pd.read_csv(PLOT_INFO_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.plot_info"""
-
-    # Read the BigQuery table into a dataframe
-    plot_info = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    plot_info.to_csv(PLOT_INFO_CSV, index=False)
+plot_info = load_table("plot_info", filters=POOL_FILTERS)
 
 # %%
 plot_info.info()
 
 # %%
-# get the slope adjusted area per nest per subplot and creaste dict for substitution
-plot_info_subset = plot_info[
-    [
-        "unique_id",
-        "corrected_plot_area_n2_m2",
-        "corrected_plot_area_n3_m2",
-        "corrected_plot_area_n4_m2",
-    ]
-].copy()
-plot_info_subset.dropna(inplace=True)
-plot_info_subset.drop_duplicates(subset=["unique_id"], inplace=True)
-plot_info_subset_dict = plot_info_subset.to_dict(orient="records")
+# get the slope adjusted area per nest per subplot
+plot_index = plot_area_index(plot_info)
 
 # %%
-plot_info_subset_dict[1]
+plot_index.head(2)
 
 # %% [markdown]
 # ### Trees data
 
 # %%
-if TREES_CSV.exists():
-    trees = pd.read_csv(TREES_CSV)
-else:
-    query = f"""
-    SELECT 
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.trees"""
-
-    # Read the BigQuery table into a dataframe
-    trees = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    trees.to_csv(TREES_CSV, index=False)
+trees = load_table("trees", filters=POOL_FILTERS)
 
 # %%
 trees.rename(
@@ -138,17 +115,7 @@ trees.head(2)
 # ### Saplings data
 
 # %%
-if SAPLING_CSV.exists():
-    saplings = pd.read_csv(SAPLING_CSV)
-else:
-    query = f"""
-    SELECT 
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.saplings_ntv_litter"""
-
-    # Read the BigQuery table into a dataframe
-    saplings = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    saplings.to_csv(SAPLING_CSV, index=False)
+saplings = load_table("saplings_ntv_litter", filters=POOL_FILTERS)
 
 # %%
 saplings.info()
@@ -177,25 +144,6 @@ plot_strata.info()
 # %% [markdown]
 # # Calculate tree biomass
 
-# %% [markdown]
-# ## Remove outliers
-#
-
-# %%
-if OUTLIER_REMOVAL == "get_ave":
-    mean_dbh = pd.DataFrame(
-        trees.groupby(["unique_id", "nest"])["DBH"].mean()
-    ).reset_index()
-    trees.loc[trees["DBH"] >= 150, "DBH"] = trees.loc[
-        trees["DBH"] >= 150, "unique_id"
-    ].map(mean_dbh.set_index(["unique_id", "nest"])["DBH"])
-
-elif OUTLIER_REMOVAL == "drop_outliers":
-    trees = trees[trees["DBH"] < 150].copy()
-
-elif OUTLIER_REMOVAL == "eq_150":
-    trees.loc[trees["DBH"] >= 150, "DBH"] = 150
-
 # %% [markdown]
 # ## Add species using lookup table
 
@@ -237,11 +185,21 @@ trees.to_csv(TREES_SPECIES_CSV, index=False)
 # Wood density was generated using [BIOMASS](https://www.rdocumentation.org/packages/BIOMASS/versions/2.1.11) library from R. For further information, 
 
 # %%
-if not TREES_WD_CSV.exists():
-    # !Rscript {SRC_DIR}/get_wood_density.R {TREES_SPECIES_CSV} {TREES_WD_CSV}
-
-# %%
-trees = pd.read_csv(TREES_WD_CSV)
+# the wood densities are cached by the contents of the species table and the R script,
+# so they are only looked up again when either changes
+intermediate_cache = TableCache()
+wood_density_key = cache_key(
+    "trees_with_wood_density", TREES_SPECIES_CSV, SRC_DIR / "get_wood_density.R"
+)
+trees = intermediate_cache.get(wood_density_key)
+if trees is None:
+    # raises if the lookup fails, so an older TREES_WD_CSV is never cached under this key
+    subprocess.run(
+        ["Rscript", SRC_DIR / "get_wood_density.R", TREES_SPECIES_CSV, TREES_WD_CSV], check=True
+    )
+    trees = pd.read_csv(TREES_WD_CSV)
+    intermediate_cache.put(wood_density_key, trees, "trees_with_wood_density")
+intermediate_cache.stats()
 
 # %%
 trees.head(2)
@@ -250,13 +208,14 @@ trees.head(2)
 trees.info()
 
 # %% [markdown]
-# ## Estimate tree height
-
-# %%
-trees = calculate_tree_height(trees, "DBH")
+# ## Remove outliers
+# The wood densities only depend on the species and subplot, so they are looked up for every
+# stem before the outliers are handled and trees_with_wood_density.csv keeps the measured DBH.
 
 # %%
-trees.head(2)
+# see OUTLIER_STRATEGIES in src/outliers.py
+trees, outlier_report = handle_outliers(trees, OUTLIER_REMOVAL, "DBH")
+outlier_report
 
 # %% [markdown]
 # ## Add strata to trees
@@ -272,171 +231,51 @@ trees.head(2)
 trees.info()
 
 # %% [markdown]
-# ## Calculate biomass and carbon stock for tree AGB 
-
-# %%
-plot_strata.Strata.unique()
+# ## Calculate AGB and BGB carbon stock per subplot
+# Tree height, aboveground biomass, carbon, belowground carbon, the sum per nest and the per hectare values are calculated in one pass. Tropical strata (1, 2, 3) use Chave, et al. (2014) and peatland strata (4, 5, 6) use Alibo, et al. (2012).
 
 # %%
-tropical_trees = trees.loc[trees["Strata"].isin([1, 2, 3])].copy()
-
-# %%
-tropical_trees = allometric_tropical_tree(
-    tropical_trees, "wood_density", "DBH", "height"
-)
-
-# %%
-peatland_trees = trees.loc[trees["Strata"].isin([4, 5, 6])].copy()
-
-# %%
-peatland_trees = allometric_peatland_tree(peatland_trees, "DBH")
-
-# %%
-trees = pd.concat([tropical_trees, peatland_trees])
-
-# %%
-trees.head()
-
-# %%
-# convert aboveground biomass to tonnes
-trees["aboveground_biomass"] = trees["aboveground_biomass"] / 1000
-
-# %%
-trees = vmd0001_eq1(trees, 0.47)
-
-# %%
-trees.head(2)
+# locally fitted height-diameter models per strata, see src/height_models.py
+height_models = None
+if USE_LOCAL_HEIGHT_MODELS:
+    height_models = pd.read_csv(HEIGHT_MODELS_CSV)
+height_models
 
 # %% [markdown]
-# ## Calculate below ground biomass
+# ## Stand structure
+# Stems, basal area and aboveground biomass per hectare by DBH class for every subplot, see src/stand_structure.py.
 
 # %%
-trees = vmd0001_eq5(
-    trees,
+plot_structure, nest_structure = stand_structure(
+    trees, plot_index, params={"height_models": height_models}
 )
+plot_structure.to_csv(STAND_STRUCTURE_CSV, index=False)
 
 # %%
-trees.head(2)
-
-# %% [markdown]
-# ## Calculate biomass sum per plot
+plot_structure.groupby("dbh_class", sort=False)[
+    ["stems_per_ha", "basal_area_m2_per_ha", "aboveground_biomass_t_per_ha"]
+].mean()
 
 # %% [markdown]
-# ### AGB
+# ## Propagate tree level errors
+# The allometric error of Chave, et al. (2014), the wood density standard deviation from BIOMASS and the error of the local height models are propagated to the plots and strata by Monte Carlo.
 
 # %%
-trees_agg_agb = vmd0001_eq2a(trees, ["unique_id", "nest"], "aboveground_carbon_tonnes")
-
-# %%
-# add the correct area using the unique_id and nest number
-trees_agg_agb["corrected_area_m2"] = trees_agg_agb.apply(
-    lambda x: next(
-        (
-            item["corrected_plot_area_n" + str(x["nest"]) + "_m2"]
-            for item in plot_info_subset_dict
-            if item["unique_id"] == x["unique_id"]
-        ),
-        None,
-    ),
-    axis=1,
-)
-
-# %%
-trees_agg_agb = vmd0001_eq2b(
-    trees_agg_agb, "aboveground_carbon_tonnes", "corrected_area_m2"
-)
-
-# %%
-# convert tonnes/sqm to tonnes/ha
-trees_agg_agb["CO2e_per_ha"] = trees_agg_agb["CO2e_per_ha"] * 10_000
-
-# %%
-trees_agg_agb.head()
-
-# %%
-# calculate tonnes of Carbon per sqm; convert tonnes/sqm to tonnes/ha
-trees_agg_agb["tC_per_ha"] = (
-    trees_agg_agb["aboveground_carbon_tonnes"] / trees_agg_agb["corrected_area_m2"]
-) * 10_000
-
-# %%
-trees_agg_agb = (
-    trees_agg_agb.groupby("unique_id")[["CO2e_per_ha", "tC_per_ha"]]
-    .mean()
-    .reset_index()
-)
-
-# %%
-trees_agg_agb.rename(
-    columns={
-        "CO2e_per_ha": "aboveground_CO2e_per_ha",
-        "tC_per_ha": "aboveground_tC_per_ha",
-    },
-    inplace=True,
-)
-
-# %%
-trees_agg_agb.head()
-
-# %% [markdown]
-# ### BGB
-
-# %%
-trees_agg_bgb = vmd0001_eq2a(trees, ["unique_id", "nest"], "belowground_carbon_tonnes")
-
-# %%
-# add the correct area using the unique_id and nest number
-trees_agg_bgb["corrected_area_m2"] = trees_agg_bgb.apply(
-    lambda x: next(
-        (
-            item["corrected_plot_area_n" + str(x["nest"]) + "_m2"]
-            for item in plot_info_subset_dict
-            if item["unique_id"] == x["unique_id"]
-        ),
-        None,
-    ),
-    axis=1,
-)
-
-# %%
-trees_agg_bgb = vmd0001_eq2b(
-    trees_agg_bgb, "belowground_carbon_tonnes", "corrected_area_m2"
-)
-
-# %%
-# convert tonnes/sqm to tonnes/ha
-trees_agg_bgb["CO2e_per_ha"] = trees_agg_bgb["CO2e_per_ha"] * 10_000
-
-# %%
-trees_agg_bgb.head()
-
-# %%
-# calculate tonnes of Carbon per sqm; convert tonnes/sqm to tonnes/ha
-trees_agg_bgb["tC_per_ha"] = (
-    trees_agg_bgb["belowground_carbon_tonnes"] / trees_agg_bgb["corrected_area_m2"]
-) * 10_000
-
-# %%
-trees_agg_bgb = (
-    trees_agg_bgb.groupby("unique_id")[["CO2e_per_ha", "tC_per_ha"]]
-    .mean()
-    .reset_index()
-)
-
-# %%
-trees_agg_bgb.rename(
-    columns={
-        "CO2e_per_ha": "belowground_CO2e_per_ha",
-        "tC_per_ha": "belowground_tC_per_ha",
-    },
-    inplace=True,
-)
-
-# %%
-trees_agg_bgb.head()
+if MONTE_CARLO_DRAWS:
+    plot_uncertainty, strata_uncertainty = monte_carlo_living_trees(
+        trees,
+        plot_index,
+        plot_strata.drop_duplicates("unique_id").set_index("unique_id")["Strata"],
+        MONTE_CARLO_DRAWS,
+        params={"height_models": height_models},
+        seed=MONTE_CARLO_SEED,
+        n_jobs=MONTE_CARLO_JOBS,
+    )
+    plot_uncertainty.to_csv(MONTE_CARLO_CSV, index=False)
+    display(strata_uncertainty)
 
 # %%
-trees = trees_agg_agb.merge(trees_agg_bgb, on="unique_id", how="left")
+trees = living_tree_stock(trees, plot_index, params={"height_models": height_models})
 
 # %%
 trees.head(2)
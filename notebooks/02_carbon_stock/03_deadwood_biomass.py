@@ -20,6 +20,7 @@
 
 # %%
 # Standard Imports
+import subprocess
 import sys
 import pandas as pd
 import numpy as np
@@ -32,42 +33,49 @@ import pandas_gbq
 sys.path.append("../../")  # include parent directory
 from src.settings import (
     GCP_PROJ_ID,
-    CARBON_POOLS_OUTDIR,
     CARBON_STOCK_OUTDIR,
     SPECIES_LOOKUP_CSV,
     PC_PLOT_LOOKUP_CSV,
+    SRC_DIR,
     TMP_OUT_DIR,
 )
+from src.loaders import load_table
 
 from src.biomass_equations import (
     vmd0002_eq1,
     vmd0002_eq2,
     vmd0002_eq3,
     vmd0002_eq4,
-    vmd0002_eq7,
-    vmd0002_eq8a,
+    vmd0002_eq7_eq8a,
     vmd0002_eq8b,
     vmd0002_eq9,
-    get_solid_diamter,
     calculate_tree_height,
-    allometric_tropical_tree,
-    allometric_peatland_tree,
+    class_density,
 )
+from src.allometry import allometric_by_strata
+from src.outliers import handle_outliers
+from src.aggregation import GroupIndex
+from src.cache import TableCache, cache_key
+from src.height_models import calculate_local_tree_height
 
 # %%
 # Variables
-PLOT_INFO_CSV = CARBON_POOLS_OUTDIR / "plot_info.csv"
-STUMPS_CSV = CARBON_POOLS_OUTDIR / "stumps.csv"
-LDW_CSV = CARBON_POOLS_OUTDIR / "lying_deadwood_wo_hollow.csv"
-LDW_HOLLOW_CSV = CARBON_POOLS_OUTDIR / "lying_deadwood_hollow.csv"
-DEAD_TREES_CSV = CARBON_POOLS_OUTDIR / "dead_trees.csv"
+# Partition filters for the carbon pool tables, e.g. [("campaign", "=", "763932")]
+POOL_FILTERS = None
+
+# Processing Conditions
+# Class 1 dead trees use the same DBH outlier strategy as the living trees
+OUTLIER_REMOVAL = "get_ave"  # Options: "get_ave", "drop_outliers", "eq_150", "percentile", "mad"
+# Use the height-diameter models fitted per strata in the height models notebook (00_height_models)
+# instead of Feldpausch for the class 1 dead trees
+USE_LOCAL_HEIGHT_MODELS = False
+HEIGHT_MODELS_CSV = TMP_OUT_DIR / "height_models.csv"
 
 # Temporary Output Files
 tmp_dead_trees_c1 = TMP_OUT_DIR / "c1_dead_trees.csv"
 tmp_dead_trees_c1_wd = TMP_OUT_DIR / "c1_dead_trees_wd.csv"
 
 # BigQuery Variables
-SRC_DATASET_ID = "biomass_inventory"
 DATASET_ID = "carbon_stock"
 IF_EXISTS = "replace"
 
@@ -78,17 +86,7 @@ IF_EXISTS = "replace"
 # ### Plot Data
 
 # %%
-if PLOT_INFO_CSV.exists():
-    plot_info = pd.read_csv(PLOT_INFO_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.plot_info"""
-
-    # Read the BigQuery table into a dataframe
-    plot_info = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    plot_info.to_csv(PLOT_INFO_CSV, index=False)
+plot_info = load_table("plot_info", filters=POOL_FILTERS)
 
 # %%
 plot_info.info()
@@ -111,17 +109,7 @@ plot_info_subset_dict = plot_info_subset.to_dict(orient="records")
 # ### Stumps
 
 # %%
-if STUMPS_CSV.exists():
-    stumps = pd.read_csv(STUMPS_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{DATASET_ID}.stumps"""
-
-    # Read the BigQuery table into a dataframe
-    stumps = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    stumps.to_csv(STUMPS_CSV, index=False)
+stumps = load_table("stumps", filters=POOL_FILTERS)
 
 # %%
 stumps.info()
@@ -130,33 +118,13 @@ stumps.info()
 # ### Lying deadwood
 
 # %%
-if LDW_CSV.exists():
-    ldw = pd.read_csv(LDW_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.lying_deadwood_wo_hollow"""
-
-    # Read the BigQuery table into a dataframe
-    ldw = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    ldw.to_csv(LDW_CSV, index=False)
+ldw = load_table("lying_deadwood_wo_hollow", filters=POOL_FILTERS)
 
 # %%
 ldw.info()
 
 # %%
-if LDW_HOLLOW_CSV.exists():
-    ldw_hollow = pd.read_csv(LDW_HOLLOW_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.lying_deadwood_hollow"""
-
-    # Read the BigQuery table into a dataframe
-    ldw_hollow = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    ldw_hollow.to_csv(LDW_HOLLOW_CSV, index=False)
+ldw_hollow = load_table("lying_deadwood_hollow", filters=POOL_FILTERS)
 
 # %%
 ldw_hollow.info()
@@ -165,17 +133,7 @@ ldw_hollow.info()
 # ### Standing Deadwood
 
 # %%
-if DEAD_TREES_CSV.exists():
-    dead_trees = pd.read_csv(DEAD_TREES_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.dead_trees"""
-
-    # Read the BigQuery table into a dataframe
-    dead_trees = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    dead_trees.to_csv(DEAD_TREES_CSV, index=False)
+dead_trees = load_table("dead_trees", filters=POOL_FILTERS)
 
 # %%
 dead_trees.info()
@@ -224,43 +182,28 @@ stumps.head(2)
 # %%
 # get wood density equivalent for each density class
 
-density_val = {1: 0.54, 2: 0.35, 3: 0.21}
-stumps["stump_density_val"] = stumps["stump_density"].replace(density_val).fillna(0.21)
+# see DENSITY_CLASSES in src/biomass_equations.py
+stumps["stump_density_val"] = class_density(stumps["stump_density"])
 
 # %%
 # convert height from cm to m
 stumps["height_m"] = stumps["height"] / 100
 
 # %%
-# Get biomass for each stump
-stumps = vmd0002_eq2(stumps, "Diam1", "Diam2", "height_m", "stump_density_val")
-
-# %%
-# Get biomass of each stump that is hollow
-stumps_hollow = vmd0002_eq2(
-    stumps, "hollow_d1", "hollow_d2", "height_m", "stump_density_val"
-)
-
-# %%
-# Get biomass to subtract due to hollow stumps
-stumps["tonnes_dry_matter_hollow"] = stumps_hollow["tonnes_dry_matter"]
-
-# %%
-# Subtract biomass of hollow stumps from total biomass
-stumps["tonnes_dry_matter"] = np.where(
-    (~stumps["tonnes_dry_matter_hollow"].isna())
-    & (stumps["tonnes_dry_matter_hollow"] > 0),
-    stumps["tonnes_dry_matter"] - stumps["tonnes_dry_matter_hollow"],
-    stumps["tonnes_dry_matter"],
+# Get biomass for each stump, less the biomass of the hollow for hollow stumps
+stumps = vmd0002_eq2(
+    stumps,
+    "Diam1",
+    "Diam2",
+    "height_m",
+    "stump_density_val",
+    hollow_base_diameter_col="hollow_d1",
+    hollow_top_diameter_col="hollow_d2",
 )
 
 # %%
 stumps.describe()
 
-# %%
-# Remove biomass_hollow column to avoid confusion
-stumps.drop(columns=["tonnes_dry_matter_hollow"], inplace=True)
-
 # %%
 stumps.head(2)
 
@@ -331,10 +274,8 @@ ldw.describe()
 ldw = ldw[ldw["diameter"] <= 150]
 
 # %%
-ldw = vmd0002_eq7(ldw, "diameter", 80)
-
-# %%
-ldw = vmd0002_eq8a(ldw, "density")
+# deadwood volume and dry matter per hectare in one pass
+ldw = vmd0002_eq7_eq8a(ldw, "diameter", "density", 80)
 
 # %%
 ldw.head(2)
@@ -343,13 +284,10 @@ ldw.head(2)
 # ## Hollow Lying Deadwood
 
 # %%
-ldw_hollow = get_solid_diamter(ldw_hollow, "hollow_d1", "hollow_d2", "diameter")
-
-# %%
-ldw_hollow = vmd0002_eq7(ldw_hollow, "solid_diameter", 80)
-
-# %%
-ldw_hollow = vmd0002_eq8a(ldw_hollow, "density")
+# solid diameter, deadwood volume and dry matter per hectare in one pass
+ldw_hollow = vmd0002_eq7_eq8a(
+    ldw_hollow, "diameter", "density", 80, hollow_diameter_cols=["hollow_d1", "hollow_d2"]
+)
 
 # %%
 ldw_hollow.head(2)
@@ -419,11 +357,21 @@ c1_dead_trees["wood_density"] = 0.64
 # ### Get genus and wood density using BIOMASS R Library
 
 # %%
-# !Rscript $SRC_DIR"/get_wood_density.R" $tmp_dead_trees_c1 $tmp_dead_trees_c1_wd
-
-# %%
-if tmp_dead_trees_c1_wd.exists():
-    c1_dead_trees = pd.read_csv(tmp_dead_trees_c1_wd)
+# cached by the contents of the class 1 dead trees and the R script, see src/cache.py
+intermediate_cache = TableCache()
+wood_density_key = cache_key(
+    "c1_dead_trees_wd", tmp_dead_trees_c1, SRC_DIR / "get_wood_density.R"
+)
+cached = intermediate_cache.get(wood_density_key)
+if cached is None:
+    # raises if the lookup fails, so an older tmp_dead_trees_c1_wd is never cached under this key
+    subprocess.run(
+        ["Rscript", SRC_DIR / "get_wood_density.R", tmp_dead_trees_c1, tmp_dead_trees_c1_wd],
+        check=True,
+    )
+    cached = pd.read_csv(tmp_dead_trees_c1_wd)
+    intermediate_cache.put(wood_density_key, cached, "c1_dead_trees_wd")
+c1_dead_trees = cached
 
 # %%
 c1_dead_trees
@@ -431,6 +379,11 @@ c1_dead_trees
 # %%
 c1_dead_trees["wood_density"] = np.nan
 
+# %%
+# see OUTLIER_STRATEGIES in src/outliers.py
+c1_dead_trees, outlier_report = handle_outliers(c1_dead_trees, OUTLIER_REMOVAL, "DBH_cl1")
+outlier_report
+
 # %%
 c1_dead_trees = calculate_tree_height(c1_dead_trees, "DBH_cl1")
 
@@ -440,26 +393,18 @@ c1_dead_trees = c1_dead_trees.merge(
 )
 
 # %%
-c1_dead_trees_tropical = c1_dead_trees.loc[
-    c1_dead_trees["Strata"].isin([1, 2, 3])
-].copy()
+if USE_LOCAL_HEIGHT_MODELS:
+    # locally fitted height-diameter models, see 00_height_models
+    c1_dead_trees = calculate_local_tree_height(
+        c1_dead_trees, "DBH_cl1", pd.read_csv(HEIGHT_MODELS_CSV), copy=False
+    )
 
 # %%
-c1_dead_trees_tropical = allometric_tropical_tree(
-    c1_dead_trees_tropical, "wood_density", "DBH_cl1", "height"
+# allometric model per strata, see STRATA_ALLOMETRY in src/allometry.py
+c1_dead_trees = allometric_by_strata(
+    c1_dead_trees, "Strata", "DBH_cl1", "wood_density", "height", copy=False
 )
 
-# %%
-c1_dead_trees_peatland = c1_dead_trees.loc[
-    c1_dead_trees["Strata"].isin([4, 5, 6])
-].copy()
-
-# %%
-c1_dead_trees_peatland = allometric_peatland_tree(c1_dead_trees_peatland, "DBH_cl1")
-
-# %%
-c1_dead_trees = pd.concat([c1_dead_trees_tropical, c1_dead_trees_peatland])
-
 # %%
 if "X" in c1_dead_trees.columns:
     c1_dead_trees.drop(columns=["X"], inplace=True)
@@ -488,26 +433,23 @@ c2_dead_trees_t = dead_trees.loc[
 ].copy()
 
 # %%
-# convert slope to radians
-c2_dead_trees_t["slope_t_tall_radians"] = np.atan(c2_dead_trees_t["slope_t_tall"]) / 100
-c2_dead_trees_t["slope_b_tall_radians"] = np.atan(c2_dead_trees_t["slope_b_tall"]) / 100
-
-# %%
-# estimate tree height
+# estimate tree height from the distance and the slopes (%) to the top and base of the tree;
+# impossible geometries (e.g. top below base) give NaN
 c2_dead_trees_t = calculate_tree_height(
     c2_dead_trees_t,
     trig_leveling=True,
     dist_col="dist_t_tall",
-    slope_b_col="slope_b_tall_radians",
-    slope_t_col="slope_t_tall_radians",
+    slope_b_col="slope_b_tall",
+    slope_t_col="slope_t_tall",
+    slope_units="percent",
 )
 
+# %%
+c2_dead_trees_t["height"].isna().sum()
+
 # %%
 # set wood density equivalent for each density class
-density_val = {1: 0.54, 2: 0.35, 3: 0.21}
-c2_dead_trees_t["density_val"] = (
-    c2_dead_trees_t["tall_density"].replace(density_val).fillna(0.21)
-)
+c2_dead_trees_t["density_val"] = class_density(c2_dead_trees_t["tall_density"])
 
 # %%
 c2_dead_trees_t = vmd0002_eq1(c2_dead_trees_t, "db_tall", "height", "density_val")
@@ -532,7 +474,11 @@ sdw_all.head(2)
 # ## get total standing deadwood biomass 
 
 # %%
-sdw_all_agg = vmd0002_eq3(sdw_all, ["unique_id", "nest"], "tonnes_dry_matter")
+# the dry matter and the stems per nest are reduced with the same index, so the keys of the
+# standing dead trees are only sorted once
+sdw_index = GroupIndex(sdw_all, ["unique_id", "nest"])
+sdw_all_agg = vmd0002_eq3(sdw_all, ["unique_id", "nest"], "tonnes_dry_matter", sdw_index)
+sdw_all_agg["stems"] = sdw_index.count()
 
 # %%
 # add the correct area using the unique_id and nest number
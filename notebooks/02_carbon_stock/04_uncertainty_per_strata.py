@@ -20,6 +20,7 @@
 
 # %%
 # Standard Imports
+import datetime
 import sys
 import pandas as pd
 
@@ -33,28 +34,42 @@ from src.settings import (
     GCP_PROJ_ID,
     CARBON_STOCK_OUTDIR,
     CARBON_POOLS_OUTDIR,
+    PARQUET_DATA_DIR,
     PC_PLOT_LOOKUP_CSV,
+    TMP_OUT_DIR,
+)
+from src.duckdb_utils import create_default_connection, strata_areas
+from src.loaders import load_table
+
+from src.uncertainty import (
+    StatisticsCube,
+    bootstrap_statistics,
+    propagate_pool_uncertainty,
+    stratified_totals,
 )
-
-from src.biomass_equations import calculate_statistics
 
 # %%
-import datetime
-
 # Variables
-PLOT_INFO_CSV = CARBON_POOLS_OUTDIR / "plot_info.csv"
-LITTER_CSV = CARBON_STOCK_OUTDIR / "litter_carbon_stock.csv"
-NTV_CSV = CARBON_STOCK_OUTDIR / "ntv_carbon_stock.csv"
-DEADWOOD_CSV = CARBON_STOCK_OUTDIR / "deadwood_carbon_stock.csv"
-TREES_CSV = CARBON_STOCK_OUTDIR / "trees_carbon_stock.csv"
 SAPLINGS_CSV = CARBON_POOLS_OUTDIR / "saplings_carbon_stock.csv"
+# Partition filters for the carbon pool tables, e.g. [("campaign", "=", "763932")]
+POOL_FILTERS = None
+
+# Bootstrap confidence intervals
+N_BOOTSTRAP = 2000
+BOOTSTRAP_SEED = 42
+
+# Activity area database with the activity area and strata tables, see the activity area notebooks
+ACTIVITY_AREA_DB = TMP_OUT_DIR / "activity_area.db"
+# Strata of the area tables to the inventory strata, e.g. {"pre_strata_1": 1}. If None, the
+# number in the area strata label, as in the plot strata lookup
+STRATA_MAP = None
 
 # Version Control
 today = datetime.date.today()
 VERSION = today.strftime("%Y%m%d")
+STATISTICS_CUBE_PARQUET = PARQUET_DATA_DIR / f"plot_statistics_cube_{VERSION}.parquet"
 
 # BigQuery Variables
-SRC_DATASET_ID = "biomass_inventory"
 DATASET_ID = "carbon_stock"
 IF_EXISTS = "replace"
 
@@ -65,17 +80,7 @@ IF_EXISTS = "replace"
 # ### Plot Data
 
 # %%
-if PLOT_INFO_CSV.exists():
-    plot_info = pd.read_csv(PLOT_INFO_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.plot_info"""
-
-    # Read the BigQuery table into a dataframe
-    plot_info = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    plot_info.to_csv(PLOT_INFO_CSV, index=False)
+plot_info = load_table("plot_info", filters=POOL_FILTERS)
 
 # %%
 plot_info.info()
@@ -96,17 +101,7 @@ plot_info = pd.merge(plot_info, plot_info_lookup, on="unique_id", how="left")
 # ### Trees
 
 # %%
-if TREES_CSV.exists():
-    trees = pd.read_csv(TREES_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.trees_carbon_stock"""
-
-    # Read the BigQuery table into a dataframe
-    trees = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    trees.to_csv(TREES_CSV, index=False)
+trees = load_table("trees_carbon_stock")
 
 # %%
 trees.info()
@@ -115,17 +110,7 @@ trees.info()
 # ### Deadwood
 
 # %%
-if DEADWOOD_CSV.exists():
-    deadwood = pd.read_csv(DEADWOOD_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.deadwood_carbon_stock"""
-
-    # Read the BigQuery table into a dataframe
-    deadwood = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    deadwood.to_csv(DEADWOOD_CSV, index=False)
+deadwood = load_table("deadwood_carbon_stock")
 
 # %%
 deadwood.info()
@@ -134,17 +119,7 @@ deadwood.info()
 # ### Litter
 
 # %%
-if LITTER_CSV.exists():
-    litter = pd.read_csv(LITTER_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.litter_carbon_stock"""
-
-    # Read the BigQuery table into a dataframe
-    litter = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    litter.to_csv(LITTER_CSV, index=False)
+litter = load_table("litter_carbon_stock")
 
 # %%
 litter.info()
@@ -153,17 +128,7 @@ litter.info()
 # ### Non-tree Vegetation
 
 # %%
-if NTV_CSV.exists():
-    ntv = pd.read_csv(NTV_CSV)
-else:
-    query = f"""
-    SELECT
-        * 
-    FROM {GCP_PROJ_ID}.{SRC_DATASET_ID}.ntv_carbon_stock"""
-
-    # Read the BigQuery table into a dataframe
-    ntv = pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
-    ntv.to_csv(NTV_CSV, index=False)
+ntv = load_table("ntv_carbon_stock")
 
 # %%
 ntv.info()
@@ -277,33 +242,30 @@ columns = [
     "litter_CO2e_per_ha",
 ]
 
-results_list = []
+# statistics of every strata and carbon pool in one pass, with bootstrap (percentile and BCa) intervals
+results_df = bootstrap_statistics(
+    data,
+    columns,
+    by="Strata",
+    weight="subplot_count",
+    n_resamples=N_BOOTSTRAP,
+    seed=BOOTSTRAP_SEED,
+)
 
-for strata, group in data.groupby("Strata"):
-    for column in columns:
-        stats = calculate_statistics(group, column)
-        stats["Strata"] = strata
-        stats["tCO2e_per_ha"] = column.split("_")[0]
-        results_list.append(stats)
+# %% [markdown]
+# ### Sufficient statistics cube
+# The weighted sums per plot and pool, so that added or re-assigned plots and merged strata can be
+# summarized without re-running this notebook, e.g.
+# `cube.remove(old_plots).add(new_plots).regroup("Strata", {"Strata": {5: 4}}).statistics()`
 
-results_df = pd.DataFrame(results_list)
+# %%
+cube = StatisticsCube.from_frame(
+    data, ["Strata", "plot_code_nmbr"], columns, weight="subplot_count"
+)
+cube.to_parquet(STATISTICS_CUBE_PARQUET)
 
-# Reordering columns for better readability
-results_df = results_df[
-    [
-        "Strata",
-        "tCO2e_per_ha",
-        "weighted_mean",
-        "confidence_interval_lower",
-        "confidence_interval_upper",
-        "uncertainty_90",
-        "uncertainty_95",
-        "margin_of_error",
-        "weighted_std",
-        "standard_error",
-        "standard_error_perc_mean",
-    ]
-]
+# %%
+cube.regroup("Strata").statistics().head(2)
 
 # %%
 results_df.head(2)
@@ -322,6 +284,10 @@ results_df[
         "uncertainty_90",
         "uncertainty_95",
         "standard_error_perc_mean",
+        "percentile_ci_lower",
+        "percentile_ci_upper",
+        "bca_ci_lower",
+        "bca_ci_upper",
     ]
 ]
 
@@ -336,21 +302,107 @@ columns = [
     "ntv_CO2e_per_ha",
     "litter_CO2e_per_ha",
 ]
-data["all_CO2e_per_ha"] = data[columns].sum(axis=1)
 
 # %%
-strata_list = []
+# uncertainty of the total from the covariance of the pools, with the variance contribution of each pool
+strata_df, pool_contributions = propagate_pool_uncertainty(
+    data, columns, by="Strata", weight="subplot_count"
+)
+
+# %%
+strata_df
+
+# %%
+pool_contributions
+
+# %%
+strata_df = strata_df.merge(plot_count)
+
+# %%
+strata_df.info()
+
+# %% [markdown]
+# ## Export data and Upload to BQ
+
+# %%
+# Upload to BQ
+if len(plot_CO2e_ha) != 0:
+    plot_CO2e_ha.to_csv(
+        CARBON_STOCK_OUTDIR / f"plot_emission_factors_{VERSION}.csv", index=False
+    )
+    pandas_gbq.to_gbq(
+        plot_CO2e_ha,
+        f"{DATASET_ID}.plot_emission_factors_{VERSION}",
+        project_id=GCP_PROJ_ID,
+        if_exists=IF_EXISTS,
+        progress_bar=True,
+    )
+else:
+    raise ValueError("Dataframe is empty.")
+
+# %% [markdown]
+# # Create Strata Level Summary
+
+# %%
+CO2e_ha_cols = plot_CO2e_ha.filter(like="CO2e_per_ha").columns
+subset_cols = CO2e_ha_cols.insert(0, ["plot_code_nmbr", "Strata", "subplot_count"])
+
+# %%
+data = plot_CO2e_ha[subset_cols].copy()
+
+# %%
+data.rename(
+    columns={"total_aboveground_CO2e_per_ha": "aboveground_CO2e_per_ha"}, inplace=True
+)
+
+# %%
+data.head(2)
+
+# %%
+plot_count = data.groupby("Strata")["plot_code_nmbr"].count().reset_index()
+
+# %%
+columns = [
+    "belowground_CO2e_per_ha",
+    "aboveground_CO2e_per_ha",
+    "deadwood_CO2e_per_ha",
+    "ntv_CO2e_per_ha",
+    "litter_CO2e_per_ha",
+]
+
+# statistics of every strata and carbon pool in one pass, with bootstrap (percentile and BCa) intervals
+results_df = bootstrap_statistics(
+    data,
+    columns,
+    by="Strata",
+    weight="subplot_count",
+    n_resamples=N_BOOTSTRAP,
+    seed=BOOTSTRAP_SEED,
+)
+
+# %% [markdown]
+# ### Sufficient statistics cube
+# The weighted sums per plot and pool, so that added or re-assigned plots and merged strata can be
+# summarized without re-running this notebook, e.g.
+# `cube.remove(old_plots).add(new_plots).regroup("Strata", {"Strata": {5: 4}}).statistics()`
+
+# %%
+cube = StatisticsCube.from_frame(
+    data, ["Strata", "plot_code_nmbr"], columns, weight="subplot_count"
+)
+cube.to_parquet(STATISTICS_CUBE_PARQUET)
+
+# %%
+cube.regroup("Strata").statistics().head(2)
 
-for strata, group in data.groupby("Strata"):
-    stats = calculate_statistics(group, "all_CO2e_per_ha")
-    stats["Strata"] = strata
-    stats["tCO2e_per_ha"] = column.split("_")[0]
-    strata_list.append(stats)
+# %%
+results_df.head(2)
 
-strata_df = pd.DataFrame(strata_list)
+# %%
+results_df.sort_values(by=["Strata", "tCO2e_per_ha"], inplace=True)
 
-# Reordering columns for better readability
-strata_df = strata_df[
+# %%
+results_df[
     [
         "Strata",
         "tCO2e_per_ha",
@@ -359,22 +411,72 @@ strata_df = strata_df[
         "confidence_interval_upper",
         "uncertainty_90",
         "uncertainty_95",
-        "margin_of_error",
-        "weighted_std",
-        "standard_error",
         "standard_error_perc_mean",
+        "percentile_ci_lower",
+        "percentile_ci_upper",
+        "bca_ci_lower",
+        "bca_ci_upper",
     ]
 ]
 
+# %% [markdown]
+# ## Get confidence by Strata
+
+# %%
+columns = [
+    "belowground_CO2e_per_ha",
+    "aboveground_CO2e_per_ha",
+    "deadwood_CO2e_per_ha",
+    "ntv_CO2e_per_ha",
+    "litter_CO2e_per_ha",
+]
+
+# %%
+# uncertainty of the total from the covariance of the pools, with the variance contribution of each pool
+strata_df, pool_contributions = propagate_pool_uncertainty(
+    data, columns, by="Strata", weight="subplot_count"
+)
+
 # %%
 strata_df
 
+# %%
+pool_contributions
+
 # %%
 strata_df = strata_df.merge(plot_count)
 
 # %%
 strata_df.info()
 
+# %% [markdown]
+# ## Project totals
+# Area-weighted totals per CADT and eligibility type, and for the whole project, with the
+# combined standard error of the strata.
+
+# %%
+db = create_default_connection(str(ACTIVITY_AREA_DB))
+areas = strata_areas(db).rename(columns={"strata": "Strata"})
+areas.head(2)
+
+# %%
+if STRATA_MAP is None:
+    strata_labels = pd.Series(areas["Strata"].unique())
+    strata_numbers = strata_labels.str.extract(r"(\d+)", expand=False)
+    # labels without a number are left unmapped, so stratified_totals reports them
+    STRATA_MAP = {
+        label: int(number)
+        for label, number in zip(strata_labels, strata_numbers)
+        if pd.notna(number)
+    }
+STRATA_MAP
+
+# %%
+project_totals = stratified_totals(
+    pd.concat([results_df, strata_df], ignore_index=True), areas, strata_map=STRATA_MAP
+)
+project_totals[project_totals["CADT"] == "all"]
+
 # %% [markdown]
 # ## Export data and Upload to BQ
 
@@ -393,3 +495,43 @@ if len(results_df) != 0:
     )
 else:
     raise ValueError("Dataframe is empty.")
+
+# %% [markdown]
+# ## Project totals
+# Area-weighted totals per CADT and eligibility type, and for the whole project, with the
+# combined standard error of the strata. Needs the activity area database written by the
+# activity area notebooks (notebooks/00_eda), so it is skipped where they have not been run.
+
+# %%
+if ACTIVITY_AREA_DB.exists():
+    db = create_default_connection(str(ACTIVITY_AREA_DB))
+    areas = strata_areas(db).rename(columns={"strata": "Strata"})
+    db.close()
+else:
+    areas = None
+    print(f"{ACTIVITY_AREA_DB} not found, skipping the project totals.")
+
+# %%
+if areas is not None:
+    if STRATA_MAP is None:
+        strata_labels = pd.Series(areas["Strata"].unique())
+        strata_numbers = strata_labels.str.extract(r"(\d+)", expand=False)
+        # labels without a number are left unmapped, so stratified_totals reports them
+        STRATA_MAP = {
+            label: int(number)
+            for label, number in zip(strata_labels, strata_numbers)
+            if pd.notna(number)
+        }
+
+    project_totals = stratified_totals(
+        pd.concat([results_df, strata_df], ignore_index=True), areas, strata_map=STRATA_MAP
+    )
+    project_totals.to_csv(CARBON_STOCK_OUTDIR / f"project_totals_{VERSION}.csv", index=False)
+    pandas_gbq.to_gbq(
+        project_totals,
+        f"{DATASET_ID}.project_totals_{VERSION}",
+        project_id=GCP_PROJ_ID,
+        if_exists=IF_EXISTS,
+        progress_bar=True,
+    )
+    display(project_totals[project_totals["CADT"] == "all"])
@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """
+    Factorized group keys of a table, e.g. ["unique_id", "nest"], built once and reused by
+    every aggregation of that table.
+
+    Groups are sorted and rows with a missing key are left out, like
+    `df.groupby(keys).sum()`. Missing values are skipped in the reductions.
+
+    Parameters:
+    - df (pd.DataFrame): The table to group.
+    - keys (list): The key columns.
+    - mask (array-like, optional): Boolean array of the rows to include. Defaults to all rows.
+    """
+
+    def __init__(self, df: pd.DataFrame, keys: list, mask=None):
+        self.keys = list(keys)
+        self.n_rows = len(df)
+        self._key_columns = [df[key] for key in self.keys]
+        self._key_buffers = [_buffers(column) for column in self._key_columns]
+
+        valid = np.ones(len(df), dtype=bool) if mask is None else np.array(mask, dtype=bool)
+        key_codes, key_values = [], []
+        for key in self.keys:
+            codes, uniques = pd.factorize(df[key], sort=True)
+            key_codes.append(codes)
+            key_values.append(uniques)
+            valid &= codes >= 0
+
+        # combined key over the observed combinations, sorted like the key columns
+        shape = [len(uniques) for uniques in key_values]
+        all_valid = valid.all()
+        combined = np.ravel_multi_index(
+            [codes if all_valid else codes[valid] for codes in key_codes], shape
+        )
+        n_combinations = int(np.prod(shape, dtype=np.int64))
+        if n_combinations <= 4 * max(len(combined), 1):
+            # dense keys, e.g. subplots x nests: renumber the observed combinations with a bincount
+            present = np.bincount(combined, minlength=n_combinations) > 0
+            group_keys = np.flatnonzero(present)
+            group_codes = (np.cumsum(present) - 1)[combined]
+        else:
+            group_codes, group_keys = pd.factorize(combined, sort=True)
+        group_key_codes = np.unravel_index(group_keys, shape)
+
+        self.codes = np.full(len(df), -1, dtype=np.intp)
+        self.codes[valid] = group_codes
+        self.valid = None if all_valid else valid
+        self.n_groups = len(group_keys)
+        self.key_frame = pd.DataFrame(
+            {
+                key: uniques.take(codes)
+                for key, uniques, codes in zip(self.keys, key_values, group_key_codes)
+            }
+        )
+
+        self._group_codes = group_codes
+        self._sorted_rows = None
+
+    def _values(self, values) -> np.ndarray:
+        values = np.asarray(values)
+        if len(values) != self.n_rows:
+            raise ValueError(
+                f"Expected {self.n_rows} values to match the grouped table, got {len(values)}."
+            )
+        return values if self.valid is None else values[self.valid]
+
+    def _reduceat_order(self):
+        # row order and group boundaries for np.add.reduceat, only built when needed
+        if self._sorted_rows is None:
+            self._sorted_rows = np.argsort(self._group_codes, kind="stable")
+            self._starts = np.searchsorted(
+                self._group_codes[self._sorted_rows], np.arange(self.n_groups)
+            )
+        return self._sorted_rows, self._starts
+
+    def sum(self, values, dtype=None) -> np.ndarray:
+        """
+        Sums `values` per group, skipping missing values.
+
+        Parameters:
+        - values (array-like): One value per row, or a 2D array with one column per variable.
+        - dtype (optional): The dtype of the sums. Defaults to the dtype of `values`;
+          1D float values are accumulated in float64 either way.
+
+        Returns:
+        - np.ndarray: The sum of each group, in the order of `key_frame`.
+        """
+        values = self._values(values)
+        dtype = values.dtype if dtype is None else dtype
+        if self.n_groups == 0:
+            return np.zeros((0,) + values.shape[1:], dtype=dtype)
+
+        if values.ndim == 1 and values.dtype.kind == "f":
+            sums = np.bincount(
+                self._group_codes, np.nan_to_num(values), minlength=self.n_groups
+            )
+            return sums.astype(dtype, copy=False)
+
+        sorted_rows, starts = self._reduceat_order()
+        rows = values[sorted_rows].astype(dtype, copy=False)
+        if rows.dtype.kind == "f":
+            rows = np.nan_to_num(rows, copy=False)
+        return np.add.reduceat(rows, starts, axis=0)
+
+    def count(self, values=None) -> np.ndarray:
+        """
+        Counts the rows of each group, or the non-missing `values` of each group.
+        """
+        weights = None if values is None else pd.notna(self._values(values))
+        return np.bincount(self._group_codes, weights, minlength=self.n_groups).astype(np.int64)
+
+    def mean(self, values) -> np.ndarray:
+        """
+        Averages `values` per group, skipping missing values. Groups without values give NaN.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 2:
+            counts = np.column_stack([self.count(column) for column in values.T])
+        else:
+            counts = self.count(values)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.sum(values) / counts
+
+    def quantile(self, values, q: float = 0.5) -> np.ndarray:
+        """
+        The `q` quantile of `values` per group with linear interpolation, like
+        `df.groupby(keys).quantile(q)`. Missing values are skipped; groups without values give NaN.
+        """
+        values = self._values(values).astype(np.float64)
+        if len(values) == 0:
+            return np.full(self.n_groups, np.nan)
+        present = ~np.isnan(values)
+        counts = np.bincount(self._group_codes, present, minlength=self.n_groups).astype(np.int64)
+
+        # sort by group, then value; NaN sorts after the values of its group
+        order = np.lexsort((values, self._group_codes))
+        sorted_values = values[order]
+        starts = np.searchsorted(self._group_codes[order], np.arange(self.n_groups))
+
+        position = np.maximum(counts - 1, 0) * q
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, np.maximum(counts - 1, 0))
+        low = sorted_values[np.minimum(starts + lower, len(sorted_values) - 1)]
+        high = sorted_values[np.minimum(starts + upper, len(sorted_values) - 1)]
+
+        return np.where(counts > 0, low + (high - low) * (position - lower), np.nan)
+
+    def aggregate(self, df: pd.DataFrame, value_cols: list, func: str = "sum") -> pd.DataFrame:
+        """
+        Reduces several columns of the grouped table at once.
+
+        Parameters:
+        - df (pd.DataFrame): The table the index was built from.
+        - value_cols (list): The columns to reduce.
+        - func (str, optional): "sum", "mean" or "count". Defaults to "sum".
+
+        Returns:
+        - pd.DataFrame: The key columns followed by the reduced columns, one row per group.
+        """
+        if func not in ("sum", "mean", "count"):
+            raise ValueError(f"Unknown aggregation '{func}'. Use 'sum', 'mean' or 'count'.")
+
+        result = self.key_frame.copy()
+        dtypes = df[value_cols].dtypes
+        if func == "sum" and dtypes.nunique() == 1 and len(value_cols) > 1:
+            # one reduceat over all columns of the same dtype
+            sums = self.sum(df[value_cols].to_numpy())
+            for i, col in enumerate(value_cols):
+                result[col] = sums[:, i]
+        else:
+            for col in value_cols:
+                result[col] = getattr(self, func)(df[col].to_numpy())
+
+        return result
+
+    def check(self, df: pd.DataFrame, keys: list) -> None:
+        """
+        Raises a ValueError if the index was not built on the same `keys` values as `df`.
+
+        The key columns of a table derived from the indexed one without changing them (e.g. with
+        new columns) share its arrays, so the check is usually a comparison of array addresses.
+        Only other arrays (e.g. a copied or rebuilt table) are compared by value.
+        """
+        if list(keys) != self.keys or len(df) != self.n_rows:
+            raise ValueError(
+                f"The group index was built on {self.keys} of {self.n_rows} rows, "
+                f"not {list(keys)} of {len(df)} rows."
+            )
+        for key, column, buffers in zip(self.keys, self._key_columns, self._key_buffers):
+            if buffers is not None and _buffers(df[key]) == buffers:
+                continue
+            if not df[key].reset_index(drop=True).equals(column.reset_index(drop=True)):
+                raise ValueError(
+                    f"The group index was built on other {self.keys} values than those of this table."
+                )
+
+
+def _buffers(column: pd.Series):
+    # the memory a column reads from: the buffers, offsets and lengths of its arrow chunks, or the
+    # address, strides and shape of its numpy array. None for the other arrays (e.g. categorical),
+    # whose values are converted on access, so their addresses say nothing about their contents
+    dtype = column.dtype
+    if isinstance(dtype, pd.ArrowDtype) or getattr(dtype, "storage", None) == "pyarrow":
+        return [
+            (chunk.offset, len(chunk), [buffer.address if buffer else 0 for buffer in chunk.buffers()])
+            for chunk in column.array.__arrow_array__().chunks
+        ]
+    if isinstance(dtype, np.dtype):
+        values = np.asarray(column.array)
+        return [(values.__array_interface__["data"][0], values.strides, values.shape, dtype.str)]
+    return None
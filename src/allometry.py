@@ -0,0 +1,127 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.biomass_equations import _as_array, agb_alibo2012, agb_chave2014
+
+# Registered allometric models: name -> kernel, the array inputs it takes and
+# any extra keyword parameters passed to the kernel
+ALLOMETRIC_MODELS = {}
+
+# Allometric model used for each strata
+STRATA_ALLOMETRY = {
+    1: "chave2014",
+    2: "chave2014",
+    3: "chave2014",
+    4: "alibo2012",
+    5: "alibo2012",
+    6: "alibo2012",
+}
+
+
+def register_allometric_model(name: str, func, inputs: list, **params) -> None:
+    """
+    Registers an aboveground biomass equation so it can be assigned to strata.
+
+    Parameters:
+    - name (str): The name used in strata mappings such as STRATA_ALLOMETRY.
+    - func (callable): An array kernel returning aboveground biomass in kg.
+    - inputs (list): The names of the arrays passed to `func`, in order. One of "dbh", "wood_density" or "height".
+    - params: Extra keyword parameters passed to `func`.
+    """
+    ALLOMETRIC_MODELS[name] = {"func": func, "inputs": inputs, "params": params}
+
+
+register_allometric_model("chave2014", agb_chave2014, ["wood_density", "height", "dbh"])
+register_allometric_model("alibo2012", agb_alibo2012, ["dbh"])
+
+
+def evaluate_allometry(
+    inputs: dict, strata, strata_models: dict = STRATA_ALLOMETRY, dtype=np.float64
+) -> np.ndarray:
+    """
+    Calculates aboveground biomass (kg) for every tree with the model assigned to its strata.
+
+    Each model is evaluated once on the trees of its strata, writing into a single output array.
+    Trees whose strata has no model get NaN and are reported with a warning instead of being dropped.
+
+    Parameters:
+    - inputs (dict): The tree arrays by input name, e.g. {"dbh": ..., "wood_density": ..., "height": ...}.
+      Values may also be callables returning the array, so inputs that no model uses are never computed.
+    - strata (array-like): The strata (or land cover class) of each tree.
+    - strata_models (dict, optional): The model name per strata. Defaults to STRATA_ALLOMETRY.
+    - dtype (optional): The float dtype of the computation, np.float64 or np.float32. Defaults to np.float64.
+
+    Returns:
+    - np.ndarray: The aboveground biomass of each tree in kg.
+    """
+    # look the models up per distinct strata rather than per tree
+    strata_codes, strata_values = pd.factorize(np.asarray(strata))
+    strata_model_names = pd.Series(strata_values).map(strata_models).to_numpy()
+
+    aboveground_biomass = np.full(len(strata_codes), np.nan, dtype=dtype)
+    resolved = {}
+    for name in pd.unique(strata_model_names[pd.notna(strata_model_names)]):
+        model = ALLOMETRIC_MODELS[name]
+        mask = np.isin(strata_codes, np.flatnonzero(strata_model_names == name))
+        args = []
+        for input_name in model["inputs"]:
+            if input_name not in resolved:
+                values = inputs[input_name]
+                values = values() if callable(values) else values
+                resolved[input_name] = _as_array(values, dtype)
+            args.append(resolved[input_name][mask])
+        aboveground_biomass[mask] = model["func"](*args, **model["params"])
+
+    unmatched_strata = np.flatnonzero(pd.isna(strata_model_names))
+    unmatched = (strata_codes == -1) | np.isin(strata_codes, unmatched_strata)
+    if unmatched.any():
+        missing = [str(value) for value in strata_values[unmatched_strata]]
+        missing = sorted(missing + ["nan"] if (strata_codes == -1).any() else missing)
+        warnings.warn(
+            f"{unmatched.sum()} trees have no allometric model for strata {missing}; "
+            "their aboveground biomass is NaN."
+        )
+
+    return aboveground_biomass
+
+
+def allometric_by_strata(
+    df: pd.DataFrame,
+    strata_col: str,
+    dbh_col: str,
+    wooddensity_col: str = None,
+    height_col: str = None,
+    strata_models: dict = STRATA_ALLOMETRY,
+    copy: bool = True,
+) -> pd.DataFrame:
+    """
+    Calculates the aboveground biomass of trees using the allometric model of their strata,
+    replacing the split by strata, separate allometric_tropical_tree / allometric_peatland_tree
+    calls and concat.
+
+    Parameters:
+    - df (pd.DataFrame): The input DataFrame containing tree data.
+    - strata_col (str): The column with the strata (or land cover class) of each tree.
+    - dbh_col (str): The column with the diameter at breast height in cm.
+    - wooddensity_col (str, optional): The column with wood density in g/cm3, required by Chave, et al. (2014).
+    - height_col (str, optional): The column with tree height in m, required by Chave, et al. (2014).
+    - strata_models (dict, optional): The model name per strata. Defaults to STRATA_ALLOMETRY.
+    - copy (bool, optional): If False, the column is added to `df` in place instead of a copy.
+
+    Returns:
+    - pd.DataFrame: The input DataFrame with an additional 'aboveground_biomass' column in kg,
+      float32 if the DBH column is float32.
+    """
+    columns = {"dbh": dbh_col, "wood_density": wooddensity_col, "height": height_col}
+    inputs = {name: (lambda col=col: df[col]) for name, col in columns.items() if col}
+
+    if copy:
+        df = df.copy()
+    dtype = np.float32 if df[dbh_col].dtype == np.float32 else np.float64
+    df["aboveground_biomass"] = evaluate_allometry(
+        inputs, df[strata_col], strata_models, dtype
+    )
+
+    return df
@@ -3,6 +3,181 @@ import pandas as pd
 from scipy.stats import t
 from scipy.stats import norm
 
+from src import kernel_backend
+from src.aggregation import GroupIndex
+
+
+# Array kernels
+# These take and return NumPy arrays so that the DataFrame functions below (and any
+# fused pipeline) can compute a single column without copying the whole table.
+# float32 inputs stay float32 (single precision mode), anything else runs in float64.
+# The chained expressions go through src.kernel_backend, which uses numba or numexpr if installed.
+def _as_array(values, dtype=None) -> np.ndarray:
+    if dtype is None:
+        dtype = np.float32 if getattr(values, "dtype", None) == np.float32 else np.float64
+    return np.asarray(values, dtype=dtype)
+
+
+def height_feldpausch(dbh, max_height: float = 30.0) -> np.ndarray:
+    """
+    Estimates tree height (m) from DBH (cm) using Feldpausch, et al. (2011):
+    Ht = 35.83 - 31.15 * exp(-0.029 * DBH), capped at `max_height`.
+    """
+    return kernel_backend.height_feldpausch(_as_array(dbh), max_height)
+
+
+def height_trigonometric(distance, slope_top, slope_base, slope_units: str = "percent") -> np.ndarray:
+    """
+    Height (m) of a standing tree from the horizontal distance (m) to the stem and the slopes
+    to its top and base, negative below the horizontal: H = distance * (tan(top) - tan(base)).
+
+    Slopes are in "percent" (as recorded by the clinometer in the ODK form), "degrees" or "radians".
+    Impossible geometries give NaN: a distance that is not positive, a top that is not above the
+    base, or an angle of 90 degrees or more.
+    """
+    distance = _as_array(distance)
+    slope_top, slope_base = _as_array(slope_top), _as_array(slope_base)
+    if slope_units == "percent":
+        tan_top, tan_base = slope_top / 100, slope_base / 100
+        valid = np.isfinite(tan_top) & np.isfinite(tan_base)
+    elif slope_units in ("degrees", "radians"):
+        right_angle = 90 if slope_units == "degrees" else np.pi / 2
+        valid = (np.abs(slope_top) < right_angle) & (np.abs(slope_base) < right_angle)
+        to_radians = np.pi / 180 if slope_units == "degrees" else 1
+        tan_top, tan_base = np.tan(slope_top * to_radians), np.tan(slope_base * to_radians)
+    else:
+        raise ValueError(
+            f"Unknown slope units '{slope_units}'. Use 'percent', 'degrees' or 'radians'."
+        )
+
+    height = distance * (tan_top - tan_base)
+    return np.where(valid & (distance > 0) & (height > 0), height, np.nan)
+
+
+def agb_chave2014(wood_density, height, dbh) -> np.ndarray:
+    """
+    Aboveground biomass (kg) of tropical trees using Chave, et al. (2014):
+    0.0673 * (wood density * height * DBH^2) ^ 0.976
+    """
+    wood_density, height, dbh = _as_array(wood_density), _as_array(height), _as_array(dbh)
+    return kernel_backend.agb_chave2014(wood_density, height, dbh)
+
+
+def agb_alibo2012(dbh) -> np.ndarray:
+    """
+    Aboveground biomass (kg) of peatland trees using Alibo, et al. (2012):
+    21.297 - 67.953 * DBH + 0.74 * DBH^2
+    """
+    dbh = _as_array(dbh)
+    return 21.297 - 67.953 * dbh + 0.74 * dbh**2
+
+
+def carbon(biomass, carbon_fraction: float = 0.47) -> np.ndarray:
+    """
+    Carbon stock from biomass and carbon fraction of dry matter.
+    """
+    return _as_array(biomass) * carbon_fraction
+
+
+def sapling_carbon(
+    count_saplings,
+    carbon_fraction: float = 0.47,
+    wc: float = 0.25,
+    avg_weight: float = 0.000184,
+) -> np.ndarray:
+    """
+    Carbon stock (tonnes) of saplings from the sapling count. Missing counts give 0.
+    """
+    sapling_c = _as_array(count_saplings) * avg_weight * wc * carbon_fraction
+    # only the missing counts, infinite values are kept as in fillna(0)
+    return np.nan_to_num(sapling_c, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+
+def belowground_carbon(carbon_stock, root_shoot_ratio: float = 0.36) -> np.ndarray:
+    """
+    Belowground carbon stock from the aboveground carbon stock and root-shoot ratio.
+    """
+    return _as_array(carbon_stock) * root_shoot_ratio
+
+
+def co2e(carbon_stock) -> np.ndarray:
+    """
+    Converts tonnes of carbon to tonnes of CO2 equivalent (44/12).
+    """
+    return _as_array(carbon_stock) * 44 / 12
+
+
+def cone_dry_matter(diameter, height, density) -> np.ndarray:
+    """
+    Dry matter (tonnes) of a standing dead tree approximated as a cone, diameter in cm.
+    """
+    diameter, height, density = _as_array(diameter), _as_array(height), _as_array(density)
+    return (1 / 3) * np.pi * (diameter / 200) ** 2 * height * density
+
+
+def stump_dry_matter(base_diameter, top_diameter, height, density) -> np.ndarray:
+    """
+    Dry matter (tonnes) of a stump from its base and top diameters in cm.
+    """
+    base_diameter, top_diameter = _as_array(base_diameter), _as_array(top_diameter)
+    return ((base_diameter + top_diameter) / 200) * _as_array(height) * _as_array(density)
+
+
+def dry_matter_co2e_per_ha(biomass_kg, water_content, carbon_fraction) -> np.ndarray:
+    """
+    CO2e per hectare of litter or non-tree vegetation from the wet biomass (kg) of a 0.25 m2 sample.
+    """
+    kg_dry_matter = _as_array(biomass_kg) * water_content
+    return co2e((10 / 0.25) * kg_dry_matter * carbon_fraction)
+
+
+def deadwood_volume(diameter, transect_l: int = 100) -> np.ndarray:
+    """
+    Lying deadwood volume from the diameter crossing a transect of length `transect_l`.
+    """
+    return _as_array(diameter) ** 2 / (8 * transect_l)
+
+
+# Wood density (g/cm3) of the deadwood density classes: 1 sound, 2 intermediate and 3 rotten
+DENSITY_CLASSES = {1: 0.54, 2: 0.35, 3: 0.21}
+DEFAULT_DENSITY = 0.21
+
+
+def density_class_table(
+    density_equivalent: dict = DENSITY_CLASSES, default_density: float = DEFAULT_DENSITY
+) -> np.ndarray:
+    """
+    Compiles a density class map into a lookup array indexed by the integer class code.
+    The last entry holds the default density, used for missing and unknown classes.
+    """
+    classes = np.array(list(density_equivalent), dtype=np.float64)
+    if ((classes < 0) | (classes != np.floor(classes))).any():
+        raise ValueError(
+            f"Density classes must be non-negative integers, got {list(density_equivalent)}."
+        )
+    table = np.full(int(classes.max(initial=-1)) + 2, default_density, dtype=np.float64)
+    table[classes.astype(np.intp)] = np.array(list(density_equivalent.values()), dtype=np.float64)
+
+    return np.where(np.isnan(table), default_density, table)
+
+
+def class_density(
+    classes,
+    density_equivalent: dict = DENSITY_CLASSES,
+    default_density: float = DEFAULT_DENSITY,
+) -> np.ndarray:
+    """
+    Wood density (g/cm3) of each deadwood density class, the default density for missing or
+    unknown classes. Float codes such as 1.0 are matched to their integer class.
+    """
+    table = density_class_table(density_equivalent, default_density)
+    codes = _as_array(classes)
+    # NaN fails every comparison, so it falls through to the default entry
+    known = (codes >= 0) & (codes < len(table) - 1) & (codes == np.floor(codes))
+    index = np.where(known, codes, len(table) - 1).astype(np.intp)
+
+    return np.take(table, index)
+
 
 # height model
 def calculate_tree_height(df: pd.DataFrame, 
@@ -10,10 +185,14 @@ def calculate_tree_height(df: pd.DataFrame,
                           trig_leveling: bool = False, 
                           dist_col: str = np.nan, 
                           slope_b_col: str = np.nan,
-                          slope_t_col: str = np.nan) -> pd.DataFrame:
+                          slope_t_col: str = np.nan,
+                          copy: bool = True,
+                          slope_units: str = "radians") -> pd.DataFrame:
     """
     Calculates the height of trees based on the diameter at breast height (DBH).
     The equation is based on T. R. Feldpausch, et al. which assumes Ht = 35.83 − 31.15 × exp(−0.029 × DBH)
+    With `trig_leveling`, the height is measured from the distance and the slopes to the top and base
+    of the tree instead (see height_trigonometric).
 
     References:
     Feldpausch TR, Banin L, Phillips OL, Baker TR, Lewis SL, Quesada CA, et al. Height-diameter allome- try of tropical forest trees. Biogeosciences. 2011; 8: 1081–1106. https://doi.org/10.5194/bg-8-1081- 2011
@@ -21,26 +200,30 @@ def calculate_tree_height(df: pd.DataFrame,
     Parameters:
     - df (pandas.DataFrame): The input DataFrame containing the tree data.
     - dbh_column (str): The name of the column in the DataFrame that represents the DBH.
+    - trig_leveling (bool): If True, use the trigonometric height from the distance and slope columns.
+    - dist_col (str): The column with the horizontal distance to the tree in m.
+    - slope_b_col (str): The column with the slope to the base of the tree.
+    - slope_t_col (str): The column with the slope to the top of the tree.
+    - copy (bool): If False, the 'height' column is added to `df` in place instead of a copy.
+    - slope_units (str): The units of the slope columns, "percent", "degrees" or "radians".
 
     Returns:
     - df (pandas.DataFrame): The input DataFrame with an additional 'height' column representing the calculated tree height.
     """
     
-    df = df.copy()
+    if copy:
+        df = df.copy()
     
     if not trig_leveling:
-        height_column = np.minimum(35.83 - 31.15 * np.exp(-0.029 * df[dbh_column]), 30)
-        df["height"] = height_column
+        df["height"] = height_feldpausch(df[dbh_column])
     else:
-        df["height"] = np.where(
-        df[slope_t_col] > df[slope_b_col],
-        df[dist_col] * np.tan(np.tan(df[slope_t_col] - df[slope_b_col])),
-        df[dist_col] * np.tan(np.tan(df[slope_b_col] - df[slope_t_col]))
-)
+        df["height"] = height_trigonometric(
+            df[dist_col], df[slope_t_col], df[slope_b_col], slope_units
+        )
     return df
 
 
-def allometric_tropical_tree(df, wooddensity_col, dbh_col, height_col):
+def allometric_tropical_tree(df, wooddensity_col, dbh_col, height_col, copy=True):
     """
     Calculates the aboveground biomass of tropical trees using allometric equation based on Chave, et al. (2015) which assumes
     10 * (0.0673 * ((wood density * height * dbh^2)^0.976)). The output is divided by 1000 to convert from kg to metric tonnes.
@@ -53,6 +236,7 @@ def allometric_tropical_tree(df, wooddensity_col, dbh_col, height_col):
     wooddensity_col (str): The column name in the dataframe that represents wood density in grams per cubic cm.
     dbh_col (str): The column name in the dataframe that represents diameter at breast height in cm.
     height_col (str): The column name in the dataframe that represents tree height in m.
+    copy (bool): If False, the column is added to `df` in place instead of a copy.
 
     Formula:
     The aboveground biomass is calculated using the following equation:
@@ -62,15 +246,16 @@ def allometric_tropical_tree(df, wooddensity_col, dbh_col, height_col):
     pandas.DataFrame: The input dataframe with an additional column 'aboveground_biomass' representing the calculated aboveground biomass in tons.
     """
 
-    df = df.copy()
-    df["aboveground_biomass"] = (
-        0.0673 * ((df[wooddensity_col] * df[height_col] * df[dbh_col] ** 2) ** 0.976)
+    if copy:
+        df = df.copy()
+    df["aboveground_biomass"] = agb_chave2014(
+        df[wooddensity_col], df[height_col], df[dbh_col]
     )
 
     return df
 
 
-def allometric_peatland_tree(df, dbh_col):
+def allometric_peatland_tree(df, dbh_col, copy=True):
     """
     Calculates the aboveground biomass of trees in a peatland using allometric equation based on Alibo, et al. (2012) which assumes
     (21.297 - (67.953 * DBH) + (0.74 * DBH^2)). The output is divided by 1000 to convert from kg to metric tonnes.
@@ -84,6 +269,8 @@ def allometric_peatland_tree(df, dbh_col):
         The input DataFrame containing tree data.
     - dbh_col: str
         The name of the column in the DataFrame that represents the diameter at breast height (DBH) in cm.
+    - copy: bool
+        If False, the column is added to `df` in place instead of a copy.
 
     Returns:
     - df: DataFrame
@@ -94,32 +281,26 @@ def allometric_peatland_tree(df, dbh_col):
     aboveground_biomass = (21.297 - (67.953 * trees[dbh_col]) + (0.74 * trees[dbh_col]**2)) The factor 10 is used to convert the biomass from kg to metric tons.
 
     """
-    df = df.copy()
-    df["aboveground_biomass"] = (
-        21.297 - 67.953 * df[dbh_col] + 0.74 * df[dbh_col] ** 2
-    )
+    if copy:
+        df = df.copy()
+    df["aboveground_biomass"] = agb_alibo2012(df[dbh_col])
     return df
 
 def get_solid_diamter(df: pd.DataFrame, 
                        hollow_diameter_1_col: str, 
                        hollow_diameter_2_col: str,
-                       diameter_col: str) -> pd.DataFrame:
-    df = df.copy()
-
-    #Get area of ldw based on the diameter
-    ldw_area = np.pi * (df[diameter_col]/2)**2
-
-    # Get the average of the two hollow diameters
-    avg_hollow_diameter = df[[hollow_diameter_1_col, hollow_diameter_2_col]].mean(axis=1)
-
-    # Get the area of the hollow
-    hollow_area = np.pi * (avg_hollow_diameter/2)**2
-
-    # Get the area of the solid part of the ldw
-    solid_area = ldw_area - hollow_area
-
-    # Get the diameter of the solid part of the ldw
-    df['solid_diameter'] = np.sqrt((solid_area/np.pi))*2
+                       diameter_col: str,
+                       copy: bool = True) -> pd.DataFrame:
+    if copy:
+        df = df.copy()
+
+    # Diameter of the cross section of the ldw less the hollow, whose diameter is the
+    # average of the two hollow diameters
+    df['solid_diameter'] = kernel_backend.solid_lying_diameter(
+        _as_array(df[diameter_col]),
+        _as_array(df[hollow_diameter_1_col]),
+        _as_array(df[hollow_diameter_2_col]),
+    )
 
     return df
 
@@ -196,6 +377,109 @@ def calculate_statistics(df, column, confidence=0.95):
         'standard_error_perc_mean': se_perc_mean,
     }
 
+STATISTICS_COLUMNS = [
+    "weighted_mean",
+    "confidence_interval_lower",
+    "confidence_interval_upper",
+    "uncertainty_90",
+    "uncertainty_95",
+    "margin_of_error",
+    "weighted_std",
+    "standard_error",
+    "standard_error_perc_mean",
+]
+
+
+def calculate_statistics_table(
+    df: pd.DataFrame,
+    value_cols: list,
+    by: str = "Strata",
+    weight: str = "subplot_count",
+    label_col: str = "tCO2e_per_ha",
+) -> pd.DataFrame:
+    """
+    Calculates the statistics of calculate_statistics for every group and value column at once.
+
+    The weighted sums of all columns are reduced in a single pass over the rows sorted by group,
+    and the normal quantiles are computed once.
+
+    Parameters:
+    - df (pd.DataFrame): The plot level table, e.g. the CO2e per hectare of each plot.
+    - value_cols (list): The columns to summarize, e.g. the carbon pools.
+    - by (str, optional): The column to group by. Defaults to "Strata".
+    - weight (str, optional): The column with the weights. Defaults to "subplot_count".
+    - label_col (str, optional): The name of the column holding the pool name, the text before the
+      first "_" of each value column. Defaults to "tCO2e_per_ha".
+
+    Returns:
+    - pd.DataFrame: One row per group and value column, with `by`, `label_col` and STATISTICS_COLUMNS.
+    """
+    codes, groups = pd.factorize(df[by], sort=True)
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    starts = np.searchsorted(codes[order], np.arange(len(groups)))
+
+    values = df[value_cols].to_numpy(dtype=np.float64)[order]
+    weights = df[weight].to_numpy(dtype=np.float64)[order]
+    group_codes = codes[order]
+
+    # weighted moments, one row per group and one column per value column
+    total_weight = np.add.reduceat(weights, starts)
+    weighted_mean = np.add.reduceat(values * weights[:, None], starts, axis=0) / total_weight[:, None]
+    squared_deviation = (values - weighted_mean[group_codes]) ** 2
+    variance = np.add.reduceat(squared_deviation * weights[:, None], starts, axis=0) / total_weight[:, None]
+
+    stats = statistics_from_moments(total_weight[:, None], weighted_mean, variance)
+    return statistics_frame(pd.DataFrame({by: np.asarray(groups)}), value_cols, stats, label_col)
+
+
+def statistics_from_moments(total_weight, weighted_mean, variance) -> dict:
+    """
+    Derives the outputs of calculate_statistics from the weighted moments of each group.
+
+    Parameters:
+    - total_weight (np.ndarray): The sum of the weights (subplot counts).
+    - weighted_mean (np.ndarray): The weighted mean.
+    - variance (np.ndarray): The weighted (population) variance.
+
+    Returns:
+    - dict: The STATISTICS_COLUMNS arrays.
+    """
+    weighted_std = np.sqrt(variance)
+    standard_error = weighted_std / np.sqrt(total_weight)
+    margin_of_error = norm.ppf(0.95) * standard_error
+
+    return {
+        "weighted_mean": weighted_mean,
+        "confidence_interval_lower": weighted_mean - margin_of_error,
+        "confidence_interval_upper": weighted_mean + margin_of_error,
+        "uncertainty_90": (margin_of_error / weighted_mean) * 100,
+        "uncertainty_95": ((norm.ppf(0.975) * standard_error) / weighted_mean) * 100,
+        "margin_of_error": margin_of_error,
+        "weighted_std": weighted_std,
+        "standard_error": standard_error,
+        "standard_error_perc_mean": (standard_error / weighted_mean) * 100,
+    }
+
+
+def statistics_frame(
+    group_keys: pd.DataFrame,
+    value_cols: list,
+    stats: dict,
+    label_col: str = "tCO2e_per_ha",
+    columns: list = STATISTICS_COLUMNS,
+) -> pd.DataFrame:
+    """
+    Lays out groups x value columns statistics as one row per group and value column.
+    """
+    table = group_keys.loc[group_keys.index.repeat(len(value_cols))].reset_index(drop=True)
+    table[label_col] = np.tile([col.split("_")[0] for col in value_cols], len(group_keys))
+    for name in columns:
+        table[name] = np.asarray(stats[name]).ravel()
+
+    return table
+
+
 def vmd0001_eq1(
     df: pd.DataFrame,
     carbon_fraction: float = 0.47,
@@ -203,6 +487,7 @@ def vmd0001_eq1(
     sapling_cnt: str = "count_saplings",
     wc: float = 0.25,
     avg_weight: float = 0.000184,
+    copy: bool = True,
 ):
     """
     Calculate the carbon stock based on the aboveground biomass and carbon fraction.
@@ -214,24 +499,34 @@ def vmd0001_eq1(
     - sapling_cnt (str, optional): The column name in the DataFrame representing the count of saplings. Default value is 'count_saplings'.
     - wc (float, optional): The wood carbon content. Default value is 0.25.
     - avg_weight (float, optional): The average weight of the saplings. Default value is 0.000184 tonnes.
+    - copy (bool, optional): If False, the column is added to `df` in place instead of a copy. Default value is True.
 
     Returns:
     - DataFrame: The input data with additional columns for carbon stock.
     """
-    df = df.copy()
+    if copy:
+        df = df.copy()
 
     if not is_sapling:
-        df["aboveground_carbon_tonnes"] = df["aboveground_biomass"] * carbon_fraction
+        df["aboveground_carbon_tonnes"] = carbon(df["aboveground_biomass"], carbon_fraction)
 
     else:
-        df["aboveground_carbon_tonnes"] = (
-            df[sapling_cnt] * avg_weight * wc
-        ) * carbon_fraction
-        df["aboveground_carbon_tonnes"] = df["aboveground_carbon_tonnes"].fillna(0)
+        df["aboveground_carbon_tonnes"] = sapling_carbon(
+            df[sapling_cnt], carbon_fraction, wc, avg_weight
+        )
 
     return df
 
-def vmd0001_eq2a(df: pd.DataFrame, agg_cols: list, tc_col: str):
+def _group_sum(df: pd.DataFrame, agg_cols: list, value_col: str, group_index: GroupIndex = None):
+    if group_index is None:
+        group_index = GroupIndex(df, agg_cols)
+    else:
+        group_index.check(df, agg_cols)
+
+    return group_index.aggregate(df, [value_col])
+
+
+def vmd0001_eq2a(df: pd.DataFrame, agg_cols: list, tc_col: str, group_index: GroupIndex = None):
     """
     Perform aggregation and summation on a calculated biomass based on specified columns.
 
@@ -239,22 +534,20 @@ def vmd0001_eq2a(df: pd.DataFrame, agg_cols: list, tc_col: str):
     df (pd.DataFrame): The input DataFrame.
     agg_cols (list): A list of columns to group by and aggregate.
     tc_col (str): The column containing the values to be summed.
+    group_index (GroupIndex, optional): A GroupIndex of `df` on `agg_cols`, shared between the
+        aggregations of the same table so the keys are only factorized once.
 
     Returns:
     pd.DataFrame: The resulting DataFrame after aggregation and summation.
     """
 
-    subset = agg_cols.copy()
-    subset.extend([tc_col])
-    df = df[subset].copy()
-    df = df.groupby(agg_cols).sum().reset_index()
-
-    return df
+    return _group_sum(df, agg_cols, tc_col, group_index)
 
 def vmd0001_eq2b(
     df: pd.DataFrame,
     biomass_col: str = "aboveground_carbon_tonnes",
     area_col: str = "corrected_sapling_area_m2",
+    copy: bool = True,
 ) -> pd.DataFrame:
     """
     Calculate CO2e per hectare based on biomass and area.
@@ -263,12 +556,14 @@ def vmd0001_eq2b(
         df (pd.DataFrame): The input DataFrame containing biomass and area columns.
         biomass_col (str, optional): The column name of the biomass data. Defaults to "aboveground_carbon_tonnes".
         area_col (str, optional): The column name of the area data. Defaults to "corrected_sapling_area_m2".
+        copy (bool, optional): If False, the column is added to `df` in place instead of a copy. Defaults to True.
 
     Returns:
         pd.DataFrame: The input DataFrame with an additional column "CO2e_per_ha" representing CO2e per hectare.
     """
-    df = df.copy()
-    df["CO2e_per_ha"] = ((df[biomass_col] / df[area_col])) * 44 / 12
+    if copy:
+        df = df.copy()
+    df["CO2e_per_ha"] = co2e(_as_array(df[biomass_col]) / _as_array(df[area_col]))
 
     return df
 
@@ -276,7 +571,8 @@ def vmd0001_eq2b(
 def vmd0001_eq5(
     df: pd.DataFrame,
     carbon_stock_col: str = "aboveground_carbon_tonnes",
-    root_shoot_ratio: float = 0.36
+    root_shoot_ratio: float = 0.36,
+    copy: bool = True,
 ) -> pd.DataFrame:
     """
     Calculate the belowground carbon stock based on the aboveground carbon stock and eco zone.
@@ -286,6 +582,7 @@ def vmd0001_eq5(
     - carbon_stock_col (str, optional): The column name of the aboveground carbon stock data. Default value is "aboveground_carbon_tonnes".
     - root_shoot_ration (float, optional): Ratio of below-ground biomass to above-ground biomass; applies to above-ground biomass, above-ground
 biomass growth, biomass removals and may differ for these components. Uses 0.36 as default for tropical rainforests
+    - copy (bool, optional): If False, the column is added to `df` in place instead of a copy. Default value is True.
     
     Returns:
     - DataFrame: The input data with an additional column for belowground carbon stock.
@@ -293,24 +590,27 @@ biomass growth, biomass removals and may differ for these components. Uses 0.36
     References
     https://www.ipcc-nggip.iges.or.jp/public/2006gl/pdf/4_Volume4/V4_04_Ch4_Forest_Land.pdf
     """
-    df = df.copy()
+    if copy:
+        df = df.copy()
 
-    df["belowground_carbon_tonnes"] = df[carbon_stock_col] * root_shoot_ratio
+    df["belowground_carbon_tonnes"] = belowground_carbon(df[carbon_stock_col], root_shoot_ratio)
 
     return df
 
 def vmd0002_eq1(df: pd.DataFrame,
                 diameter_col:str, 
                 height_col:str,
-                density_col:str) -> pd.DataFrame:
-    df = df.copy()
+                density_col:str,
+                copy: bool = True) -> pd.DataFrame:
+    if copy:
+        df = df.copy()
 
     # Calculate the biomass of each tree
-    df['tonnes_dry_matter'] = (1/3) * np.pi * (df[diameter_col]/200)**2 * df[height_col] * df[density_col]
+    df['tonnes_dry_matter'] = cone_dry_matter(df[diameter_col], df[height_col], df[density_col])
 
     return df
 
-def vmd0002_eq2(df: pd.DataFrame, base_diameter_col: str, top_diamter_col: str, height_col: str, density_col: str):
+def vmd0002_eq2(df: pd.DataFrame, base_diameter_col: str, top_diamter_col: str, height_col: str, density_col: str, copy: bool = True, hollow_base_diameter_col: str = None, hollow_top_diameter_col: str = None):
     """
     Calculate the biomass based on the given parameters.
 
@@ -320,53 +620,117 @@ def vmd0002_eq2(df: pd.DataFrame, base_diameter_col: str, top_diamter_col: str,
     top_diamter_col (str): The column name for the top diameter.
     height_col (str): The column name for the height.
     density_col (str): The column name for the density.
+    copy (bool): If False, the column is added to `df` in place instead of a copy.
+    hollow_base_diameter_col (str, optional): The column name for the base diameter of the hollow.
+    hollow_top_diameter_col (str, optional): The column name for the top diameter of the hollow.
+        If both hollow columns are given, the dry matter of the hollow is subtracted in the same pass.
 
     Returns:
-    pd.DataFrame: The DataFrame with an additional 'biomass' column.
+    pd.DataFrame: The DataFrame with an additional 'tonnes_dry_matter' column.
     """
-    df = df.copy()
-    df['tonnes_dry_matter'] = ((df[base_diameter_col] + df[top_diamter_col]) / 200) * df[height_col] * df[density_col]
+    if copy:
+        df = df.copy()
+    if hollow_base_diameter_col and hollow_top_diameter_col:
+        df['tonnes_dry_matter'] = kernel_backend.hollow_stump_dry_matter(
+            *[
+                _as_array(df[col])
+                for col in [
+                    base_diameter_col,
+                    top_diamter_col,
+                    hollow_base_diameter_col,
+                    hollow_top_diameter_col,
+                    height_col,
+                    density_col,
+                ]
+            ]
+        )
+    else:
+        df['tonnes_dry_matter'] = stump_dry_matter(
+            df[base_diameter_col], df[top_diamter_col], df[height_col], df[density_col]
+        )
 
     return df
 
-def vmd0002_eq3(df:pd.DataFrame, agg_cols:list, tdm_col:str):
-    subset = agg_cols.copy()
-    subset.extend([tdm_col])
-    df = df[subset].copy()
-    df = df.groupby(agg_cols).sum().reset_index()
-    return df
+def vmd0002_eq3(df:pd.DataFrame, agg_cols:list, tdm_col:str, group_index: GroupIndex = None):
+    return _group_sum(df, agg_cols, tdm_col, group_index)
 
-def vmd0002_eq4(df:pd.DataFrame, biomass_col:str, area_ha_col:str):
-    df =df.copy()
+def vmd0002_eq4(df:pd.DataFrame, biomass_col:str, area_ha_col:str, copy: bool = True):
+    if copy:
+        df = df.copy()
 
-    df['tonnes_dry_matter_ha'] = df[biomass_col] / df[area_ha_col]
+    df['tonnes_dry_matter_ha'] = _as_array(df[biomass_col]) / _as_array(df[area_ha_col])
 
     return df
 
-def vmd0002_eq7(df: pd.DataFrame, diamter_col: str, transect_l: int = 100) -> pd.DataFrame:
-    df = df.copy()
-    df['deadwood_volume'] = ((df[diamter_col])**2) / (8 * transect_l)
+def vmd0002_eq7(df: pd.DataFrame, diamter_col: str, transect_l: int = 100, copy: bool = True) -> pd.DataFrame:
+    if copy:
+        df = df.copy()
+    df['deadwood_volume'] = deadwood_volume(df[diamter_col], transect_l)
     return df
 
-def vmd0002_eq8a(df: pd.DataFrame, density_col: str, density_equivalent: dict = {1: 0.54, 2: 0.35, 3: 0.21}, default_density: float = 0.21) -> pd.DataFrame:
-    df = df.copy()
-    
-    density = df[density_col].replace(density_equivalent).fillna(default_density)
-    df['tonnes_dry_matter_ha'] = df['deadwood_volume'] * density
+def vmd0002_eq8a(df: pd.DataFrame, density_col: str, density_equivalent: dict = DENSITY_CLASSES, default_density: float = DEFAULT_DENSITY, copy: bool = True) -> pd.DataFrame:
+    if copy:
+        df = df.copy()
+
+    density = class_density(df[density_col], density_equivalent, default_density)
+    df['tonnes_dry_matter_ha'] = _as_array(df['deadwood_volume']) * density
+    return df
+
+def vmd0002_eq7_eq8a(
+    df: pd.DataFrame,
+    diameter_col: str,
+    density_col: str,
+    transect_l: int = 100,
+    density_equivalent: dict = DENSITY_CLASSES,
+    default_density: float = DEFAULT_DENSITY,
+    copy: bool = True,
+    hollow_diameter_cols: list = None,
+) -> pd.DataFrame:
+    """
+    Calculates the lying deadwood volume (vmd0002_eq7) and dry matter per hectare (vmd0002_eq8a)
+    in one pass over the diameter and density class arrays.
+
+    For hollow pieces, the solid diameter (see get_solid_diamter) is calculated in the same pass
+    and used instead of the diameter.
+
+    Parameters:
+    - df (pd.DataFrame): The lying deadwood table.
+    - diameter_col (str): The column with the diameter in cm.
+    - density_col (str): The column with the density class.
+    - transect_l (int, optional): The transect length in m. Defaults to 100.
+    - density_equivalent (dict, optional): The wood density per class. Defaults to DENSITY_CLASSES.
+    - default_density (float, optional): The density of missing or unknown classes. Defaults to 0.21.
+    - copy (bool, optional): If False, the columns are added to `df` in place instead of a copy.
+    - hollow_diameter_cols (list, optional): The two hollow diameter columns of hollow pieces.
+
+    Returns:
+    - pd.DataFrame: The input DataFrame with 'deadwood_volume' and 'tonnes_dry_matter_ha' columns,
+      and 'solid_diameter' for hollow pieces.
+    """
+    if copy:
+        df = df.copy()
+
+    density = class_density(df[density_col], density_equivalent, default_density)
+    diameter = _as_array(df[diameter_col])
+    if hollow_diameter_cols:
+        hollow_1, hollow_2 = [_as_array(df[col]) for col in hollow_diameter_cols]
+        df['solid_diameter'], df['deadwood_volume'], df['tonnes_dry_matter_ha'] = (
+            kernel_backend.hollow_deadwood_dry_matter(
+                diameter, hollow_1, hollow_2, density, transect_l
+            )
+        )
+    else:
+        df['deadwood_volume'], df['tonnes_dry_matter_ha'] = kernel_backend.deadwood_dry_matter(
+            diameter, density, transect_l
+        )
     return df
 
 def vmd0002_eq8b(df: pd.DataFrame,
                 agg_col:list,
                 tdm_col: str = 'tonnes_dry_matter_ha',
+                group_index: GroupIndex = None,
                 ) -> pd.DataFrame:
-    df = df.copy()
-    subset = agg_col.copy()
-    subset.extend([tdm_col])
-
-    df = df[subset]
-    df = df.groupby(agg_col).sum().reset_index()
-
-    return df
+    return _group_sum(df, agg_col, tdm_col, group_index)
 
 def vmd0002_eq9(df_stumps: pd.DataFrame, 
                 df_ldw: pd.DataFrame, 
@@ -387,6 +751,7 @@ def vmd0003_eq1(
     kdm_col: str,
     water_content: float,
     carbon_fraction: float = 0.37,
+    copy: bool = True,
 ):
     """
     Calculate the carbon stock from forest litter and non-tree vegetation based on VCS module VMD0003 - equation 1.
@@ -402,18 +767,18 @@ def vmd0003_eq1(
     col_name (str): The name of the column for the biomass in kilograms.
     water_content (float): The water content of the biomass. Used as multiplier to remove water weight
     carbon_fraction (float): Carbon fraction of dry matter, default is 0.37 based on based on VMD0003.
+    copy (bool): If False, the columns are added to `df` in place instead of a copy.
 
     Returns:
     DataFrame: The input data with additional columns for dry biomass and carbon stock.
     """
-    df = df.copy()
+    if copy:
+        df = df.copy()
 
     # remove water content
-    df["kg_dry_matter"] = df[kdm_col] * water_content
+    df["kg_dry_matter"] = _as_array(df[kdm_col]) * water_content
 
     # calculate carbon stock
-    df["CO2e_per_ha"] = (
-        (10 / 0.25) * df["kg_dry_matter"] * carbon_fraction * 44 / 12
-    )
+    df["CO2e_per_ha"] = dry_matter_co2e_per_ha(df[kdm_col], water_content, carbon_fraction)
 
     return df
@@ -0,0 +1,268 @@
+import hashlib
+import json
+import os
+import time
+import warnings
+from pathlib import Path
+
+import pandas as pd
+
+from src.settings import TMP_OUT_DIR
+
+# Root of the intermediate table cache
+CACHE_DIR = TMP_OUT_DIR / "cache"
+
+# Largest total size (bytes) of the cached tables before the least recently used are evicted
+CACHE_MAX_BYTES = 2 * 1024**3
+
+_HASH_CHUNK_BYTES = 1024**2
+
+# Age (seconds) after which a temporary file of an unfinished write is removed, even if a
+# process with its PID is running (the PID may have been reused)
+TMP_MAX_AGE = 24 * 3600
+
+
+def _hash_path(digest, path: Path) -> None:
+    # content hash of a file, or of every file of a directory in path order;
+    # a missing path hashes as missing
+    path = Path(path)
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    for file in files:
+        digest.update(str(file.relative_to(path) if path.is_dir() else file.name).encode())
+        if not file.exists():
+            digest.update(b"<missing>")
+            continue
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+                digest.update(chunk)
+
+
+def cache_key(*parts) -> str:
+    """
+    Content-addressed key of an intermediate table from everything it is derived from.
+
+    e.g. cache_key("trees_with_wood_density", TREES_SPECIES_CSV, SRC_DIR / "get_wood_density.R")
+
+    Parameters:
+    - parts: Paths (hashed by the contents of the file or directory), DataFrames (hashed by their
+      values) or any other value (hashed by its repr), e.g. a name or parameters.
+
+    Returns:
+    - str: The sha256 hex digest.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, Path):
+            _hash_path(digest, part)
+        elif isinstance(part, pd.DataFrame):
+            digest.update(repr(list(part.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        else:
+            digest.update(repr(part).encode())
+        # separator, so ("ab", "c") and ("a", "bc") differ
+        digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def _process_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, as another user
+        return True
+    return True
+
+
+class TableCache:
+    """
+    Size-bounded on-disk cache of intermediate tables, stored as Parquet under content-addressed keys.
+
+    The name and creation time of every table are kept in a JSON file next to it, and its last
+    access time is the modification time of the table. The index is rebuilt from the directory
+    rather than kept in a shared file, so stages caching tables in parallel never drop each
+    other's entries and every table on disk counts against the budget. When a new table brings
+    the total size above `max_bytes`, the least recently used tables are evicted. The temporary
+    files of writes that never finished (their process is gone, or they are older than
+    TMP_MAX_AGE) are removed when the index is rebuilt. Hits, misses and evictions are counted
+    per instance (see `stats`).
+
+    Parameters:
+    - cache_dir (Path, optional): The cache directory. Defaults to CACHE_DIR.
+    - max_bytes (int, optional): The byte budget of the cached tables. Defaults to CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.parquet"
+
+    def _meta_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _read_meta(self, key: str) -> dict:
+        # a table without metadata (e.g. its writer was interrupted) is still a cached table
+        try:
+            return json.loads(self._meta_path(key).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        # written to a temporary file first, so readers never see a partial file
+        path = self._meta_path(key)
+        tmp_path = path.with_suffix(f".json.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(meta, indent=2, sort_keys=True))
+        os.replace(tmp_path, path)
+
+    def _remove_stale_tmp(self) -> None:
+        # temporary files ("<key>.<pid>.tmp", "<key>.json.<pid>.tmp") of writes whose process
+        # is gone, e.g. killed mid-write, are never finished and would pile up uncounted
+        now = time.time()
+        for path in self.cache_dir.glob("*.tmp"):
+            pid = path.suffixes[-2].lstrip(".") if len(path.suffixes) >= 2 else ""
+            try:
+                stale = now - path.stat().st_mtime > TMP_MAX_AGE
+                if not stale and pid.isdigit() and int(pid) != os.getpid():
+                    stale = not _process_running(int(pid))
+                if stale:
+                    path.unlink()
+            except FileNotFoundError:
+                # finished or removed by another process since the listing
+                continue
+
+    def _read_index(self) -> dict:
+        self._remove_stale_tmp()
+        index = {}
+        for path in self.cache_dir.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # evicted by another process since the listing
+                continue
+            meta = self._read_meta(path.stem)
+            index[path.stem] = {
+                "name": meta.get("name"),
+                "size": stat.st_size,
+                "created": meta.get("created", stat.st_mtime),
+                "last_access": stat.st_mtime,
+            }
+        return index
+
+    def _remove(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+        self._meta_path(key).unlink(missing_ok=True)
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def get(self, key: str, columns: list = None, filters=None):
+        """
+        Reads a cached table, or returns None if it is not cached.
+
+        Parameters:
+        - key (str): The key of the table, e.g. from cache_key.
+        - columns (list, optional): Only read these columns.
+        - filters (optional): Row filters in the pyarrow format, e.g. [("nest", "=", 2)].
+
+        Returns:
+        - pd.DataFrame: The table, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            df = pd.read_parquet(path, columns=columns, filters=filters)
+            # the modification time is the last access time of the table
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        return df
+
+    def put(self, key: str, df: pd.DataFrame, name: str = None) -> None:
+        """
+        Caches a table under `key`, then evicts the least recently used tables over the budget.
+
+        Parameters:
+        - key (str): The key of the table, e.g. from cache_key.
+        - df (pd.DataFrame): The table.
+        - name (str, optional): A readable name kept with the table, e.g. "trees_with_wood_density".
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(tmp_path, index=False)
+        self._write_meta(key, {"name": name, "created": time.time()})
+        os.replace(tmp_path, path)
+
+        index = self._read_index()
+        size = path.stat().st_size
+        if size > self.max_bytes:
+            warnings.warn(
+                f"Table '{name or key}' ({size} bytes) is larger than the cache "
+                f"budget of {self.max_bytes} bytes; it is kept until the next table is cached."
+            )
+
+        total = sum(entry["size"] for entry in index.values())
+        for old_key in sorted(index, key=lambda k: index[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if old_key == key:
+                continue
+            total -= index[old_key]["size"]
+            self._remove(old_key)
+            self.evictions += 1
+
+    def get_or_compute(self, key: str, func, name: str = None) -> pd.DataFrame:
+        """
+        Reads a cached table, or computes it with `func()` and caches it.
+        """
+        df = self.get(key)
+        if df is None:
+            df = func()
+            self.put(key, df, name)
+        return df
+
+    def entries(self) -> pd.DataFrame:
+        """
+        The cached tables with their name, size (bytes) and creation and last access times,
+        most recently used first.
+        """
+        index = self._read_index()
+        entries = pd.DataFrame.from_dict(
+            index, orient="index", columns=["name", "size", "created", "last_access"]
+        )
+        for col in ["created", "last_access"]:
+            entries[col] = pd.to_datetime(entries[col], unit="s")
+        return entries.rename_axis("key").sort_values("last_access", ascending=False)
+
+    def stats(self) -> dict:
+        """
+        The hits, misses, hit rate and evictions of this instance, and the number of tables and
+        bytes in the cache.
+        """
+        index = self._read_index()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else float("nan"),
+            "evictions": self.evictions,
+            "entries": len(index),
+            "bytes": sum(entry["size"] for entry in index.values()),
+            "max_bytes": self.max_bytes,
+        }
+
+    def clear(self) -> None:
+        """
+        Removes every cached table.
+        """
+        for path in [*self.cache_dir.glob("*.parquet"), *self.cache_dir.glob("*.json")]:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,278 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from src.aggregation import GroupIndex
+from src.allometry import STRATA_ALLOMETRY, evaluate_allometry
+from src.biomass_equations import _as_array, co2e, height_feldpausch
+from src.height_models import predict_height
+from src.kernel_backend import tree_carbon
+
+NESTS = [2, 3, 4]
+
+# Default parameters of the living tree calculation, matching the living trees notebook
+LIVING_TREE_PARAMS = {
+    "dbh_col": "DBH",
+    "wood_density_col": "wood_density",
+    "strata_col": "Strata",
+    "strata_models": STRATA_ALLOMETRY,
+    "max_height": 30.0,
+    # locally fitted height-diameter models per strata from src.height_models.fit_height_models;
+    # None uses Feldpausch, et al. (2011) for every strata
+    "height_models": None,
+    "carbon_fraction": 0.47,
+    "root_shoot_ratio": 0.36,
+    # np.float32 halves the memory of the tree level arrays; sums are still accumulated in float64
+    "dtype": np.float64,
+    # in float32 mode, the plot and strata results are checked against float64 and a
+    # ValueError is raised above this relative error. None skips the check.
+    "verify_rtol": 1e-4,
+    # number of plots, drawn at random, recomputed in float64 for the check, so it costs a
+    # fraction of the float32 run. None recomputes every plot.
+    "verify_plots": 200,
+}
+
+
+def plot_area_index(plot_info: pd.DataFrame, nests: list = NESTS) -> pd.DataFrame:
+    """
+    Builds the lookup of slope corrected nest areas per subplot.
+
+    Parameters:
+    - plot_info (pd.DataFrame): The plot info table with 'corrected_plot_area_n{nest}_m2' columns.
+    - nests (list, optional): The nest numbers. Defaults to [2, 3, 4].
+
+    Returns:
+    - pd.DataFrame: The corrected area (m2) per nest, indexed by unique_id with one column per nest.
+    """
+    area_cols = [f"corrected_plot_area_n{nest}_m2" for nest in nests]
+    plot_index = plot_info[["unique_id"] + area_cols].dropna()
+    plot_index = plot_index.drop_duplicates(subset=["unique_id"]).set_index("unique_id")
+    plot_index.columns = nests
+
+    return plot_index
+
+
+def _nest_areas(plot_index: pd.DataFrame, unique_ids, nests) -> np.ndarray:
+    """
+    Looks up the corrected area (m2) of each (unique_id, nest) pair, NaN if unknown.
+    """
+    plot_pos = plot_index.index.get_indexer(unique_ids)
+    nest_pos = pd.Index(plot_index.columns).get_indexer(nests)
+
+    areas = np.full(len(plot_pos), np.nan)
+    found = (plot_pos >= 0) & (nest_pos >= 0)
+    areas[found] = plot_index.to_numpy(dtype=np.float64)[plot_pos[found], nest_pos[found]]
+
+    return areas
+
+
+def living_tree_stock(
+    trees: pd.DataFrame,
+    plot_index: pd.DataFrame,
+    params: dict = None,
+    return_nests: bool = False,
+):
+    """
+    Calculates the aboveground and belowground carbon stock of living trees per subplot,
+    from DBH to tC and CO2e per hectare, in a single pass over the tree arrays.
+
+    This gives the same results as the chain in the living trees notebook (calculate_tree_height,
+    allometric_tropical_tree / allometric_peatland_tree, vmd0001_eq1, vmd0001_eq5, vmd0001_eq2a,
+    vmd0001_eq2b and the mean over nests) without copying or splitting the tree table.
+    The allometric model of each tree is looked up from `strata_models` (see src.allometry). Trees whose
+    strata has no model are excluded from the sums with a warning.
+
+    Parameters:
+    - trees (pd.DataFrame): The tree table with unique_id, nest, DBH, wood density and strata columns.
+    - plot_index (pd.DataFrame): The corrected nest areas from plot_area_index.
+    - params (dict, optional): Overrides of LIVING_TREE_PARAMS. Set "dtype" to np.float32 to run the
+      tree level math in single precision; the results of "verify_plots" plots are then verified
+      against float64 (see check_precision).
+    - return_nests (bool, optional): If True, also return the per nest sums and areas.
+
+    Returns:
+    - pd.DataFrame: aboveground/belowground tC and CO2e per hectare per unique_id.
+    - pd.DataFrame: (only if return_nests) carbon sums and corrected area per unique_id and nest.
+    """
+    params = {**LIVING_TREE_PARAMS, **(params or {})}
+    result = _living_tree_stock(trees, plot_index, params, return_nests)
+
+    if np.dtype(params["dtype"]) == np.float32 and params["verify_rtol"] is not None:
+        stock = result[0] if return_nests else result
+        # the plots are computed independently, so a sample of plots recomputed on its own
+        # gives the exact float64 reference of those plots
+        sample = trees
+        if params["verify_plots"] is not None and len(stock) > params["verify_plots"]:
+            rng = np.random.default_rng(0)
+            plots = rng.choice(stock["unique_id"].to_numpy(), params["verify_plots"], replace=False)
+            sample = trees[trees["unique_id"].isin(plots)]
+            stock = stock[stock["unique_id"].isin(plots)]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            reference = _living_tree_stock(
+                sample, plot_index, {**params, "dtype": np.float64}, False
+            )
+        plot_strata = sample.groupby("unique_id")[params["strata_col"]].first()
+        check_precision(stock, reference, plot_strata, params["verify_rtol"])
+
+    return result
+
+
+def _living_tree_stock(trees, plot_index, params, return_nests):
+    nests = _nest_biomass(trees, params)
+    nest_area = _nest_areas(plot_index, nests["unique_id"], nests["nest"])
+
+    # carbon fraction and root-shoot ratio are linear, so they are applied to the nest sums
+    aboveground_sum, belowground_sum = tree_carbon(
+        nests["aboveground_biomass"], params["carbon_fraction"], params["root_shoot_ratio"]
+    )
+
+    stock = pd.DataFrame({"unique_id": nests["unique_ids"]})
+    per_ha = _per_ha_stock(aboveground_sum, belowground_sum, nest_area, nests["group_plot"])
+    for col, values in per_ha.items():
+        stock[col] = values
+
+    if not return_nests:
+        return stock
+
+    nest_stock = pd.DataFrame({"unique_id": nests["unique_id"], "nest": nests["nest"]})
+    nest_stock["aboveground_carbon_tonnes"] = aboveground_sum
+    nest_stock["belowground_carbon_tonnes"] = belowground_sum
+    nest_stock["corrected_area_m2"] = nest_area
+
+    return stock, nest_stock
+
+
+def _nest_biomass(trees: pd.DataFrame, params: dict) -> dict:
+    """
+    Sums the aboveground biomass (kg) of the trees of each subplot and nest.
+
+    Returns:
+    - dict: The unique_id, nest and float64 biomass sum of each nest, the position of its subplot
+      ("group_plot") and the sorted subplots ("unique_ids").
+    """
+    aboveground_biomass, has_model = _tree_biomass(trees, params)
+
+    # Sum per subplot and nest
+    group_index = GroupIndex(trees, ["unique_id", "nest"], mask=has_model)
+    unique_id = group_index.key_frame["unique_id"].to_numpy()
+
+    # the groups are sorted by unique_id, so the plots come out in sorted order
+    group_plot, unique_ids = pd.factorize(unique_id)
+
+    return {
+        "unique_id": unique_id,
+        "nest": group_index.key_frame["nest"].to_numpy(),
+        "aboveground_biomass": group_index.sum(aboveground_biomass, dtype=np.float64),
+        "group_plot": group_plot,
+        "unique_ids": np.asarray(unique_ids),
+    }
+
+
+def _tree_biomass(trees: pd.DataFrame, params: dict) -> tuple:
+    """
+    Calculates the aboveground biomass (kg) of every tree with the model of its strata.
+
+    Returns:
+    - np.ndarray: The biomass of each tree, NaN where the strata has no model.
+    - np.ndarray: Boolean array of the trees whose strata has a model.
+    """
+    dtype = np.dtype(params["dtype"])
+    dbh = _as_array(trees[params["dbh_col"]], dtype)
+    strata = trees[params["strata_col"]]
+    has_model = strata.map(params["strata_models"]).notna().to_numpy()
+
+    aboveground_biomass = evaluate_allometry(
+        {
+            "dbh": dbh,
+            "wood_density": lambda: trees[params["wood_density_col"]],
+            "height": lambda: _tree_height(dbh, strata, params),
+        },
+        strata,
+        params["strata_models"],
+        dtype,
+    )
+
+    return aboveground_biomass, has_model
+
+
+def _tree_height(dbh: np.ndarray, strata, params: dict) -> np.ndarray:
+    if params["height_models"] is None:
+        return height_feldpausch(dbh, params["max_height"])
+    return predict_height(
+        dbh, strata, params["height_models"], params["strata_col"], params["max_height"]
+    )
+
+
+def _per_ha_stock(aboveground_sum, belowground_sum, nest_area, group_plot) -> dict:
+    """
+    Converts the carbon sums (tonnes) of each nest to tC and CO2e per hectare and averages them
+    over the nests of each subplot, ignoring nests without an area.
+
+    The sums may have a second axis (e.g. parameter combinations), kept in the results.
+    """
+    nest_area = nest_area.reshape(nest_area.shape + (1,) * (np.ndim(aboveground_sum) - 1))
+    per_ha = {
+        "aboveground_CO2e_per_ha": co2e(aboveground_sum / nest_area) * 10_000,
+        "aboveground_tC_per_ha": (aboveground_sum / nest_area) * 10_000,
+        "belowground_CO2e_per_ha": co2e(belowground_sum / nest_area) * 10_000,
+        "belowground_tC_per_ha": (belowground_sum / nest_area) * 10_000,
+    }
+
+    # group_plot is sorted, so the nests of each subplot are contiguous
+    starts = np.flatnonzero(np.diff(group_plot, prepend=-1))
+    has_area = ~np.isnan(nest_area)
+    nest_count = np.add.reduceat(has_area.astype(np.float64), starts, axis=0)
+
+    results = {}
+    for col, values in per_ha.items():
+        total = np.add.reduceat(np.where(has_area, values, 0), starts, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            results[col] = np.where(nest_count > 0, total / nest_count, np.nan)
+
+    return results
+
+
+def check_precision(
+    result: pd.DataFrame,
+    reference: pd.DataFrame,
+    plot_strata: pd.Series,
+    rtol: float = 1e-4,
+    key: str = "unique_id",
+) -> None:
+    """
+    Compares reduced precision results against a float64 reference at plot and strata level.
+
+    Parameters:
+    - result (pd.DataFrame): The per plot results computed in reduced precision.
+    - reference (pd.DataFrame): The same results computed in float64.
+    - plot_strata (pd.Series): The strata of each plot, indexed by `key`.
+    - rtol (float, optional): The largest relative error allowed. Defaults to 1e-4.
+    - key (str, optional): The plot key column. Defaults to "unique_id".
+
+    Raises:
+    - ValueError: If any plot or strata value differs from the reference by more than `rtol`.
+    """
+    result = result.set_index(key).sort_index()
+    reference = reference.set_index(key).sort_index()
+    value_cols = reference.select_dtypes("number").columns
+
+    levels = {"plot": (result[value_cols], reference[value_cols])}
+    strata = plot_strata.reindex(reference.index)
+    levels["strata"] = (
+        result[value_cols].groupby(strata).mean(),
+        reference[value_cols].groupby(strata).mean(),
+    )
+
+    tiny = np.finfo(np.float32).tiny
+    for level, (actual, expected) in levels.items():
+        # NaN in both is a match, NaN in only one of them is an infinite error
+        rel_error = (actual - expected).abs() / np.maximum(expected.abs(), tiny)
+        rel_error = rel_error.mask(actual.isna() & expected.isna(), 0).fillna(np.inf)
+        worst = rel_error.max()
+        if (worst > rtol).any():
+            raise ValueError(
+                f"Relative error at {level} level exceeds {rtol}: "
+                f"{worst.idxmax()} = {worst.max():.3g}"
+            )
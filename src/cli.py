@@ -0,0 +1,97 @@
+import argparse
+import ast
+import sys
+
+from src.pipeline import PIPELINE_STATE_JSON, PIPELINE_STAGES, plan_pipeline, run_pipeline
+
+
+def parse_params(assignments: list) -> dict:
+    """
+    Parses "stage.VARIABLE=value" assignments into the parameters of each stage. Values are read
+    as Python literals where possible, e.g. "living_trees.MONTE_CARLO_DRAWS=1000", and as strings
+    otherwise, e.g. "living_trees.OUTLIER_REMOVAL=mad".
+    """
+    params = {}
+    for assignment in assignments or []:
+        target, sep, value = assignment.partition("=")
+        stage, dot, variable = target.partition(".")
+        if not sep or not dot or not variable:
+            raise ValueError(f"Expected 'stage.VARIABLE=value', got '{assignment}'.")
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            pass
+        params.setdefault(stage, {})[variable] = value
+
+    return params
+
+
+def _print_table(rows: list) -> None:
+    for row in rows:
+        print(f"{row['level']:>5}  {row['stage']:<20} {row['status']}")
+
+
+def main(argv: list = None) -> int:
+    """
+    The pipeline command line, run from the repo root.
+
+    e.g.
+    - python -m src.cli run: brings every stage up to date, skipping unchanged stages
+    - python -m src.cli run --stage living_trees --dry-run: shows what running the living trees stage would do
+    - python -m src.cli run --jobs 3: runs the litter, living tree and deadwood stages in parallel
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m src.cli", description="Runs the carbon stock pipeline, see src/pipeline.py."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run the pipeline stages that are out of date.")
+    run.add_argument(
+        "--stage",
+        action="append",
+        choices=list(PIPELINE_STAGES),
+        help="Only this stage and the stages it depends on. May be repeated.",
+    )
+    run.add_argument(
+        "--jobs", type=int, default=1, help="Worker processes for independent stages."
+    )
+    run.add_argument(
+        "--dry-run", action="store_true", help="Show what would run without running it."
+    )
+    run.add_argument("--force", action="store_true", help="Run the stages even if unchanged.")
+    run.add_argument(
+        "--param",
+        action="append",
+        metavar="STAGE.VARIABLE=VALUE",
+        help="Override a notebook variable of a stage. May be repeated.",
+    )
+    run.add_argument(
+        "--state", default=PIPELINE_STATE_JSON, help="The pipeline state file."
+    )
+    args = parser.parse_args(argv)
+
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    try:
+        params = parse_params(args.param)
+    except ValueError as error:
+        parser.error(str(error))
+    unknown = sorted(set(params) - set(PIPELINE_STAGES))
+    if unknown:
+        parser.error(f"Unknown stages {unknown} in --param.")
+
+    options = {
+        "targets": args.stage,
+        "params": params,
+        "force": args.force,
+        "state_path": args.state,
+    }
+    if args.dry_run:
+        _print_table(plan_pipeline(**options))
+        return 0
+
+    _print_table(run_pipeline(**options, jobs=args.jobs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
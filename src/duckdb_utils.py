@@ -19,3 +19,45 @@ def table_exists(db, table_name):
     """
     result = db.execute(query).fetchdf()
     return result["count_star()"][0] == 1
+
+
+def strata_areas(
+    db,
+    activity_table="activity_area",
+    strata_table="caraga_strata",
+    strata_col="strata",
+    group_cols=("CADT", "ELI_TYPE"),
+    crs="EPSG:3123",
+):
+    """
+    Area (ha) of every strata within each activity area group, from the intersection of the
+    activity area and strata tables of the activity area notebooks (geometries in EPSG:4326).
+    The areas are measured in `crs`, the projected CRS used in those notebooks.
+
+    Returns a DataFrame with `group_cols`, `strata_col` and area_ha, for src.uncertainty.stratified_totals.
+    """
+    for table in [activity_table, strata_table]:
+        if not table_exists(db, table):
+            raise ValueError(
+                f"The database has no {table} table, run the activity area notebooks first "
+                "(notebooks/00_eda/20240802_activity_area_calculation.py)."
+            )
+
+    groups = ", ".join(f"a.{col}" for col in group_cols)
+    query = f"""
+    SELECT
+        {groups},
+        s.{strata_col},
+        SUM(
+            ST_Area(
+                ST_Transform(
+                    ST_Intersection(a.geometry, s.geometry), 'EPSG:4326', '{crs}', always_xy := true
+                )
+            )
+        ) / 10000 AS area_ha
+    FROM {activity_table} a
+    JOIN {strata_table} s ON ST_Intersects(s.geometry, a.geometry)
+    GROUP BY {groups}, s.{strata_col}
+    ORDER BY {groups}, s.{strata_col}
+    """
+    return db.execute(query).fetchdf()
@@ -0,0 +1,234 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import curve_fit
+
+from src.biomass_equations import _as_array, height_feldpausch
+from src.cache import TableCache
+
+# Fewest trees with a measured height needed to fit a local model for a strata;
+# strata with fewer trees use Feldpausch, et al. (2011)
+MIN_HEIGHT_TREES = 10
+
+PARAM_COLUMNS = ["a", "b", "c"]
+
+
+def michaelis_menten(dbh, a, b) -> np.ndarray:
+    """
+    Michaelis-Menten height (m) from DBH (cm): H = a * DBH / (b + DBH).
+    """
+    return a * dbh / (b + dbh)
+
+
+def weibull(dbh, a, b, c) -> np.ndarray:
+    """
+    Weibull height (m) from DBH (cm): H = a * (1 - exp(-b * DBH^c)).
+    """
+    return a * (1 - np.exp(-b * dbh**c))
+
+
+def loglog(dbh, a, b, c) -> np.ndarray:
+    """
+    Log-log height (m) from DBH (cm): H = exp(a + b * ln(DBH) + c), where c = RSE^2 / 2 is the
+    correction for the back transformation from the log scale.
+    """
+    return np.exp(a + b * np.log(dbh) + c)
+
+
+def _fit_loglog(dbh, height):
+    # linear least squares on the log scale
+    log_dbh, log_height = np.log(dbh), np.log(height)
+    b, a = np.polyfit(log_dbh, log_height, 1)
+    residuals = log_height - (a + b * log_dbh)
+    rse = np.sqrt((residuals**2).sum() / (len(dbh) - 2))
+    return [a, b, rse**2 / 2]
+
+
+def _fit_curve(func, initial_guess):
+    def fit(dbh, height):
+        p0 = initial_guess(dbh, height)
+        params, _ = curve_fit(func, dbh, height, p0=p0, bounds=(0, np.inf), maxfev=10_000)
+        return list(params)
+
+    return fit
+
+
+# Registered height-diameter models: name -> kernel, its parameter names and fitting function
+HEIGHT_MODELS = {
+    "michaelis_menten": {
+        "func": michaelis_menten,
+        "params": ["a", "b"],
+        "fit": _fit_curve(
+            michaelis_menten, lambda dbh, height: [height.max() * 1.2, np.median(dbh)]
+        ),
+    },
+    "weibull": {
+        "func": weibull,
+        "params": ["a", "b", "c"],
+        "fit": _fit_curve(weibull, lambda dbh, height: [height.max() * 1.2, 0.05, 1.0]),
+    },
+    "loglog": {"func": loglog, "params": ["a", "b", "c"], "fit": _fit_loglog},
+}
+
+def height_data_hash(model: str, dbh, height) -> str:
+    """
+    The sha256 hex digest of a model name and the measurements it is fitted to.
+    """
+    digest = hashlib.sha256(model.encode())
+    digest.update(np.ascontiguousarray(dbh, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(height, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def fit_height_model(dbh, height, model: str = "michaelis_menten", cache: TableCache = None) -> list:
+    """
+    Fits a height-diameter model by least squares.
+
+    Parameters:
+    - dbh (array-like): The DBH (cm) of the trees with a measured height.
+    - height (array-like): The measured heights (m).
+    - model (str, optional): One of HEIGHT_MODELS. Defaults to "michaelis_menten".
+    - cache (TableCache, optional): Keeps the fitted parameters under height_data_hash, so the
+      same measurements are only fitted once, also across runs. Defaults to no caching.
+
+    Returns:
+    - list: The fitted parameters of the model kernel.
+    """
+    if model not in HEIGHT_MODELS:
+        raise ValueError(f"Unknown height model '{model}'. Use one of {list(HEIGHT_MODELS)}.")
+    dbh, height = _as_array(dbh, np.float64), _as_array(height, np.float64)
+    if cache is None:
+        return list(HEIGHT_MODELS[model]["fit"](dbh, height))
+
+    key = height_data_hash(model, dbh, height)
+    fit = cache.get(key)
+    if fit is None:
+        params = HEIGHT_MODELS[model]["fit"](dbh, height)
+        fit = pd.DataFrame([params], columns=HEIGHT_MODELS[model]["params"])
+        cache.put(key, fit, f"{model}_height_model")
+    return fit.iloc[0].tolist()
+
+
+def fit_height_models(
+    df: pd.DataFrame,
+    dbh_col: str,
+    height_col: str,
+    strata_col: str = "Strata",
+    model: str = "michaelis_menten",
+    min_trees: int = MIN_HEIGHT_TREES,
+    cache: TableCache = None,
+) -> pd.DataFrame:
+    """
+    Fits a height-diameter model per strata from the trees with a measured height, e.g. the
+    trigonometric heights of standing dead trees.
+
+    Strata with fewer than `min_trees` valid measurements, or where the fit does not converge,
+    are marked to use Feldpausch, et al. (2011) instead.
+
+    Parameters:
+    - df (pd.DataFrame): The tree table. Rows without a positive DBH and height are ignored.
+    - dbh_col (str): The column with the DBH in cm.
+    - height_col (str): The column with the measured height in m.
+    - strata_col (str, optional): The strata column. Defaults to "Strata".
+    - model (str, optional): One of HEIGHT_MODELS. Defaults to "michaelis_menten".
+    - min_trees (int, optional): The fewest measurements needed to fit a strata. Defaults to MIN_HEIGHT_TREES.
+    - cache (TableCache, optional): Keeps the fits by data hash, see fit_height_model.
+
+    Returns:
+    - pd.DataFrame: One row per strata with the model ("feldpausch" for the fallback), the number
+      of trees, the parameters a, b and c, the residual standard error (m) of the fit and the
+      data_hash of the measurements (see height_data_hash), to tell which data a fit is from.
+    """
+    dbh = _as_array(df[dbh_col], np.float64)
+    height = _as_array(df[height_col], np.float64)
+    valid = (dbh > 0) & (height > 0)
+
+    codes, strata = pd.factorize(df[strata_col], sort=True)
+    rows = []
+    for code, strata_value in enumerate(strata):
+        mask = valid & (codes == code)
+        row = {strata_col: strata_value, "model": "feldpausch", "n_trees": int(mask.sum())}
+        row.update(dict.fromkeys(PARAM_COLUMNS + ["rse"], np.nan))
+        row["data_hash"] = height_data_hash(model, dbh[mask], height[mask])
+        if mask.sum() >= min_trees:
+            try:
+                params = fit_height_model(dbh[mask], height[mask], model, cache)
+            except (RuntimeError, ValueError):
+                params = None
+            if params is not None:
+                residuals = height[mask] - HEIGHT_MODELS[model]["func"](dbh[mask], *params)
+                row.update(zip(PARAM_COLUMNS, params))
+                row["model"] = model
+                row["rse"] = np.sqrt((residuals**2).sum() / (mask.sum() - len(params)))
+        rows.append(row)
+
+    return pd.DataFrame(
+        rows, columns=[strata_col, "model", "n_trees"] + PARAM_COLUMNS + ["rse", "data_hash"]
+    )
+
+
+def predict_height(
+    dbh, strata, height_models: pd.DataFrame, strata_col: str = "Strata", max_height: float = 30.0
+) -> np.ndarray:
+    """
+    Estimates tree height (m) from DBH (cm) with the fitted model of each strata, evaluated once
+    per strata with the same kernel used for the fit. Strata without a fitted model use
+    Feldpausch, et al. (2011).
+
+    Parameters:
+    - dbh (array-like): The DBH of each tree in cm.
+    - strata (array-like): The strata of each tree.
+    - height_models (pd.DataFrame): The fits from fit_height_models.
+    - strata_col (str, optional): The strata column of `height_models`. Defaults to "Strata".
+    - max_height (float, optional): The height cap (m), as for Feldpausch. Defaults to 30.
+
+    Returns:
+    - np.ndarray: The height of each tree in m.
+    """
+    dbh = _as_array(dbh)
+    strata_codes, strata_values = pd.factorize(np.asarray(strata))
+    fits = height_models.set_index(strata_col).reindex(strata_values)
+
+    height = height_feldpausch(dbh, max_height)
+    for code, fit in enumerate(fits.itertuples()):
+        if not isinstance(fit.model, str) or fit.model not in HEIGHT_MODELS:
+            continue
+        mask = strata_codes == code
+        model = HEIGHT_MODELS[fit.model]
+        params = [getattr(fit, name) for name in model["params"]]
+        height[mask] = np.minimum(model["func"](dbh[mask], *params), max_height)
+
+    return height
+
+
+def calculate_local_tree_height(
+    df: pd.DataFrame,
+    dbh_col: str,
+    height_models: pd.DataFrame,
+    strata_col: str = "Strata",
+    max_height: float = 30.0,
+    copy: bool = True,
+) -> pd.DataFrame:
+    """
+    Calculates tree height with the locally fitted height-diameter model of each strata, the
+    counterpart of calculate_tree_height for the fits of fit_height_models.
+
+    Parameters:
+    - df (pd.DataFrame): The tree table.
+    - dbh_col (str): The column with the DBH in cm.
+    - height_models (pd.DataFrame): The fits from fit_height_models.
+    - strata_col (str, optional): The strata column of `df` and `height_models`. Defaults to "Strata".
+    - max_height (float, optional): The height cap (m). Defaults to 30.
+    - copy (bool, optional): If False, the 'height' column is added to `df` in place instead of a copy.
+
+    Returns:
+    - pd.DataFrame: The input DataFrame with an additional 'height' column in m.
+    """
+    if copy:
+        df = df.copy()
+    df["height"] = predict_height(
+        df[dbh_col], df[strata_col], height_models, strata_col, max_height
+    )
+
+    return df
@@ -0,0 +1,348 @@
+import numpy as np
+
+# Optional compiled backends for the chained tree level expressions. numba fuses each
+# kernel into a single multithreaded loop and numexpr evaluates it blockwise without
+# full size temporaries. Without either, the plain NumPy expressions are used.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+KERNEL_BACKENDS = [
+    name for name, module in [("numba", numba), ("numexpr", numexpr)] if module
+] + ["numpy"]
+
+_backend = KERNEL_BACKENDS[0]
+
+
+def get_kernel_backend() -> str:
+    """
+    Returns the backend used by the fused kernels: "numba", "numexpr" or "numpy".
+    """
+    return _backend
+
+
+def set_kernel_backend(name: str) -> None:
+    """
+    Selects the backend used by the fused kernels.
+
+    Parameters:
+    - name (str): One of the installed backends listed in KERNEL_BACKENDS.
+    """
+    global _backend
+    if name not in KERNEL_BACKENDS:
+        raise ValueError(
+            f"Kernel backend '{name}' is not available. Installed backends: {KERNEL_BACKENDS}"
+        )
+    _backend = name
+
+
+def _result_dtype(*arrays):
+    return np.result_type(*[array.dtype for array in arrays])
+
+
+def _use_numba(*arrays) -> bool:
+    # the compiled loops run over flat arrays of the same shape; broadcasting inputs use NumPy
+    return _backend == "numba" and all(array.shape == arrays[0].shape for array in arrays)
+
+
+def _numba_out(*arrays) -> np.ndarray:
+    return np.empty(arrays[0].shape, dtype=_result_dtype(*arrays))
+
+
+if numba is not None:
+
+    @numba.njit(parallel=True, cache=True)
+    def _height_feldpausch_numba(dbh, max_height, out):
+        for i in numba.prange(dbh.shape[0]):
+            height = 35.83 - 31.15 * np.exp(-0.029 * dbh[i])
+            out[i] = max_height if height > max_height else height
+
+    @numba.njit(parallel=True, cache=True)
+    def _agb_chave2014_numba(wood_density, height, dbh, out):
+        for i in numba.prange(dbh.shape[0]):
+            out[i] = 0.0673 * (wood_density[i] * height[i] * dbh[i] ** 2) ** 0.976
+
+    @numba.njit(parallel=True, cache=True)
+    def _tree_carbon_numba(biomass, carbon_fraction, root_shoot_ratio, agc, bgc):
+        for i in numba.prange(biomass.shape[0]):
+            aboveground = biomass[i] / 1000 * carbon_fraction
+            agc[i] = aboveground
+            bgc[i] = aboveground * root_shoot_ratio
+
+    @numba.njit(parallel=True, cache=True)
+    def _chave2014_tree_carbon_numba(
+        wood_density, dbh, max_height, carbon_fraction, root_shoot_ratio, agc, bgc
+    ):
+        for i in numba.prange(dbh.shape[0]):
+            height = 35.83 - 31.15 * np.exp(-0.029 * dbh[i])
+            height = max_height if height > max_height else height
+            biomass = 0.0673 * (wood_density[i] * height * dbh[i] ** 2) ** 0.976
+            aboveground = biomass / 1000 * carbon_fraction
+            agc[i] = aboveground
+            bgc[i] = aboveground * root_shoot_ratio
+
+    @numba.njit(parallel=True, cache=True)
+    def _deadwood_dry_matter_numba(diameter, density, transect_l, volume, dry_matter):
+        for i in numba.prange(diameter.shape[0]):
+            deadwood_volume = diameter[i] ** 2 / (8 * transect_l)
+            volume[i] = deadwood_volume
+            dry_matter[i] = deadwood_volume * density[i]
+
+    @numba.njit(parallel=True, cache=True)
+    def _hollow_stump_dry_matter_numba(
+        base_diameter, top_diameter, hollow_base, hollow_top, height, density, out
+    ):
+        for i in numba.prange(base_diameter.shape[0]):
+            solid = (base_diameter[i] + top_diameter[i]) / 200 * height[i] * density[i]
+            hollow = (hollow_base[i] + hollow_top[i]) / 200 * height[i] * density[i]
+            # NaN > 0 is False, so stumps without hollow diameters keep their solid dry matter
+            out[i] = solid - hollow if hollow > 0 else solid
+
+    @numba.njit(parallel=True, cache=True)
+    def _hollow_deadwood_dry_matter_numba(
+        diameter, hollow_1, hollow_2, density, transect_l, solid_diameter, volume, dry_matter
+    ):
+        for i in numba.prange(diameter.shape[0]):
+            if np.isnan(hollow_1[i]):
+                hollow = hollow_2[i]
+            elif np.isnan(hollow_2[i]):
+                hollow = hollow_1[i]
+            else:
+                hollow = (hollow_1[i] + hollow_2[i]) / 2
+            solid = np.sqrt(diameter[i] ** 2 - hollow**2)
+            solid_diameter[i] = solid
+            volume[i] = solid**2 / (8 * transect_l)
+            dry_matter[i] = volume[i] * density[i]
+
+
+_HEIGHT_FELDPAUSCH = "(35.83 - 31.15 * exp(-0.029 * dbh))"
+_AGB_CHAVE2014 = "0.0673 * (wood_density * height * dbh**2) ** 0.976"
+
+
+def _numexpr(expression: str, local_dict: dict, dtype) -> np.ndarray:
+    # numexpr evaluates float constants in double precision; writing into an output
+    # of the input dtype keeps float32 inputs float32 without a full size temporary
+    shape = np.broadcast_shapes(*[np.shape(value) for value in local_dict.values()])
+    out = np.empty(shape, dtype=dtype)
+    return numexpr.evaluate(expression, local_dict=local_dict, out=out, casting="same_kind")
+
+
+def height_feldpausch(dbh: np.ndarray, max_height: float = 30.0) -> np.ndarray:
+    """
+    Fused Feldpausch, et al. (2011) height (m) from DBH (cm), capped at `max_height`.
+    """
+    if _use_numba(dbh):
+        out = _numba_out(dbh)
+        _height_feldpausch_numba(dbh.ravel(), max_height, out.ravel())
+        return out
+    if _backend == "numexpr":
+        # NaN heights stay NaN since NaN > max_height is False
+        return _numexpr(
+            f"where({_HEIGHT_FELDPAUSCH} > max_height, max_height, {_HEIGHT_FELDPAUSCH})",
+            {"dbh": dbh, "max_height": max_height},
+            dbh.dtype,
+        )
+    return np.minimum(35.83 - 31.15 * np.exp(-0.029 * dbh), max_height)
+
+
+def agb_chave2014(
+    wood_density: np.ndarray, height: np.ndarray, dbh: np.ndarray
+) -> np.ndarray:
+    """
+    Fused Chave, et al. (2014) aboveground biomass (kg).
+    """
+    if _use_numba(wood_density, height, dbh):
+        out = _numba_out(wood_density, height, dbh)
+        _agb_chave2014_numba(wood_density.ravel(), height.ravel(), dbh.ravel(), out.ravel())
+        return out
+    if _backend == "numexpr":
+        return _numexpr(
+            _AGB_CHAVE2014,
+            {"wood_density": wood_density, "height": height, "dbh": dbh},
+            _result_dtype(wood_density, height, dbh),
+        )
+    return 0.0673 * ((wood_density * height * dbh**2) ** 0.976)
+
+
+def tree_carbon(
+    biomass: np.ndarray, carbon_fraction: float = 0.47, root_shoot_ratio: float = 0.36
+) -> tuple:
+    """
+    Fused aboveground and belowground carbon (tonnes) from aboveground biomass in kg.
+
+    Returns:
+    - tuple: The aboveground and belowground carbon arrays.
+    """
+    if _use_numba(biomass):
+        agc, bgc = _numba_out(biomass), _numba_out(biomass)
+        _tree_carbon_numba(
+            biomass.ravel(), carbon_fraction, root_shoot_ratio, agc.ravel(), bgc.ravel()
+        )
+        return agc, bgc
+    if _backend == "numexpr":
+        agc = _numexpr(
+            "biomass / 1000 * carbon_fraction",
+            {"biomass": biomass, "carbon_fraction": carbon_fraction},
+            biomass.dtype,
+        )
+        bgc = _numexpr(
+            "agc * root_shoot_ratio",
+            {"agc": agc, "root_shoot_ratio": root_shoot_ratio},
+            biomass.dtype,
+        )
+        return agc, bgc
+    agc = biomass / 1000 * carbon_fraction
+    return agc, agc * root_shoot_ratio
+
+
+def chave2014_tree_carbon(
+    wood_density: np.ndarray,
+    dbh: np.ndarray,
+    max_height: float = 30.0,
+    carbon_fraction: float = 0.47,
+    root_shoot_ratio: float = 0.36,
+) -> tuple:
+    """
+    Fused Feldpausch height, Chave, et al. (2014) aboveground biomass, carbon fraction and
+    root-shoot ratio, from wood density (g/cm3) and DBH (cm) to carbon (tonnes).
+
+    Returns:
+    - tuple: The aboveground and belowground carbon arrays.
+    """
+    if _use_numba(wood_density, dbh):
+        agc, bgc = _numba_out(wood_density, dbh), _numba_out(wood_density, dbh)
+        _chave2014_tree_carbon_numba(
+            wood_density.ravel(),
+            dbh.ravel(),
+            max_height,
+            carbon_fraction,
+            root_shoot_ratio,
+            agc.ravel(),
+            bgc.ravel(),
+        )
+        return agc, bgc
+    height = height_feldpausch(dbh, max_height)
+    biomass = agb_chave2014(wood_density, height, dbh)
+    return tree_carbon(biomass, carbon_fraction, root_shoot_ratio)
+
+
+def deadwood_dry_matter(diameter: np.ndarray, density: np.ndarray, transect_l: int = 100) -> tuple:
+    """
+    Fused lying deadwood volume and dry matter per hectare from the diameter (cm) crossing a
+    transect of length `transect_l` and the wood density (g/cm3) of each piece.
+
+    Returns:
+    - tuple: The deadwood volume and dry matter arrays.
+    """
+    if _use_numba(diameter, density):
+        volume = _numba_out(diameter, density)
+        dry_matter = _numba_out(diameter, density)
+        _deadwood_dry_matter_numba(
+            diameter.ravel(), density.ravel(), transect_l, volume.ravel(), dry_matter.ravel()
+        )
+        return volume, dry_matter
+    if _backend == "numexpr":
+        dtype = _result_dtype(diameter, density)
+        volume = _numexpr(
+            "diameter**2 / (8 * transect_l)",
+            {"diameter": diameter, "transect_l": transect_l},
+            dtype,
+        )
+        dry_matter = _numexpr("volume * density", {"volume": volume, "density": density}, dtype)
+        return volume, dry_matter
+    volume = diameter**2 / (8 * transect_l)
+    return volume, volume * density
+
+
+def hollow_stump_dry_matter(
+    base_diameter: np.ndarray,
+    top_diameter: np.ndarray,
+    hollow_base: np.ndarray,
+    hollow_top: np.ndarray,
+    height: np.ndarray,
+    density: np.ndarray,
+) -> np.ndarray:
+    """
+    Fused stump dry matter (tonnes) from the base and top diameters (cm), less the dry matter of
+    the hollow from the hollow diameters when it is positive.
+    """
+    arrays = (base_diameter, top_diameter, hollow_base, hollow_top, height, density)
+    if _use_numba(*arrays):
+        out = _numba_out(*arrays)
+        _hollow_stump_dry_matter_numba(*[array.ravel() for array in arrays], out.ravel())
+        return out
+    if _backend == "numexpr":
+        names = ["base_diameter", "top_diameter", "hollow_base", "hollow_top", "height", "density"]
+        solid = "(base_diameter + top_diameter) / 200 * height * density"
+        hollow = "(hollow_base + hollow_top) / 200 * height * density"
+        return _numexpr(
+            f"where({hollow} > 0, {solid} - {hollow}, {solid})",
+            dict(zip(names, arrays)),
+            _result_dtype(*arrays),
+        )
+    solid = (base_diameter + top_diameter) / 200 * height * density
+    hollow = (hollow_base + hollow_top) / 200 * height * density
+    return np.where(hollow > 0, solid - hollow, solid)
+
+
+def hollow_deadwood_dry_matter(
+    diameter: np.ndarray,
+    hollow_1: np.ndarray,
+    hollow_2: np.ndarray,
+    density: np.ndarray,
+    transect_l: int = 100,
+) -> tuple:
+    """
+    Fused solid diameter, volume and dry matter per hectare of hollow lying deadwood. The solid
+    diameter has the cross section of the piece less the hollow, whose diameter is the mean of the
+    two hollow diameters (either one if the other is missing).
+
+    Returns:
+    - tuple: The solid diameter, deadwood volume and dry matter arrays.
+    """
+    arrays = (diameter, hollow_1, hollow_2, density)
+    if _use_numba(*arrays):
+        solid_diameter, volume, dry_matter = [_numba_out(*arrays) for _ in range(3)]
+        _hollow_deadwood_dry_matter_numba(
+            *[array.ravel() for array in arrays],
+            transect_l,
+            solid_diameter.ravel(),
+            volume.ravel(),
+            dry_matter.ravel(),
+        )
+        return solid_diameter, volume, dry_matter
+    solid_diameter = solid_lying_diameter(diameter, hollow_1, hollow_2)
+    return (solid_diameter,) + deadwood_dry_matter(solid_diameter, density, transect_l)
+
+
+def solid_lying_diameter(
+    diameter: np.ndarray, hollow_1: np.ndarray, hollow_2: np.ndarray
+) -> np.ndarray:
+    """
+    Diameter (cm) with the cross section of a hollow lying deadwood piece less the hollow.
+    Hollows wider than the piece have no solid part and give NaN.
+    """
+    if _backend == "numexpr":
+        # x != x is the NaN test in numexpr
+        hollow = (
+            "where(hollow_1 != hollow_1, hollow_2, "
+            "where(hollow_2 != hollow_2, hollow_1, (hollow_1 + hollow_2) / 2))"
+        )
+        return _numexpr(
+            f"sqrt(diameter**2 - ({hollow})**2)",
+            {"diameter": diameter, "hollow_1": hollow_1, "hollow_2": hollow_2},
+            _result_dtype(diameter, hollow_1, hollow_2),
+        )
+    hollow = np.where(
+        np.isnan(hollow_1),
+        hollow_2,
+        np.where(np.isnan(hollow_2), hollow_1, (hollow_1 + hollow_2) / 2),
+    )
+    with np.errstate(invalid="ignore"):
+        return np.sqrt(diameter**2 - hollow**2)
@@ -0,0 +1,268 @@
+import datetime
+import json
+import os
+import warnings
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from src.pool_storage import POOL_PARTITIONS, pool_table_exists, read_pool_table, write_pool_table
+from src.settings import (
+    CARBON_POOLS_DATASET_DIR,
+    CARBON_STOCK_OUTDIR,
+    DATA_DIR,
+    GCP_PROJ_ID,
+    PARQUET_DATA_DIR,
+)
+
+# Local DuckDB warehouse, read before going to BigQuery
+WAREHOUSE_DB = DATA_DIR / "warehouse.duckdb"
+
+# Parquet copies of the tables that are not carbon pool datasets
+TABLES_PARQUET_DIR = PARQUET_DATA_DIR / "tables"
+
+# Source, load time and row count of every local copy written by load_table, one JSON file per
+# table so stages loading tables in parallel never overwrite each other's entries
+TABLE_METADATA_DIR = PARQUET_DATA_DIR / "table_metadata"
+
+# Remote BigQuery dataset of each table, and the CSV the pipeline writes it to, if any
+TABLE_SOURCES = {}
+
+
+def register_table(name: str, dataset: str, csv: Path = None) -> None:
+    """
+    Registers a table served by load_table.
+
+    Parameters:
+    - name (str): The name of the table, e.g. "trees". Also the name of the BigQuery and warehouse table.
+    - dataset (str): The BigQuery dataset of the table, e.g. "biomass_inventory".
+    - csv (Path, optional): The CSV written by a pipeline stage. If given, the CSV is the local
+      source of the table and the Parquet copy is rewritten whenever the CSV changes.
+    """
+    TABLE_SOURCES[name] = {"dataset": dataset, "csv": Path(csv) if csv else None}
+
+
+for _name in POOL_PARTITIONS:
+    register_table(_name, "biomass_inventory")
+for _pool in ["litter", "ntv", "trees", "deadwood"]:
+    register_table(
+        f"{_pool}_carbon_stock", "carbon_stock", CARBON_STOCK_OUTDIR / f"{_pool}_carbon_stock.csv"
+    )
+
+_FILTER_OPS = {"=": "=", "==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    raise ValueError(f"Unsupported filter value {value!r}.")
+
+
+def _sql_identifier(col: str, quote: str) -> str:
+    if not col.isidentifier():
+        raise ValueError(f"Unsupported column name '{col}'.")
+    return f"{quote}{col}{quote}"
+
+
+def filters_sql(filters, quote: str = '"') -> str:
+    """
+    Translates pyarrow style row filters to a SQL condition.
+
+    e.g. filters_sql([("nest", "=", 2), ("campaign", "in", ["763932"])])
+    -> "nest" = 2 AND "campaign" IN ('763932')
+
+    Parameters:
+    - filters (list): A list of (column, op, value) tuples that must all hold, or a list of such
+      lists of which any must hold (pyarrow DNF form).
+    - quote (str, optional): The identifier quote, '"' for DuckDB and '`' for BigQuery.
+
+    Returns:
+    - str: The condition, or "TRUE" if there are no filters.
+    """
+    if not filters:
+        return "TRUE"
+    groups = filters if isinstance(filters[0], list) else [filters]
+
+    clauses = []
+    for group in groups:
+        terms = []
+        for col, op, value in group:
+            col = _sql_identifier(col, quote)
+            op = op.lower()
+            if op in ("in", "not in"):
+                values = ", ".join(_sql_literal(v) for v in value)
+                terms.append(f"{col} {op.upper()} ({values})")
+            elif op in _FILTER_OPS:
+                terms.append(f"{col} {_FILTER_OPS[op]} {_sql_literal(value)}")
+            else:
+                raise ValueError(f"Unsupported filter operator '{op}'.")
+        clauses.append("(" + " AND ".join(terms) + ")")
+
+    return " OR ".join(clauses)
+
+
+def _select_sql(table: str, columns: list, filters, quote: str) -> str:
+    projection = ", ".join(_sql_identifier(col, quote) for col in columns) if columns else "*"
+    return f"SELECT {projection} FROM {table} WHERE {filters_sql(filters, quote)}"
+
+
+def _read_metadata(name: str, metadata_dir: Path) -> dict:
+    metadata_path = metadata_dir / f"{name}.json"
+    if not metadata_path.exists():
+        return {}
+    return json.loads(metadata_path.read_text())
+
+
+def _write_metadata(name: str, metadata: dict, metadata_dir: Path) -> None:
+    # written to a temporary file first, so readers never see a partial file
+    metadata_dir.mkdir(parents=True, exist_ok=True)
+    metadata_path = metadata_dir / f"{name}.json"
+    tmp_path = metadata_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(metadata, indent=2, sort_keys=True))
+    os.replace(tmp_path, metadata_path)
+
+
+def _csv_stamp(path: Path) -> list:
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def table_metadata(metadata_dir: Path = TABLE_METADATA_DIR) -> pd.DataFrame:
+    """
+    The freshness of the local copies written by load_table: the source each table was loaded
+    from ("csv", "warehouse" or "bigquery"), when and how many rows.
+    """
+    metadata_dir = Path(metadata_dir)
+    metadata = {
+        path.stem: _read_metadata(path.stem, metadata_dir) for path in metadata_dir.glob("*.json")
+    }
+    entries = pd.DataFrame.from_dict(
+        metadata, orient="index", columns=["source", "loaded_at", "rows"]
+    )
+    entries["loaded_at"] = pd.to_datetime(entries["loaded_at"])
+    return entries.rename_axis("name").sort_index()
+
+
+def _read_warehouse(name: str, columns: list, filters, warehouse_db: Path):
+    # None if the warehouse or the table does not exist
+    if not Path(warehouse_db).exists():
+        return None
+    with duckdb.connect(str(warehouse_db), read_only=True) as db:
+        exists = db.execute(
+            "SELECT COUNT(*) FROM information_schema.tables WHERE table_name = ?", [name]
+        ).fetchone()[0]
+        if not exists:
+            return None
+        return db.execute(_select_sql(f'"{name}"', columns, filters, '"')).fetchdf()
+
+
+def _read_bigquery(name: str, dataset: str, columns: list, filters) -> pd.DataFrame:
+    import pandas_gbq
+
+    query = _select_sql(f"`{GCP_PROJ_ID}.{dataset}.{name}`", columns, filters, "`")
+    return pandas_gbq.read_gbq(query, project_id=GCP_PROJ_ID)
+
+
+def load_table(
+    name: str,
+    columns: list = None,
+    filters=None,
+    refresh: bool = False,
+    pools_dir=CARBON_POOLS_DATASET_DIR,
+    tables_dir=TABLES_PARQUET_DIR,
+    warehouse_db=WAREHOUSE_DB,
+    metadata_dir=TABLE_METADATA_DIR,
+) -> pd.DataFrame:
+    """
+    Loads a table from the nearest source that has it, replacing the "read the local CSV, else
+    query BigQuery and write the CSV" blocks of the notebooks.
+
+    The sources are tried in order:
+    1. The local Parquet copy: the partitioned dataset of a carbon pool table (see
+       src.pool_storage), or a Parquet file in `tables_dir`. A table registered with a CSV is
+       parsed once into its Parquet copy, and again only when the CSV changes.
+    2. The local DuckDB warehouse, if it has a table of that name.
+    3. BigQuery, from the dataset in TABLE_SOURCES.
+
+    The columns and filters are pushed into the source that serves the request: Parquet reads
+    only those columns and row groups (and partitions), the warehouse and BigQuery get them in
+    the SELECT. A table read in full from the warehouse or BigQuery is written to its local copy
+    with its source, load time and row count in `metadata_dir` (see table_metadata). Filtered
+    or projected reads are not copied, so a partial table is never taken for the full one, and
+    neither are carbon pool tables without the campaign column their dataset is partitioned by.
+
+    e.g. load_table("trees", columns=["unique_id", "nest", "DBH"], filters=[("nest", "=", 2)])
+
+    Parameters:
+    - name (str): The name of the table, one of TABLE_SOURCES.
+    - columns (list, optional): The columns to read. Reads all columns if None.
+    - filters (list, optional): Row filters in pyarrow form, e.g. [("campaign", "=", "763932")].
+    - refresh (bool, optional): Skip the local copy and reload the table from the warehouse or
+      BigQuery. Tables with a CSV are always loaded from the CSV.
+    - pools_dir (Path, optional): The carbon pool datasets. Defaults to CARBON_POOLS_DATASET_DIR.
+    - tables_dir (Path, optional): The Parquet copies of the other tables. Defaults to TABLES_PARQUET_DIR.
+    - warehouse_db (Path, optional): The DuckDB warehouse. Defaults to WAREHOUSE_DB.
+    - metadata_dir (Path, optional): The freshness metadata, a JSON file per table. Defaults to TABLE_METADATA_DIR.
+
+    Returns:
+    - pd.DataFrame: The table.
+    """
+    if name not in TABLE_SOURCES:
+        raise ValueError(f"Unknown table '{name}', expected one of {list(TABLE_SOURCES)}.")
+    source = TABLE_SOURCES[name]
+    metadata_dir = Path(metadata_dir)
+    is_pool = name in POOL_PARTITIONS
+    parquet_path = Path(tables_dir) / f"{name}.parquet"
+
+    def has_copy():
+        return pool_table_exists(name, pools_dir) if is_pool else parquet_path.exists()
+
+    def write_copy(df, origin, **extra):
+        if is_pool:
+            if "campaign" not in df.columns:
+                # the dataset is partitioned by campaign, see src.pool_storage
+                warnings.warn(
+                    f"The {name} table from the {origin} has no campaign column, so it is not "
+                    "copied to the local pool dataset and is read from the source again next time."
+                )
+                return
+            write_pool_table(df, name, outdir=pools_dir)
+        else:
+            parquet_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = parquet_path.with_suffix(f".{os.getpid()}.tmp")
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, parquet_path)
+        metadata = {
+            "source": origin,
+            "loaded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "rows": len(df),
+            **extra,
+        }
+        _write_metadata(name, metadata, metadata_dir)
+
+    csv = source["csv"]
+    if csv is not None and csv.exists():
+        stamp = _csv_stamp(csv)
+        if not has_copy() or _read_metadata(name, metadata_dir).get("csv") != stamp:
+            write_copy(pd.read_csv(csv), "csv", csv=stamp)
+        refresh = False
+
+    if not refresh and has_copy():
+        if is_pool:
+            return read_pool_table(name, filters=filters, columns=columns, outdir=pools_dir)
+        return pd.read_parquet(parquet_path, columns=columns, filters=filters)
+
+    df = _read_warehouse(name, columns, filters, warehouse_db)
+    origin = "warehouse"
+    if df is None:
+        df = _read_bigquery(name, source["dataset"], columns, filters)
+        origin = "bigquery"
+    if columns is None and not filters:
+        write_copy(df, origin)
+
+    return df
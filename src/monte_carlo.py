@@ -0,0 +1,255 @@
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.aggregation import GroupIndex
+from src.allometry import ALLOMETRIC_MODELS
+from src.biomass_equations import _as_array
+from src.carbon_stock import LIVING_TREE_PARAMS, _nest_areas, _per_ha_stock, _tree_height
+
+# Largest size (bytes) of the trees x draws arrays of one block
+MONTE_CARLO_BLOCK_BYTES = 64 * 1024**2
+
+# Draws per task. The random stream of each task is spawned from the seed, so the draws
+# depend on the seed but not on the number of worker processes.
+DRAWS_PER_TASK = 100
+
+# Default error sources of the living tree Monte Carlo, see monte_carlo_living_trees
+MONTE_CARLO_PARAMS = {
+    # residual standard error of ln(AGB) per allometric model; models without one have no
+    # allometric error. 0.357 is the RSE of the pantropical model of Chave, et al. (2014)
+    "allometry_rse": {"chave2014": 0.357},
+    # standard deviation of the wood density of each tree (sdWD from BIOMASS::getWoodDensity,
+    # see src/get_wood_density.R); trees without it have no wood density error
+    "wood_density_sd_col": "wood_density_sd",
+    # wood densities are drawn within the range of the global wood density database, as in BIOMASS
+    "wood_density_range": (0.08, 1.39),
+    # standard deviation of ln(height) for trees on Feldpausch, et al. (2011). Strata with a local
+    # fit (params["height_models"]) use the RSE of the fit relative to the predicted height instead
+    "height_sd_log": 0.0,
+}
+
+
+def _tree_inputs(trees: pd.DataFrame, params: dict, errors: dict) -> dict:
+    """
+    The tree arrays and error terms of the trees with an allometric model, sorted by nest.
+    """
+    strata = trees[params["strata_col"]]
+    model_names = strata.map(params["strata_models"])
+    has_model = model_names.notna().to_numpy()
+
+    group_index = GroupIndex(trees, ["unique_id", "nest"], mask=has_model)
+    order = np.argsort(group_index.codes, kind="stable")[int((group_index.codes < 0).sum()) :]
+
+    dbh = _as_array(trees[params["dbh_col"]], np.float64)
+    height = _tree_height(dbh, strata, params)
+    height_sd_log = np.full(len(trees), errors["height_sd_log"], dtype=np.float64)
+    if params["height_models"] is not None:
+        fits = params["height_models"].set_index(params["strata_col"])
+        rse = strata.map(fits["rse"].where(fits["model"] != "feldpausch")).to_numpy(np.float64)
+        local = ~np.isnan(rse)
+        height_sd_log[local] = rse[local] / height[local]
+
+    names = list(pd.unique(model_names[has_model]))
+    uses_wood_density = any("wood_density" in ALLOMETRIC_MODELS[name]["inputs"] for name in names)
+    wood_density = np.full(len(trees), np.nan)
+    wood_density_sd = np.zeros(len(trees))
+    if uses_wood_density:
+        wood_density = _as_array(trees[params["wood_density_col"]], np.float64)
+        if errors["wood_density_sd_col"] in trees:
+            wood_density_sd = np.nan_to_num(
+                _as_array(trees[errors["wood_density_sd_col"]], np.float64)
+            )
+
+    model_codes = pd.Index(names).get_indexer(model_names)
+    return {
+        "dbh": dbh[order],
+        "wood_density": wood_density[order],
+        "wood_density_sd": wood_density_sd[order],
+        "height": height[order],
+        "height_sd_log": height_sd_log[order],
+        "model_codes": model_codes[order],
+        "models": [
+            (
+                ALLOMETRIC_MODELS[name]["func"],
+                ALLOMETRIC_MODELS[name]["inputs"],
+                ALLOMETRIC_MODELS[name]["params"],
+                errors["allometry_rse"].get(name, 0.0),
+            )
+            for name in names
+        ],
+        "nest_codes": group_index.codes[order],
+        "n_nests": group_index.n_groups,
+        "key_frame": group_index.key_frame,
+    }
+
+
+def _monte_carlo_block(
+    seed: np.random.SeedSequence,
+    inputs: dict,
+    n_draws: int,
+    wood_density_range: tuple,
+    max_bytes: int,
+) -> np.ndarray:
+    """
+    Aboveground biomass sums (kg) of each nest for `n_draws` draws of the tree level errors.
+
+    The trees are drawn in blocks of trees x draws that fit `max_bytes`; each block is summed into
+    the nests right away, so the trees x draws arrays of all trees are never held at once.
+
+    Parameters:
+    - seed (np.random.SeedSequence): The seed of the random stream of this task.
+    - inputs (dict): The tree arrays sorted by nest, from _tree_inputs.
+    - n_draws (int): The number of draws.
+    - wood_density_range (tuple): The bounds of the drawn wood densities.
+    - max_bytes (int): Memory guard for the trees x draws arrays of a block.
+
+    Returns:
+    - np.ndarray: The biomass sums, nests x draws.
+    """
+    # one stream per error term, read row by row, so the draws do not depend on the block size
+    wood_density_rng, height_rng, allometry_rng = map(np.random.default_rng, seed.spawn(3))
+    n_trees = len(inputs["dbh"])
+    nest_sums = np.zeros((inputs["n_nests"], n_draws))
+    # wood density, height, error and biomass draws plus the flat model inputs
+    block = max(1, max_bytes // (8 * 8 * n_draws))
+
+    for start in range(0, n_trees, block):
+        rows = slice(start, start + block)
+        n_rows = len(inputs["dbh"][rows])
+        wood_density_error = wood_density_rng.standard_normal((n_rows, n_draws))
+        height_error = height_rng.standard_normal((n_rows, n_draws))
+        allometry_error = allometry_rng.standard_normal((n_rows, n_draws))
+        drawn = {
+            "dbh": np.broadcast_to(inputs["dbh"][rows, None], (n_rows, n_draws)),
+            "wood_density": np.clip(
+                inputs["wood_density"][rows, None]
+                + inputs["wood_density_sd"][rows, None] * wood_density_error,
+                *wood_density_range,
+            ),
+            "height": inputs["height"][rows, None]
+            * np.exp(inputs["height_sd_log"][rows, None] * height_error),
+        }
+
+        biomass = np.full((n_rows, n_draws), np.nan)
+        model_codes = inputs["model_codes"][rows]
+        for code, (func, names, params, rse) in enumerate(inputs["models"]):
+            mask = model_codes == code
+            if not mask.any():
+                continue
+            args = [np.ascontiguousarray(drawn[name][mask]).ravel() for name in names]
+            model_biomass = func(*args, **params).reshape(-1, n_draws)
+            biomass[mask] = model_biomass * np.exp(rse * allometry_error[mask])
+
+        # the trees are sorted by nest, so the nests of the block are contiguous
+        nest_codes = inputs["nest_codes"][rows]
+        starts = np.flatnonzero(np.diff(nest_codes, prepend=-1))
+        nest_sums[nest_codes[starts]] += np.add.reduceat(np.nan_to_num(biomass), starts, axis=0)
+
+    return nest_sums
+
+
+def _draw_summary(draws: np.ndarray, confidence: float) -> dict:
+    # mean, standard deviation and percentile interval of each row of a rows x draws array
+    alpha = 1 - confidence
+    with warnings.catch_warnings():
+        # plots without any nest area are NaN in every draw
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lower, upper = np.nanquantile(draws, [alpha / 2, 1 - alpha / 2], axis=1)
+        return {
+            "mean": np.nanmean(draws, axis=1),
+            "sd": np.nanstd(draws, axis=1, ddof=1),
+            "ci_lower": lower,
+            "ci_upper": upper,
+        }
+
+
+def monte_carlo_living_trees(
+    trees: pd.DataFrame,
+    plot_index: pd.DataFrame,
+    plot_strata: pd.Series,
+    n_draws: int = 1000,
+    params: dict = None,
+    errors: dict = None,
+    seed: int = None,
+    n_jobs: int = 1,
+    confidence: float = 0.95,
+    max_bytes: int = MONTE_CARLO_BLOCK_BYTES,
+) -> tuple:
+    """
+    Propagates the per tree allometric, wood density and height errors through the living tree
+    carbon stock (see src.carbon_stock.living_tree_stock) by Monte Carlo, as in BIOMASS::AGBmonteCarlo.
+
+    In every draw, each tree gets a wood density from N(wood density, sd) within `wood_density_range`,
+    a height from a log-normal error around its model height and an allometric error
+    exp(N(0, RSE)) on its biomass. The draws are summed per nest in blocks of trees, then carried
+    through the carbon fraction, root-shoot ratio and nest areas to the plots and strata.
+    The draws are split into tasks of DRAWS_PER_TASK that can run in worker processes.
+
+    Parameters:
+    - trees (pd.DataFrame): The tree table with unique_id, nest, DBH, wood density and strata columns,
+      and optionally the wood density standard deviation.
+    - plot_index (pd.DataFrame): The corrected nest areas from plot_area_index.
+    - plot_strata (pd.Series): The strata of each plot, indexed by unique_id.
+    - n_draws (int, optional): The number of draws. Defaults to 1000.
+    - params (dict, optional): Overrides of LIVING_TREE_PARAMS.
+    - errors (dict, optional): Overrides of MONTE_CARLO_PARAMS.
+    - seed (int, optional): The seed of the random streams.
+    - n_jobs (int, optional): The number of worker processes. Defaults to 1 (no worker processes).
+    - confidence (float, optional): The level of the percentile intervals. Defaults to 0.95.
+    - max_bytes (int, optional): Memory guard for the trees x draws arrays of a block.
+      Defaults to MONTE_CARLO_BLOCK_BYTES.
+
+    Returns:
+    - pd.DataFrame: Per unique_id, the mean, sd, ci_lower and ci_upper of the draws of each result
+      column, e.g. 'aboveground_CO2e_per_ha_sd'.
+    - pd.DataFrame: The same per strata, from the mean over the plots of the strata in each draw.
+    """
+    if n_draws < 2:
+        raise ValueError(f"At least 2 draws are needed, got {n_draws}.")
+    params = {**LIVING_TREE_PARAMS, **(params or {})}
+    errors = {**MONTE_CARLO_PARAMS, **(errors or {})}
+
+    inputs = _tree_inputs(trees, params, errors)
+    key_frame = inputs.pop("key_frame")
+
+    task_draws = [
+        min(DRAWS_PER_TASK, n_draws - start) for start in range(0, n_draws, DRAWS_PER_TASK)
+    ]
+    seeds = np.random.SeedSequence(seed).spawn(len(task_draws))
+    tasks = [
+        (task_seed, inputs, size, errors["wood_density_range"], max_bytes)
+        for task_seed, size in zip(seeds, task_draws)
+    ]
+    if n_jobs == 1:
+        blocks = [_monte_carlo_block(*task) for task in tasks]
+    else:
+        # spawned rather than forked workers, since forking after numba or BLAS threads have started can deadlock
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as executor:
+            blocks = list(executor.map(_monte_carlo_block, *zip(*tasks)))
+    biomass = np.concatenate(blocks, axis=1)
+    del blocks
+
+    unique_id = key_frame["unique_id"].to_numpy()
+    group_plot, unique_ids = pd.factorize(unique_id)
+    nest_area = _nest_areas(plot_index, unique_id, key_frame["nest"].to_numpy())
+    aboveground_sum = biomass / 1000 * params["carbon_fraction"]
+    per_ha = _per_ha_stock(
+        aboveground_sum, aboveground_sum * params["root_shoot_ratio"], nest_area, group_plot
+    )
+
+    plot_summary = pd.DataFrame({"unique_id": np.asarray(unique_ids)})
+    strata = pd.Series(np.asarray(unique_ids)).map(plot_strata)
+    strata_index = GroupIndex(pd.DataFrame({params["strata_col"]: strata}), [params["strata_col"]])
+    strata_summary = strata_index.key_frame.copy()
+    for col, draws in per_ha.items():
+        for stat, values in _draw_summary(draws, confidence).items():
+            plot_summary[f"{col}_{stat}"] = values
+        for stat, values in _draw_summary(strata_index.mean(draws), confidence).items():
+            strata_summary[f"{col}_{stat}"] = values
+
+    return plot_summary, strata_summary
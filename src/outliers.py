@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from src.aggregation import GroupIndex
+
+# Registered DBH outlier strategies: name -> kernel and the default grouping keys
+OUTLIER_STRATEGIES = {}
+
+
+def register_outlier_strategy(name: str, func, keys: list = None) -> None:
+    """
+    Registers a DBH outlier strategy so it can be selected by name in handle_outliers.
+
+    Parameters:
+    - name (str): The name of the strategy, e.g. "get_ave".
+    - func (callable): A kernel taking the DBH array, a GroupIndex (None if the strategy has no keys)
+      and keyword parameters, returning the new DBH array and a boolean array of the stems to keep.
+    - keys (list, optional): The default grouping keys of the strategy. None for strategies without groups.
+    """
+    OUTLIER_STRATEGIES[name] = {"func": func, "keys": keys}
+
+
+def _group_values(group_index: GroupIndex, group_values: np.ndarray) -> np.ndarray:
+    # broadcast one value per group back to the rows; rows outside any group (code -1) get NaN
+    return np.append(group_values, np.nan)[group_index.codes]
+
+
+def replace_with_group_mean(dbh, group_index, threshold: float = 150):
+    """
+    Replaces DBH at or above `threshold` with the mean DBH of its group (subplot and nest by default).
+    The mean includes the outlier itself, as in the original living trees notebook.
+    """
+    outlier = dbh >= threshold
+    group_mean = _group_values(group_index, group_index.mean(dbh))
+    return np.where(outlier, group_mean, dbh), np.ones(len(dbh), dtype=bool)
+
+
+def drop_outliers(dbh, group_index, threshold: float = 150):
+    """
+    Drops the stems with DBH at or above `threshold`. Stems without DBH are dropped too.
+    """
+    return dbh, dbh < threshold
+
+
+def cap_at_threshold(dbh, group_index, threshold: float = 150):
+    """
+    Sets DBH at or above `threshold` to `threshold`.
+    """
+    return np.where(dbh >= threshold, threshold, dbh), np.ones(len(dbh), dtype=bool)
+
+
+def cap_at_percentile(dbh, group_index, q: float = 0.99):
+    """
+    Caps DBH at the `q` quantile of its group.
+    """
+    cap = _group_values(group_index, group_index.quantile(dbh, q))
+    return np.where(dbh > cap, cap, dbh), np.ones(len(dbh), dtype=bool)
+
+
+def cap_at_mad(dbh, group_index, k: float = 3.5):
+    """
+    Caps DBH more than `k` robust standard deviations (1.4826 x the median absolute deviation)
+    above the median of its group. Only large stems are capped since the nest DBH limits
+    already bound the small ones.
+    """
+    median = _group_values(group_index, group_index.quantile(dbh, 0.5))
+    mad = _group_values(group_index, group_index.quantile(np.abs(dbh - median), 0.5))
+    upper = median + k * 1.4826 * mad
+    return np.where(dbh > upper, upper, dbh), np.ones(len(dbh), dtype=bool)
+
+
+register_outlier_strategy("get_ave", replace_with_group_mean, ["unique_id", "nest"])
+register_outlier_strategy("drop_outliers", drop_outliers)
+register_outlier_strategy("eq_150", cap_at_threshold)
+# the nests have their own DBH ranges, so the distribution based strategies group by nest
+register_outlier_strategy("percentile", cap_at_percentile, ["nest"])
+register_outlier_strategy("mad", cap_at_mad, ["nest"])
+
+
+def handle_outliers(
+    df: pd.DataFrame,
+    strategy: str = "get_ave",
+    dbh_col: str = "DBH",
+    keys: list = None,
+    copy: bool = True,
+    **params,
+) -> tuple:
+    """
+    Handles DBH outliers of living or class 1 dead trees with a named strategy.
+
+    Strategies (see OUTLIER_STRATEGIES):
+    - "get_ave": DBH >= threshold (150 cm) is replaced by the mean DBH of its subplot and nest.
+    - "drop_outliers": stems with DBH >= threshold are removed.
+    - "eq_150": DBH >= threshold is set to the threshold.
+    - "percentile": DBH above the q (0.99) quantile of its nest is capped at that quantile.
+    - "mad": DBH more than k (3.5) robust standard deviations above the median of its nest is capped.
+
+    Parameters:
+    - df (pd.DataFrame): The tree table.
+    - strategy (str, optional): The name of the strategy. Defaults to "get_ave".
+    - dbh_col (str, optional): The DBH column in cm. Defaults to "DBH".
+    - keys (list, optional): Overrides the grouping keys of the strategy, e.g. ["Strata", "nest"].
+    - copy (bool, optional): If False, the DBH column is replaced in place (unless stems are dropped).
+    - params: Parameters of the strategy, e.g. threshold=150, q=0.99 or k=3.5.
+
+    Returns:
+    - pd.DataFrame: The tree table with the outliers handled.
+    - dict: The strategy, the number of stems and the number of stems replaced and dropped.
+    """
+    if strategy not in OUTLIER_STRATEGIES:
+        raise ValueError(
+            f"Unknown outlier strategy '{strategy}'. Use one of {list(OUTLIER_STRATEGIES)}."
+        )
+    func = OUTLIER_STRATEGIES[strategy]["func"]
+    keys = keys or OUTLIER_STRATEGIES[strategy]["keys"]
+
+    dbh = df[dbh_col].to_numpy(dtype=np.float64)
+    group_index = GroupIndex(df, keys) if keys else None
+    new_dbh, keep = func(dbh, group_index, **params)
+
+    changed = keep & ~((new_dbh == dbh) | (np.isnan(new_dbh) & np.isnan(dbh)))
+    report = {
+        "strategy": strategy,
+        "stems": len(df),
+        "replaced": int(changed.sum()),
+        "dropped": int((~keep).sum()),
+    }
+
+    if copy or not keep.all():
+        df = df.copy()
+    df[dbh_col] = new_dbh.astype(np.float32) if df[dbh_col].dtype == np.float32 else new_dbh
+    if not keep.all():
+        df = df[keep]
+
+    return df, report
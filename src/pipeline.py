@@ -0,0 +1,461 @@
+import functools
+import hashlib
+import inspect
+import json
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.cache import _hash_path
+from src.settings import (
+    CARBON_POOLS_DATASET_DIR,
+    CARBON_STOCK_OUTDIR,
+    DATA_DIR,
+    PC_PLOT_LOOKUP_CSV,
+    ROOT_DIR,
+    SPECIES_LOOKUP_CSV,
+    SRC_DIR,
+    TMP_OUT_DIR,
+)
+
+NOTEBOOKS_DIR = ROOT_DIR / "notebooks"
+
+# Fingerprint of every stage at its last successful run
+PIPELINE_STATE_JSON = TMP_OUT_DIR / "pipeline_state.json"
+
+# Executed copies of the stage notebooks, with their outputs
+EXECUTED_NOTEBOOKS_DIR = TMP_OUT_DIR / "executed_notebooks"
+
+# Registered pipeline stages: name -> callable, input and output paths and the code it depends on
+PIPELINE_STAGES = {}
+
+
+def register_stage(
+    name: str, func, inputs: list = None, outputs: list = None, code: list = None
+) -> None:
+    """
+    Registers a pipeline stage. Stages are ordered by their files: a stage that reads the output
+    of another stage runs after it.
+
+    Parameters:
+    - name (str): The name of the stage, e.g. "living_trees".
+    - func (callable): Runs the stage, called with the stage parameters as keyword arguments.
+    - inputs (list, optional): The files or directories the stage reads.
+    - outputs (list, optional): The files or directories the stage writes.
+    - code (list, optional): The source files the stage depends on, besides `func` itself.
+    """
+    PIPELINE_STAGES[name] = {
+        "func": func,
+        "inputs": [Path(path) for path in inputs or []],
+        "outputs": [Path(path) for path in outputs or []],
+        "code": [Path(path) for path in code or []],
+    }
+
+
+def _notebook_code(notebook: Path) -> list:
+    """
+    The notebook and the src modules it imports, directly or through other src modules.
+    """
+    code, pending = [], [Path(notebook)]
+    while pending:
+        path = pending.pop()
+        if path in code or not path.exists():
+            continue
+        code.append(path)
+        modules = re.findall(r"^\s*(?:from|import) src\.(\w+)", path.read_text(), re.MULTILINE)
+        pending.extend(SRC_DIR / f"{module}.py" for module in modules)
+
+    return sorted(code)
+
+
+def parameters_cell(nb) -> int:
+    """
+    The position of the cell with the defaults of the notebook variables: the cell tagged
+    "parameters", else the code cell starting with "# Variables". None if there is neither.
+    """
+    for i, cell in enumerate(nb.cells):
+        if "parameters" in cell.metadata.get("tags", []):
+            return i
+    for i, cell in enumerate(nb.cells):
+        if cell.cell_type == "code" and cell.source.lstrip().startswith("# Variables"):
+            return i
+    return None
+
+
+def execute_notebook(notebook, params: dict = None, output_dir=EXECUTED_NOTEBOOKS_DIR) -> Path:
+    """
+    Executes a jupytext notebook from its directory, like running all of its cells.
+
+    The parameters are set in a cell inserted after the parameters cell (see parameters_cell),
+    so they override the defaults of the notebook. The executed notebook is written to `output_dir`.
+
+    Parameters:
+    - notebook (Path): The .py notebook.
+    - params (dict, optional): Notebook variables to override, e.g. {"OUTLIER_REMOVAL": "mad"}.
+    - output_dir (Path, optional): Where the executed notebook is written. Defaults to EXECUTED_NOTEBOOKS_DIR.
+
+    Returns:
+    - Path: The executed notebook.
+    """
+    import jupytext
+    import nbformat
+    from nbclient import NotebookClient
+
+    notebook = Path(notebook)
+    nb = jupytext.read(notebook)
+    if params:
+        source = "\n".join(f"{name} = {value!r}" for name, value in params.items())
+        position = parameters_cell(nb)
+        if position is None:
+            raise ValueError(f"{notebook.name} has no '# Variables' cell to set {list(params)}.")
+        nb.cells.insert(position + 1, nbformat.v4.new_code_cell(source))
+
+    resources = {"metadata": {"path": str(notebook.parent)}}
+    NotebookClient(nb, timeout=None, resources=resources).execute()
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output = output_dir / f"{notebook.stem}.ipynb"
+    nbformat.write(nb, output)
+
+    return output
+
+
+def register_notebook_stage(
+    name: str, notebook, inputs: list = None, outputs: list = None, code: list = None
+) -> None:
+    """
+    Registers a notebook as a pipeline stage, run with execute_notebook. The notebook and the
+    src modules it imports are part of the fingerprint of the stage, with the other source
+    files in `code` that it runs (e.g. R scripts).
+    """
+    notebook = Path(notebook)
+    # a partial rather than a closure, so the stage can be sent to a worker process
+    run = functools.partial(_run_notebook, notebook)
+    register_stage(name, run, inputs, outputs, _notebook_code(notebook) + list(code or []))
+
+
+def _run_notebook(notebook: Path, **params) -> Path:
+    return execute_notebook(notebook, params)
+
+
+def _func_source(func) -> str:
+    # the source of the stage callable; for a partial, the source of the function and its arguments
+    if isinstance(func, functools.partial):
+        keywords = sorted(func.keywords.items())
+        return _func_source(func.func) + repr((func.args, keywords))
+    try:
+        return inspect.getsource(func)
+    except (OSError, TypeError):
+        return f"{getattr(func, '__module__', '')}.{getattr(func, '__qualname__', repr(func))}"
+
+
+def stage_fingerprint(stage: dict, params: dict = None) -> str:
+    """
+    Hashes the contents of the inputs, the parameters and the code of a stage.
+
+    Parameters:
+    - stage (dict): A registered stage.
+    - params (dict, optional): The parameters of the stage.
+
+    Returns:
+    - str: The sha256 hex digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(_func_source(stage["func"]).encode())
+    for path in stage["code"] + stage["inputs"]:
+        _hash_path(digest, path)
+    digest.update(json.dumps(params or {}, sort_keys=True, default=repr).encode())
+
+    return digest.hexdigest()
+
+
+def stage_order(stages: dict = None, targets: list = None) -> list:
+    """
+    Orders the stages so that every stage comes after the stages writing its inputs.
+
+    Parameters:
+    - stages (dict, optional): The stages by name. Defaults to PIPELINE_STAGES.
+    - targets (list, optional): Only these stages and the stages they depend on. Defaults to all stages.
+
+    Returns:
+    - list: The levels of the pipeline, each a list of stage names that do not depend on each other.
+    """
+    stages = PIPELINE_STAGES if stages is None else stages
+    unknown = sorted(set(targets or []) - set(stages))
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown}. Use any of {list(stages)}.")
+
+    writers = {path: name for name, stage in stages.items() for path in stage["outputs"]}
+    upstream = {
+        name: {
+            writers[path]
+            for path in stage["inputs"]
+            if path in writers and writers[path] != name
+        }
+        for name, stage in stages.items()
+    }
+
+    selected, pending = set(), list(targets or stages)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(upstream[name])
+
+    levels, done = [], set()
+    while len(done) < len(selected):
+        level = [name for name in stages if name in selected - done and upstream[name] <= done]
+        if not level:
+            raise ValueError(f"The stages {sorted(selected - done)} depend on each other.")
+        levels.append(level)
+        done.update(level)
+
+    return levels
+
+
+def downstream_stages(names: list, stages: dict = None) -> set:
+    """
+    The stages that read the outputs of `names`, directly or through other stages.
+    """
+    stages = PIPELINE_STAGES if stages is None else stages
+    affected, pending = set(), list(names)
+    while pending:
+        outputs = set(stages[pending.pop()]["outputs"])
+        for name, stage in stages.items():
+            if name not in affected and outputs & set(stage["inputs"]):
+                affected.add(name)
+                pending.append(name)
+
+    return affected
+
+
+def _read_state(state_path) -> dict:
+    state_path = Path(state_path)
+    return json.loads(state_path.read_text()) if state_path.exists() else {}
+
+
+def _write_state(state: dict, state_path) -> None:
+    state_path = Path(state_path)
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state_path.write_text(json.dumps(state, indent=2, sort_keys=True))
+
+
+def stage_status(name: str, stage: dict, params: dict, state: dict, force: bool = False) -> tuple:
+    """
+    The fingerprint of a stage and whether it has to run: "forced", "changed" (new inputs,
+    parameters or code), "missing_outputs" or "unchanged".
+    """
+    fingerprint = stage_fingerprint(stage, params)
+    if force:
+        return fingerprint, "forced"
+    if state.get(name) != fingerprint:
+        return fingerprint, "changed"
+    if not all(path.exists() for path in stage["outputs"]):
+        return fingerprint, "missing_outputs"
+    return fingerprint, "unchanged"
+
+
+def plan_pipeline(
+    targets: list = None,
+    params: dict = None,
+    force: bool = False,
+    stages: dict = None,
+    state_path=PIPELINE_STATE_JSON,
+) -> list:
+    """
+    Lists what run_pipeline would do, without running anything.
+
+    Stages downstream of a stage that runs are "pending": whether they run depends on the
+    new outputs of that stage.
+
+    Returns:
+    - list: One dict per stage in run order, with the stage, its level and status.
+    """
+    stages = PIPELINE_STAGES if stages is None else stages
+    params = params or {}
+    state = _read_state(state_path)
+
+    plan, running = [], set()
+    for level, names in enumerate(stage_order(stages, targets)):
+        for name in names:
+            _, status = stage_status(name, stages[name], params.get(name), state, force)
+            if status == "unchanged" and name in downstream_stages(running, stages):
+                status = "pending"
+            if status != "unchanged":
+                running.add(name)
+            plan.append({"stage": name, "level": level, "status": status})
+
+    return plan
+
+
+def _run_stage(func, params: dict) -> None:
+    func(**params)
+
+
+def run_pipeline(
+    targets: list = None,
+    params: dict = None,
+    force: bool = False,
+    stages: dict = None,
+    state_path=PIPELINE_STATE_JSON,
+    jobs: int = 1,
+) -> list:
+    """
+    Runs the pipeline stages in dependency order, skipping every stage whose inputs, parameters
+    and code have the same fingerprint as at its last successful run and whose outputs exist.
+
+    The outputs of a stage are the inputs of the stages after it, so a change only re-runs the
+    stages it reaches; if a re-run stage writes the same outputs as before, the stages after it
+    are skipped too. The stages of a level do not depend on each other (e.g. the litter, living
+    tree and deadwood pools) and run in parallel worker processes when `jobs` > 1.
+
+    Parameters:
+    - targets (list, optional): The stages to bring up to date, with the stages they depend on.
+      Defaults to all stages.
+    - params (dict, optional): The parameters of each stage by name, e.g. {"living_trees": {"OUTLIER_REMOVAL": "mad"}}.
+    - force (bool, optional): If True, every selected stage runs. Defaults to False.
+    - stages (dict, optional): The stages by name. Defaults to PIPELINE_STAGES.
+    - state_path (Path, optional): The file with the fingerprints of the last runs. Defaults to PIPELINE_STATE_JSON.
+    - jobs (int, optional): The number of worker processes. Defaults to 1 (stages run in this process).
+
+    Returns:
+    - list: One dict per stage in run order, with the stage, its level and status ("ran" or "skipped").
+    """
+    stages = PIPELINE_STAGES if stages is None else stages
+    params = params or {}
+    state = _read_state(state_path)
+
+    report = []
+    executor = None
+    if jobs > 1:
+        # spawned rather than forked workers, since forking after numba or BLAS threads have started can deadlock
+        context = multiprocessing.get_context("spawn")
+        executor = ProcessPoolExecutor(max_workers=jobs, mp_context=context)
+    try:
+        for level, names in enumerate(stage_order(stages, targets)):
+            to_run = []
+            for name in names:
+                _, status = stage_status(name, stages[name], params.get(name), state, force)
+                if status == "unchanged":
+                    report.append({"stage": name, "level": level, "status": "skipped"})
+                else:
+                    to_run.append(name)
+
+            if executor is None or len(to_run) < 2:
+                results = {}
+                for name in to_run:
+                    try:
+                        _run_stage(stages[name]["func"], params.get(name) or {})
+                        results[name] = None
+                    except Exception as error:
+                        results[name] = error
+                        break
+            else:
+                futures = {
+                    name: executor.submit(_run_stage, stages[name]["func"], params.get(name) or {})
+                    for name in to_run
+                }
+                results = {name: future.exception() for name, future in futures.items()}
+
+            for name, error in results.items():
+                if error is None:
+                    # fingerprinted after the run, since a stage may write files it also reads
+                    # (e.g. pool tables fetched from BigQuery when the local copy is missing)
+                    state[name] = stage_fingerprint(stages[name], params.get(name))
+                    report.append({"stage": name, "level": level, "status": "ran"})
+            _write_state(state, state_path)
+
+            errors = [(name, error) for name, error in results.items() if error is not None]
+            if errors:
+                name, error = errors[0]
+                raise RuntimeError(f"Stage '{name}' failed: {error}") from error
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return report
+
+
+# Production stages, see the notebooks for what each of them does
+_POOL_TABLES = {
+    name: CARBON_POOLS_DATASET_DIR / name
+    for name in [
+        "plot_info",
+        "saplings_ntv_litter",
+        "trees",
+        "stumps",
+        "dead_trees",
+        "lying_deadwood_hollow",
+        "lying_deadwood_wo_hollow",
+    ]
+}
+_HEIGHT_MODELS_CSV = TMP_OUT_DIR / "height_models.csv"
+# written by the activity area notebooks (notebooks/00_eda), which are not pipeline stages; the
+# uncertainty notebook skips the project totals without it, and re-runs once it is written
+_ACTIVITY_AREA_DB = TMP_OUT_DIR / "activity_area.db"
+# run by the living trees and deadwood notebooks with Rscript
+_WOOD_DENSITY_R = SRC_DIR / "get_wood_density.R"
+_STOCK_CSVS = {
+    pool: CARBON_STOCK_OUTDIR / f"{pool}_carbon_stock.csv"
+    for pool in ["litter", "ntv", "trees", "deadwood"]
+}
+
+register_notebook_stage(
+    "carbon_pools",
+    NOTEBOOKS_DIR / "01_biomass_inventory" / "01_export_load_carbon_pools.py",
+    inputs=[
+        DATA_DIR / "csv" / "biomass_inventory_raw.csv",
+        DATA_DIR / "gpkg" / "duplicate_plots_corrected.gpkg",
+    ],
+    outputs=list(_POOL_TABLES.values()),
+)
+register_notebook_stage(
+    "height_models",
+    NOTEBOOKS_DIR / "02_carbon_stock" / "00_height_models.py",
+    inputs=[_POOL_TABLES["dead_trees"], PC_PLOT_LOOKUP_CSV],
+    outputs=[_HEIGHT_MODELS_CSV],
+)
+register_notebook_stage(
+    "ntv_litter",
+    NOTEBOOKS_DIR / "02_carbon_stock" / "01_nontree_litter_biomass.py",
+    inputs=[_POOL_TABLES["plot_info"], _POOL_TABLES["saplings_ntv_litter"]],
+    outputs=[_STOCK_CSVS["litter"], _STOCK_CSVS["ntv"]],
+)
+register_notebook_stage(
+    "living_trees",
+    NOTEBOOKS_DIR / "02_carbon_stock" / "02_living_trees_biomass.py",
+    inputs=[
+        _POOL_TABLES["plot_info"],
+        _POOL_TABLES["trees"],
+        _POOL_TABLES["saplings_ntv_litter"],
+        SPECIES_LOOKUP_CSV,
+        PC_PLOT_LOOKUP_CSV,
+        _HEIGHT_MODELS_CSV,
+    ],
+    outputs=[_STOCK_CSVS["trees"]],
+    code=[_WOOD_DENSITY_R],
+)
+register_notebook_stage(
+    "deadwood",
+    NOTEBOOKS_DIR / "02_carbon_stock" / "03_deadwood_biomass.py",
+    inputs=[
+        _POOL_TABLES["plot_info"],
+        _POOL_TABLES["stumps"],
+        _POOL_TABLES["dead_trees"],
+        _POOL_TABLES["lying_deadwood_hollow"],
+        _POOL_TABLES["lying_deadwood_wo_hollow"],
+        SPECIES_LOOKUP_CSV,
+        PC_PLOT_LOOKUP_CSV,
+        _HEIGHT_MODELS_CSV,
+    ],
+    outputs=[_STOCK_CSVS["deadwood"]],
+    code=[_WOOD_DENSITY_R],
+)
+register_notebook_stage(
+    "uncertainty",
+    NOTEBOOKS_DIR / "02_carbon_stock" / "04_uncertainty_per_strata.py",
+    inputs=[_POOL_TABLES["plot_info"], PC_PLOT_LOOKUP_CSV, _ACTIVITY_AREA_DB]
+    + list(_STOCK_CSVS.values()),
+)
@@ -0,0 +1,127 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.settings import CARBON_POOLS_DATASET_DIR
+
+# Hive partition keys of each carbon pool table. Tables that are recorded per
+# nest are also partitioned by nest so that a single nest can be read on its own.
+POOL_PARTITIONS = {
+    "plot_info": ["campaign"],
+    "saplings_ntv_litter": ["campaign"],
+    "trees": ["campaign", "nest"],
+    "stumps": ["campaign", "nest"],
+    "dead_trees": ["campaign", "nest"],
+    "lying_deadwood_hollow": ["campaign"],
+    "lying_deadwood_wo_hollow": ["campaign"],
+}
+
+PARTITION_TYPES = {
+    "campaign": pa.string(),
+    "nest": pa.int64(),
+}
+
+PANDAS_PARTITION_TYPES = {
+    "campaign": "string",
+    "nest": "Int64",
+}
+
+
+def _partitioning(partition_cols: list) -> ds.Partitioning:
+    schema = pa.schema([(col, PARTITION_TYPES[col]) for col in partition_cols])
+    return ds.partitioning(schema, flavor="hive")
+
+
+def pool_table_path(name: str, outdir=CARBON_POOLS_DATASET_DIR):
+    return outdir / name
+
+
+def pool_table_exists(name: str, outdir=CARBON_POOLS_DATASET_DIR) -> bool:
+    """
+    Checks if a carbon pool table has been written as a partitioned dataset.
+    """
+    path = pool_table_path(name, outdir)
+    return path.exists() and any(path.rglob("*.parquet"))
+
+
+def write_pool_table(
+    df: pd.DataFrame,
+    name: str,
+    campaign: str = None,
+    partition_cols: list = None,
+    outdir=CARBON_POOLS_DATASET_DIR,
+) -> None:
+    """
+    Writes a carbon pool table as a hive-partitioned Parquet dataset, e.g.
+    `trees/campaign=763932/nest=2/part-0.parquet`.
+
+    Only the partitions present in `df` are replaced. Writing a new campaign adds
+    new directories and leaves the partitions of earlier campaigns untouched.
+
+    Parameters:
+    - df (pd.DataFrame): The carbon pool table to write.
+    - name (str): The name of the carbon pool table, e.g. "trees".
+    - campaign (str, optional): The inventory campaign of the records. Required if `df` has no 'campaign' column.
+    - partition_cols (list, optional): The columns to partition by. Defaults to the columns listed in POOL_PARTITIONS.
+    - outdir (Path, optional): The root directory of the datasets. Defaults to CARBON_POOLS_DATASET_DIR.
+    """
+    if partition_cols is None:
+        partition_cols = POOL_PARTITIONS.get(name, ["campaign"])
+
+    if campaign is not None:
+        df = df.assign(campaign=str(campaign))
+    elif "campaign" in partition_cols and "campaign" not in df.columns:
+        raise ValueError(
+            f"Table '{name}' has no campaign column; pass the campaign to write_pool_table."
+        )
+
+    missing_cols = [col for col in partition_cols if col not in df.columns]
+    if missing_cols:
+        raise ValueError(f"Table '{name}' has no partition column(s) {missing_cols}.")
+
+    # nullable dtypes, so rows with a missing partition value are written to the
+    # __HIVE_DEFAULT_PARTITION__ directory and read back as missing
+    df = df.astype({col: PANDAS_PARTITION_TYPES[col] for col in partition_cols})
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    ds.write_dataset(
+        table,
+        pool_table_path(name, outdir),
+        format="parquet",
+        partitioning=_partitioning(partition_cols),
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
+
+
+def read_pool_table(
+    name: str,
+    filters: list = None,
+    columns: list = None,
+    outdir=CARBON_POOLS_DATASET_DIR,
+) -> pd.DataFrame:
+    """
+    Reads a carbon pool table from its partitioned Parquet dataset.
+
+    Filters on partition columns prune whole directories, so only the matching
+    nests and campaigns are scanned.
+
+    Parameters:
+    - name (str): The name of the carbon pool table, e.g. "trees".
+    - filters (list, optional): Row filters in pyarrow DNF form, e.g. [("nest", "=", 2), ("campaign", "in", ["763932"])].
+    - columns (list, optional): The columns to read. Reads all columns if None.
+    - outdir (Path, optional): The root directory of the datasets. Defaults to CARBON_POOLS_DATASET_DIR.
+
+    Returns:
+    - pd.DataFrame: The filtered carbon pool table.
+    """
+    partition_cols = POOL_PARTITIONS.get(name, ["campaign"])
+    table = pq.read_table(
+        pool_table_path(name, outdir),
+        columns=columns,
+        filters=filters,
+        partitioning=_partitioning(partition_cols),
+    )
+
+    return table.to_pandas()
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from src.carbon_stock import LIVING_TREE_PARAMS, _nest_areas, _tree_biomass
+
+# Lower bounds (cm) of the DBH classes; the last class is open ended
+DBH_CLASS_EDGES = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100]
+
+STRUCTURE_COLUMNS = [
+    "stems_per_ha",
+    "basal_area_m2_per_ha",
+    "aboveground_biomass_t_per_ha",
+]
+
+
+def dbh_class_labels(edges: list = DBH_CLASS_EDGES) -> list:
+    """
+    Labels of the DBH classes, e.g. "10-20" and "100+" for the last, open ended class.
+    """
+    edges = [f"{edge:g}" for edge in edges]
+    return [f"{low}-{high}" for low, high in zip(edges[:-1], edges[1:])] + [f"{edges[-1]}+"]
+
+
+def stand_structure(
+    trees: pd.DataFrame,
+    plot_index: pd.DataFrame,
+    dbh_edges: list = DBH_CLASS_EDGES,
+    params: dict = None,
+) -> tuple:
+    """
+    Summarizes the stand structure of every plot and nest by DBH class: stems, basal area and
+    aboveground biomass per hectare.
+
+    All three are counted in a single np.bincount each over the combined (subplot, nest, DBH class)
+    key, so the cost is linear in the number of stems. Nest values are scaled by the corrected nest
+    area and, as in living_tree_stock, the subplot values are the mean over the nests with trees
+    and a known area, so the biomass summed over the classes matches the living tree stock.
+    Stems without DBH are left out; subplots without an allometric model have NaN biomass.
+
+    Parameters:
+    - trees (pd.DataFrame): The tree table with unique_id, nest, DBH, wood density and strata columns.
+    - plot_index (pd.DataFrame): The corrected nest areas from plot_area_index.
+    - dbh_edges (list, optional): The increasing lower bounds (cm) of the DBH classes. Defaults to DBH_CLASS_EDGES.
+    - params (dict, optional): Overrides of LIVING_TREE_PARAMS, used for the biomass.
+
+    Returns:
+    - pd.DataFrame: One row per unique_id and DBH class with the stems, basal area (m2) and
+      aboveground biomass (tonnes) per hectare.
+    - pd.DataFrame: One row per unique_id, nest and DBH class with the stem count and the same
+      per hectare columns, for the nests with trees.
+    """
+    params = {**LIVING_TREE_PARAMS, **(params or {})}
+    dbh_edges = np.asarray(dbh_edges, dtype=np.float64)
+    if len(dbh_edges) == 0 or (np.diff(dbh_edges) <= 0).any():
+        raise ValueError(f"The DBH class edges must be increasing, got {list(dbh_edges)}.")
+    labels = dbh_class_labels(list(dbh_edges))
+
+    plot_codes, unique_ids = pd.factorize(trees["unique_id"], sort=True)
+    nest_codes, nests = pd.factorize(trees["nest"], sort=True)
+    dbh = trees[params["dbh_col"]].to_numpy(dtype=np.float64)
+    dbh_class = np.searchsorted(dbh_edges, dbh, side="right") - 1
+    valid = (plot_codes >= 0) & (nest_codes >= 0) & (dbh_class >= 0) & ~np.isnan(dbh)
+
+    biomass, has_model = _tree_biomass(trees, params)
+    shape = (len(unique_ids), len(nests), len(labels))
+    cells = np.ravel_multi_index((plot_codes[valid], nest_codes[valid], dbh_class[valid]), shape)
+    size = int(np.prod(shape))
+
+    def cell_sums(weights=None):
+        return np.bincount(cells, weights, minlength=size).reshape(shape)
+
+    stems = cell_sums()
+    # basal area (m2) from DBH (cm)
+    basal_area = cell_sums(np.pi / 4 * (dbh[valid] / 100) ** 2)
+    aboveground_biomass = cell_sums(np.nan_to_num(biomass[valid].astype(np.float64))) / 1000
+    modelled = cell_sums(has_model[valid]).sum(axis=(1, 2)) > 0
+
+    # corrected area of every subplot and nest, NaN if unknown or the nest has no trees
+    unique_ids, nests = np.asarray(unique_ids), np.asarray(nests)
+    area = _nest_areas(
+        plot_index, np.repeat(unique_ids, len(nests)), np.tile(nests, len(unique_ids))
+    ).reshape(shape[:2])
+    area[stems.sum(axis=2) == 0] = np.nan
+    with np.errstate(invalid="ignore", divide="ignore"):
+        per_ha = {
+            col: values / area[:, :, None] * 10_000
+            for col, values in zip(STRUCTURE_COLUMNS, [stems, basal_area, aboveground_biomass])
+        }
+    per_ha["aboveground_biomass_t_per_ha"][~modelled] = np.nan
+
+    # mean over the nests of each subplot with trees and an area
+    has_area = ~np.isnan(area)
+    nest_count = has_area.sum(axis=1)[:, None]
+    plot_structure = pd.DataFrame(
+        {
+            "unique_id": np.repeat(unique_ids, len(labels)),
+            "dbh_class": np.tile(labels, len(unique_ids)),
+        }
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for col, values in per_ha.items():
+            total = np.where(has_area[:, :, None], values, 0).sum(axis=1)
+            plot_structure[col] = np.where(nest_count > 0, total / nest_count, np.nan).ravel()
+
+    plot_pos, nest_pos, class_pos = np.unravel_index(np.arange(size), shape)
+    nest_structure = pd.DataFrame(
+        {
+            "unique_id": unique_ids[plot_pos],
+            "nest": nests[nest_pos],
+            "dbh_class": np.asarray(labels)[class_pos],
+            "stems": stems.ravel(),
+        }
+    )
+    for col, values in per_ha.items():
+        nest_structure[col] = values.ravel()
+    nest_structure = nest_structure[(stems.sum(axis=2) > 0)[plot_pos, nest_pos]]
+
+    return plot_structure, nest_structure.reset_index(drop=True)
@@ -0,0 +1,266 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from src.aggregation import GroupIndex
+from src.biomass_equations import (
+    DEFAULT_DENSITY,
+    DENSITY_CLASSES,
+    _as_array,
+    belowground_carbon,
+    carbon,
+    class_density,
+    dry_matter_co2e_per_ha,
+)
+from src.carbon_stock import LIVING_TREE_PARAMS, _nest_areas, _nest_biomass, _per_ha_stock
+
+# Largest size (bytes) of the arrays spanning rows x parameter combinations held at once.
+# Larger sweeps are run over chunks of the parameter axis.
+SWEEP_MAX_BYTES = 256 * 1024**2
+
+
+def parameter_grid(**params) -> pd.DataFrame:
+    """
+    Builds every combination of the given parameter values, one row per combination.
+
+    e.g. parameter_grid(carbon_fraction=[0.45, 0.47], root_shoot_ratio=[0.24, 0.36]) gives 4 rows.
+
+    Parameters:
+    - params: The values of each parameter. A list, tuple or array is a set of values to sweep;
+      anything else (a float, a density class dict) is a single value.
+
+    Returns:
+    - pd.DataFrame: One column per parameter, indexed by 'combination'.
+    """
+    values = {
+        name: list(value) if isinstance(value, (list, tuple, np.ndarray, pd.Series)) else [value]
+        for name, value in params.items()
+    }
+    grid = pd.DataFrame(list(itertools.product(*values.values())), columns=list(values))
+    grid.index.name = "combination"
+
+    return grid
+
+
+def _check_grid(grid: pd.DataFrame, allowed: list) -> None:
+    unknown = sorted(set(grid.columns) - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {unknown}. Use any of {allowed}.")
+    if grid.empty:
+        raise ValueError("The parameter grid has no combinations.")
+
+
+def _chunks(n_rows: int, n_combinations: int, n_arrays: int, max_bytes: int) -> list:
+    """
+    Splits the parameter axis so that `n_arrays` float64 arrays of rows x chunk fit in `max_bytes`.
+    """
+    chunk = max(1, max_bytes // max(8 * n_rows * n_arrays, 1))
+    return [slice(start, start + chunk) for start in range(0, n_combinations, chunk)]
+
+
+def _grid_column(grid: pd.DataFrame, name: str, default, chunk: slice) -> np.ndarray:
+    # one value per combination of the chunk, on the trailing parameter axis
+    if name in grid:
+        return grid[name].to_numpy(dtype=np.float64)[chunk][None, :]
+    return np.full((1, len(grid.index[chunk])), default, dtype=np.float64)
+
+
+def _long_results(grid: pd.DataFrame, chunk: slice, keys: pd.DataFrame, values: dict) -> pd.DataFrame:
+    """
+    Stacks rows x combinations result arrays into a long table, one row per combination and key.
+    """
+    combinations = grid.index[chunk]
+    result = grid.iloc[chunk].reset_index().loc[
+        np.repeat(np.arange(len(combinations)), len(keys))
+    ].reset_index(drop=True)
+    for col in keys.columns:
+        result[col] = np.tile(keys[col].to_numpy(), len(combinations))
+    for col, array in values.items():
+        result[col] = array.T.ravel()
+
+    return result
+
+
+def _sweep_results(grid, chunk_results, plot_strata, key, value_cols, strata_col) -> tuple:
+    plot_results = pd.concat(chunk_results, ignore_index=True)
+
+    # average per strata and combination; grid columns may hold dicts, so group on the combination
+    strata = plot_results[key].map(plot_strata).rename(strata_col)
+    strata_results = (
+        plot_results.groupby([plot_results["combination"], strata])[value_cols]
+        .mean()
+        .reset_index()
+    )
+    strata_results = grid.reset_index().merge(strata_results, on="combination")
+
+    return plot_results, strata_results
+
+
+def sweep_living_trees(
+    trees: pd.DataFrame,
+    plot_index: pd.DataFrame,
+    plot_strata: pd.Series,
+    grid: pd.DataFrame,
+    params: dict = None,
+    max_bytes: int = SWEEP_MAX_BYTES,
+) -> tuple:
+    """
+    Calculates the living tree carbon stock (see src.carbon_stock.living_tree_stock) for every
+    combination of carbon fraction and root-shoot ratio in one run.
+
+    The tree level biomass and the nest sums do not depend on these parameters and are computed once;
+    carbon fraction and root-shoot ratio are linear, so they are broadcast over the nest sums.
+
+    Parameters:
+    - trees (pd.DataFrame): The tree table with unique_id, nest, DBH, wood density and strata columns.
+    - plot_index (pd.DataFrame): The corrected nest areas from plot_area_index.
+    - plot_strata (pd.Series): The strata of each plot, indexed by unique_id.
+    - grid (pd.DataFrame): The combinations from parameter_grid, with 'carbon_fraction' and/or
+      'root_shoot_ratio' columns. Missing parameters take their value from `params`.
+    - params (dict, optional): Overrides of LIVING_TREE_PARAMS for everything else.
+    - max_bytes (int, optional): Memory guard for the nests x combinations arrays. Defaults to SWEEP_MAX_BYTES.
+
+    Returns:
+    - pd.DataFrame: The results per combination and unique_id, with the parameter columns.
+    - pd.DataFrame: The mean of the results per combination and strata.
+    """
+    _check_grid(grid, ["carbon_fraction", "root_shoot_ratio"])
+    params = {**LIVING_TREE_PARAMS, **(params or {})}
+
+    nests = _nest_biomass(trees, params)
+    nest_area = _nest_areas(plot_index, nests["unique_id"], nests["nest"])
+    keys = pd.DataFrame({"unique_id": nests["unique_ids"]})
+    biomass = nests["aboveground_biomass"][:, None]
+
+    chunk_results = []
+    for chunk in _chunks(len(nest_area), len(grid), 12, max_bytes):
+        aboveground_sum = carbon(
+            biomass / 1000, _grid_column(grid, "carbon_fraction", params["carbon_fraction"], chunk)
+        )
+        belowground_sum = belowground_carbon(
+            aboveground_sum,
+            _grid_column(grid, "root_shoot_ratio", params["root_shoot_ratio"], chunk),
+        )
+        per_ha = _per_ha_stock(aboveground_sum, belowground_sum, nest_area, nests["group_plot"])
+        chunk_results.append(_long_results(grid, chunk, keys, per_ha))
+
+    return _sweep_results(
+        grid, chunk_results, plot_strata, "unique_id", list(per_ha), params["strata_col"]
+    )
+
+
+def sweep_litter(
+    df: pd.DataFrame,
+    kdm_col: str,
+    plot_strata: pd.Series,
+    grid: pd.DataFrame,
+    key: str = "unique_id",
+    strata_col: str = "Strata",
+    max_bytes: int = SWEEP_MAX_BYTES,
+) -> tuple:
+    """
+    Calculates the litter or non-tree vegetation carbon stock (see vmd0003_eq1) for every
+    combination of water content and carbon fraction in one run.
+
+    Parameters:
+    - df (pd.DataFrame): The litter table with the wet biomass (kg) of each sample.
+    - kdm_col (str): The column with the wet biomass in kg.
+    - plot_strata (pd.Series): The strata of each plot, indexed by `key`.
+    - grid (pd.DataFrame): The combinations from parameter_grid, with 'water_content' and
+      optionally 'carbon_fraction' (defaults to 0.37) columns.
+    - key (str, optional): The plot key column. Samples of the same plot are averaged. Defaults to "unique_id".
+    - strata_col (str, optional): The name of the strata column of the results. Defaults to "Strata".
+    - max_bytes (int, optional): Memory guard for the samples x combinations arrays. Defaults to SWEEP_MAX_BYTES.
+
+    Returns:
+    - pd.DataFrame: CO2e_per_ha per combination and plot, with the parameter columns.
+    - pd.DataFrame: The mean CO2e_per_ha per combination and strata.
+    """
+    _check_grid(grid, ["water_content", "carbon_fraction"])
+    if "water_content" not in grid:
+        raise ValueError("The parameter grid needs a 'water_content' column.")
+
+    group_index = GroupIndex(df, [key])
+    biomass = _as_array(df[kdm_col])[:, None]
+
+    chunk_results = []
+    for chunk in _chunks(len(df), len(grid), 3, max_bytes):
+        co2e_per_ha = dry_matter_co2e_per_ha(
+            biomass,
+            _grid_column(grid, "water_content", None, chunk),
+            _grid_column(grid, "carbon_fraction", 0.37, chunk),
+        )
+        values = {"CO2e_per_ha": group_index.mean(co2e_per_ha)}
+        chunk_results.append(_long_results(grid, chunk, group_index.key_frame, values))
+
+    return _sweep_results(grid, chunk_results, plot_strata, key, ["CO2e_per_ha"], strata_col)
+
+
+def sweep_lying_deadwood(
+    df: pd.DataFrame,
+    density_col: str,
+    plot_strata: pd.Series,
+    grid: pd.DataFrame,
+    volume_col: str = "deadwood_volume",
+    key: str = "unique_id",
+    strata_col: str = "Strata",
+    max_bytes: int = SWEEP_MAX_BYTES,
+) -> tuple:
+    """
+    Calculates the lying deadwood dry matter per hectare (see vmd0002_eq8a and vmd0002_eq8b) for
+    every density class map in one run.
+
+    The density classes are factorized once and each map is applied to the distinct classes only,
+    with the same lookup as vmd0002_eq8a (see class_density).
+
+    Parameters:
+    - df (pd.DataFrame): The lying deadwood table with the deadwood volume per hectare.
+    - density_col (str): The column with the density class.
+    - plot_strata (pd.Series): The strata of each plot, indexed by `key`.
+    - grid (pd.DataFrame): The combinations from parameter_grid, with a 'density_equivalent' column
+      of dicts (class -> g/cm3) and/or a 'default_density' column.
+    - volume_col (str, optional): The column with the deadwood volume. Defaults to "deadwood_volume".
+    - key (str, optional): The plot key column. Defaults to "unique_id".
+    - strata_col (str, optional): The name of the strata column of the results. Defaults to "Strata".
+    - max_bytes (int, optional): Memory guard for the pieces x combinations arrays. Defaults to SWEEP_MAX_BYTES.
+
+    Returns:
+    - pd.DataFrame: tonnes_dry_matter_ha per combination and plot, with the parameter columns.
+    - pd.DataFrame: The mean tonnes_dry_matter_ha per combination and strata.
+    """
+    _check_grid(grid, ["density_equivalent", "default_density"])
+    density_equivalent = (
+        grid["density_equivalent"]
+        if "density_equivalent" in grid
+        else pd.Series([DENSITY_CLASSES] * len(grid), index=grid.index)
+    )
+    default_density = (
+        grid["default_density"].to_numpy(dtype=np.float64)
+        if "default_density" in grid
+        else np.full(len(grid), DEFAULT_DENSITY)
+    )
+
+    # density of each distinct class under each combination; the last row, for missing
+    # classes (code -1), is the default density
+    class_codes, classes = pd.factorize(df[density_col])
+    classes = np.append(np.asarray(classes, dtype=np.float64), np.nan)
+    densities = np.column_stack(
+        [
+            class_density(classes, mapping, default)
+            for mapping, default in zip(density_equivalent, default_density)
+        ]
+    )
+
+    group_index = GroupIndex(df, [key])
+    volume = _as_array(df[volume_col])[:, None]
+
+    chunk_results = []
+    for chunk in _chunks(len(df), len(grid), 3, max_bytes):
+        density = densities[:, chunk].take(class_codes, axis=0)
+        values = {"tonnes_dry_matter_ha": group_index.sum(volume * density)}
+        chunk_results.append(_long_results(grid, chunk, group_index.key_frame, values))
+
+    return _sweep_results(
+        grid, chunk_results, plot_strata, key, ["tonnes_dry_matter_ha"], strata_col
+    )
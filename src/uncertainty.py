@@ -0,0 +1,520 @@
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from src.aggregation import GroupIndex
+from src.biomass_equations import (
+    calculate_statistics_table,
+    statistics_frame,
+    statistics_from_moments,
+)
+
+# Largest resample count matrix held in memory per block, in bytes
+BOOTSTRAP_BLOCK_BYTES = 256 * 1024**2
+
+BOOTSTRAP_COLUMNS = [
+    "bootstrap_se",
+    "percentile_ci_lower",
+    "percentile_ci_upper",
+    "bca_ci_lower",
+    "bca_ci_upper",
+]
+
+
+def _bootstrap_block(
+    seed: np.random.SeedSequence, wx: np.ndarray, w: np.ndarray, n_resamples: int
+) -> np.ndarray:
+    """
+    Weighted means of `n_resamples` resamples (with replacement) of the rows of a table.
+
+    The resample indices are drawn at once and turned into a count matrix, so that the
+    weighted sums of all resamples are two matrix products.
+
+    Parameters:
+    - seed (np.random.SeedSequence): The seed of the random stream of this block.
+    - wx (np.ndarray): The weighted values, rows x (strata * columns), zero outside the strata of the row.
+    - w (np.ndarray): The weights, rows x strata, zero outside the strata of the row.
+    - n_resamples (int): The number of resamples to draw.
+
+    Returns:
+    - np.ndarray: The weighted means, resamples x strata x columns.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = len(w)
+    indices = rng.integers(0, n_rows, size=(n_resamples, n_rows))
+    indices += np.arange(n_resamples)[:, None] * n_rows
+    counts = np.bincount(indices.ravel(), minlength=n_resamples * n_rows)
+    counts = counts.reshape(n_resamples, n_rows).astype(np.float64)
+    del indices
+
+    weighted_sums = (counts @ wx).reshape(n_resamples, w.shape[1], -1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return weighted_sums / (counts @ w)[:, :, None]
+
+
+def _jackknife_means(values: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """
+    Leave-one-out weighted means of each column, rows x columns.
+    """
+    weighted = values * weights[:, None]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weighted.sum(axis=0) - weighted) / (weights.sum() - weights)[:, None]
+
+
+def _bca_interval(replicates, estimate, jackknife, alpha) -> tuple:
+    """
+    Bias-corrected and accelerated interval of each column of `replicates`.
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        n_valid = (~np.isnan(replicates)).sum(axis=0)
+        below = ((replicates < estimate).sum(axis=0) + (replicates == estimate).sum(axis=0) / 2) / n_valid
+        z0 = norm.ppf(below)
+
+        deviation = jackknife.mean(axis=0) - jackknife
+        acceleration = (deviation**3).sum(axis=0) / (6 * ((deviation**2).sum(axis=0)) ** 1.5)
+
+        bounds = []
+        for z_alpha in norm.ppf([alpha / 2, 1 - alpha / 2]):
+            level = norm.cdf(z0 + (z0 + z_alpha) / (1 - acceleration * (z0 + z_alpha)))
+            bounds.append(
+                [
+                    np.nanquantile(replicates[:, i], q) if np.isfinite(q) else np.nan
+                    for i, q in enumerate(level)
+                ]
+            )
+
+    return tuple(np.array(bound) for bound in bounds)
+
+
+def bootstrap_statistics(
+    df: pd.DataFrame,
+    value_cols: list,
+    by: str = "Strata",
+    weight: str = "subplot_count",
+    n_resamples: int = 2000,
+    confidence: float = 0.90,
+    stratified: bool = True,
+    seed: int = None,
+    n_jobs: int = 1,
+    block_bytes: int = BOOTSTRAP_BLOCK_BYTES,
+) -> pd.DataFrame:
+    """
+    Adds bootstrap standard errors and percentile and BCa confidence intervals of the weighted
+    mean to the statistics of calculate_statistics_table.
+
+    The resamples are drawn in blocks of at most `block_bytes`. Every block has its own random
+    stream spawned from `seed`, so the results depend on the seed but not on `n_jobs`.
+
+    Parameters:
+    - df (pd.DataFrame): The plot level table, e.g. the CO2e per hectare of each plot.
+    - value_cols (list): The columns to summarize, e.g. the carbon pools.
+    - by (str, optional): The strata column. Defaults to "Strata".
+    - weight (str, optional): The column with the weights. Defaults to "subplot_count".
+    - n_resamples (int, optional): The number of bootstrap resamples. Defaults to 2000.
+    - confidence (float, optional): The confidence level of the intervals. Defaults to 0.90, the
+      level of confidence_interval_lower and confidence_interval_upper.
+    - stratified (bool, optional): If True, plots are resampled within their strata. If False, all
+      plots are resampled together, so the number of plots per strata varies between resamples.
+    - seed (int, optional): The seed of the random streams.
+    - n_jobs (int, optional): The number of worker processes. Defaults to 1 (no worker processes).
+    - block_bytes (int, optional): The memory budget of a block of resamples. Defaults to BOOTSTRAP_BLOCK_BYTES.
+
+    Returns:
+    - pd.DataFrame: The output of calculate_statistics_table with the BOOTSTRAP_COLUMNS added.
+    """
+    table = calculate_statistics_table(df, value_cols, by=by, weight=weight)
+    codes, groups = pd.factorize(df[by], sort=True)
+    values = df[value_cols].to_numpy(dtype=np.float64)
+    weights = df[weight].to_numpy(dtype=np.float64)
+
+    # the rows resampled together and the strata they cover
+    if stratified:
+        resample_sets = [(np.flatnonzero(codes == i), [i]) for i in range(len(groups))]
+    else:
+        resample_sets = [(np.flatnonzero(codes >= 0), list(range(len(groups))))]
+
+    tasks, task_sets = [], []
+    set_seeds = np.random.SeedSequence(seed).spawn(len(resample_sets))
+    for set_index, ((rows, set_groups), set_seed) in enumerate(zip(resample_sets, set_seeds)):
+        membership = codes[rows][:, None] == np.array(set_groups)
+        w = weights[rows][:, None] * membership
+        # zero rather than NaN outside the strata of the row, so a missing value only affects its own strata
+        wx = np.where(membership[:, :, None], w[:, :, None] * values[rows][:, None, :], 0)
+        wx = wx.reshape(len(rows), -1)
+
+        # the index and count matrices take 16 bytes per resampled row
+        block_size = max(1, block_bytes // (16 * len(rows)))
+        n_blocks = -(-n_resamples // block_size)
+        for block, block_seed in enumerate(set_seed.spawn(n_blocks)):
+            size = min(block_size, n_resamples - block * block_size)
+            tasks.append((block_seed, wx, w, size))
+            task_sets.append(set_index)
+
+    if n_jobs == 1:
+        blocks = [_bootstrap_block(*task) for task in tasks]
+    else:
+        # spawned rather than forked workers, since forking after numba or BLAS threads have started can deadlock
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as executor:
+            blocks = list(executor.map(_bootstrap_block, *zip(*tasks)))
+
+    # replicates of each strata, resamples x columns
+    replicates = [None] * len(groups)
+    for set_index, (_, set_groups) in enumerate(resample_sets):
+        set_blocks = [block for block, task_set in zip(blocks, task_sets) if task_set == set_index]
+        set_replicates = np.concatenate(set_blocks)
+        for position, group in enumerate(set_groups):
+            replicates[group] = set_replicates[:, position, :]
+
+    alpha = 1 - confidence
+    estimates = table["weighted_mean"].to_numpy().reshape(len(groups), len(value_cols))
+    summary = {col: [] for col in BOOTSTRAP_COLUMNS}
+    for group, (group_replicates, estimate) in enumerate(zip(replicates, estimates)):
+        rows = codes == group
+        jackknife = _jackknife_means(values[rows], weights[rows])
+        bca_lower, bca_upper = _bca_interval(group_replicates, estimate, jackknife, alpha)
+
+        # resamples without plots of the strata (only if not stratified) give NaN and are skipped
+        summary["bootstrap_se"].append(np.nanstd(group_replicates, axis=0, ddof=1))
+        summary["percentile_ci_lower"].append(np.nanquantile(group_replicates, alpha / 2, axis=0))
+        summary["percentile_ci_upper"].append(np.nanquantile(group_replicates, 1 - alpha / 2, axis=0))
+        summary["bca_ci_lower"].append(bca_lower)
+        summary["bca_ci_upper"].append(bca_upper)
+
+    for col, group_values in summary.items():
+        table[col] = np.concatenate(group_values)
+
+    return table
+
+
+def propagate_pool_uncertainty(
+    df: pd.DataFrame,
+    value_cols: list,
+    by: str = "Strata",
+    weight: str = "subplot_count",
+    label_col: str = "tCO2e_per_ha",
+    total_label: str = "all",
+) -> tuple:
+    """
+    Calculates the statistics of the total of several pools per strata from the weighted
+    covariance matrix of the pools, and the contribution of each pool to the total variance.
+
+    The total variance is the sum of the covariance matrix, and the contribution of a pool is its
+    row sum (its variance plus its covariances with the other pools), so the contributions add
+    up to the total. This gives the same statistics as calculate_statistics on the summed column.
+
+    Parameters:
+    - df (pd.DataFrame): The plot level table, e.g. the CO2e per hectare of each plot.
+    - value_cols (list): The pools to add up.
+    - by (str, optional): The strata column. Defaults to "Strata".
+    - weight (str, optional): The column with the weights. Defaults to "subplot_count".
+    - label_col (str, optional): The name of the column holding the pool name. Defaults to "tCO2e_per_ha".
+    - total_label (str, optional): The pool name of the total. Defaults to "all".
+
+    Returns:
+    - pd.DataFrame: The statistics of the total per strata, in the layout of calculate_statistics_table.
+    - pd.DataFrame: Per strata and pool, the weighted mean, variance, covariance with the other
+      pools, variance contribution and its share of the total variance in percent.
+    """
+    codes, groups = pd.factorize(df[by], sort=True)
+    order = np.argsort(codes, kind="stable")
+    order = order[codes[order] >= 0]
+    starts = np.searchsorted(codes[order], np.arange(len(groups)))
+
+    values = df[value_cols].to_numpy(dtype=np.float64)[order]
+    weights = df[weight].to_numpy(dtype=np.float64)[order]
+    group_codes = codes[order]
+
+    # weighted covariance matrix of each strata: groups x pools x pools
+    total_weight = np.add.reduceat(weights, starts)
+    weighted_mean = np.add.reduceat(values * weights[:, None], starts, axis=0) / total_weight[:, None]
+    deviation = values - weighted_mean[group_codes]
+    cross_products = np.einsum("ni,nj->nij", deviation * weights[:, None], deviation)
+    covariance = np.add.reduceat(cross_products, starts, axis=0) / total_weight[:, None, None]
+
+    contribution = covariance.sum(axis=2)
+    total_variance = contribution.sum(axis=1)
+    pool_variance = np.diagonal(covariance, axis1=1, axis2=2)
+
+    stats = statistics_from_moments(total_weight, weighted_mean.sum(axis=1), total_variance)
+    totals = statistics_frame(pd.DataFrame({by: np.asarray(groups)}), [total_label], stats, label_col)
+
+    contributions = statistics_frame(
+        pd.DataFrame({by: np.asarray(groups)}),
+        value_cols,
+        {"weighted_mean": weighted_mean},
+        label_col,
+        columns=["weighted_mean"],
+    )
+    contributions["variance"] = pool_variance.ravel()
+    contributions["covariance_with_other_pools"] = (contribution - pool_variance).ravel()
+    contributions["variance_contribution"] = contribution.ravel()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        contributions["contribution_perc"] = (contribution / total_variance[:, None]).ravel() * 100
+
+    return totals, contributions
+
+
+def stratified_totals(
+    strata_statistics: pd.DataFrame,
+    strata_areas: pd.DataFrame,
+    group_cols: tuple = ("CADT", "ELI_TYPE"),
+    by: str = "Strata",
+    area_col: str = "area_ha",
+    label_col: str = "tCO2e_per_ha",
+    strata_map: dict = None,
+    total_label: str = "all",
+) -> pd.DataFrame:
+    """
+    Area-weighted stratified estimate of the total carbon stock of every area group (e.g. CADT and
+    eligibility type) and of the whole project, from the per hectare statistics of each strata.
+
+    The total of a group is sum_h(A_h * mean_h) and, since the strata are sampled independently,
+    its variance is sum_h(A_h^2 * SE_h^2). All groups and pools are computed at once as the
+    products of the groups x strata area matrix with the strata x pools means and variances.
+    Area in strata without statistics, or without the mean of a pool, is left out of the totals
+    (of that pool) with a warning. A strata with a mean but no standard error (e.g. a single
+    plot) gives a total without a standard error.
+
+    Parameters:
+    - strata_statistics (pd.DataFrame): The strata statistics from calculate_statistics_table,
+      bootstrap_statistics or propagate_pool_uncertainty, with `by`, `label_col`, weighted_mean
+      and standard_error columns.
+    - strata_areas (pd.DataFrame): The area (ha) per group and strata, e.g. from
+      src.duckdb_utils.strata_areas. Repeated rows are added up.
+    - group_cols (tuple, optional): The group columns of `strata_areas`. Defaults to ("CADT", "ELI_TYPE").
+    - by (str, optional): The strata column of both tables. Defaults to "Strata".
+    - area_col (str, optional): The area column of `strata_areas`. Defaults to "area_ha".
+    - label_col (str, optional): The pool column of `strata_statistics`. Defaults to "tCO2e_per_ha".
+    - strata_map (dict, optional): Maps the strata of `strata_areas` to those of the statistics,
+      e.g. {"pre_strata_1": 1}. Every strata of the areas must be mapped.
+    - total_label (str, optional): The group value of the project total rows. Defaults to "all".
+
+    Returns:
+    - pd.DataFrame: One row per group (and the project total) and pool with the area counted in
+      the total of the pool, the total (tCO2e), its standard error, the area-weighted mean per
+      hectare, the 90% confidence interval and the 90% and 95% uncertainty (% of the total).
+    """
+    group_cols = list(group_cols)
+    areas = strata_areas[group_cols + [by, area_col]].copy()
+    area_strata = areas[by]
+    if strata_map is not None:
+        unmapped = ~area_strata.isin(list(strata_map))
+        if unmapped.any():
+            raise ValueError(
+                f"The strata {sorted(map(str, area_strata[unmapped].unique()))} of the areas are "
+                "not in strata_map."
+            )
+        areas[by] = areas[by].map(strata_map)
+
+    means = strata_statistics.pivot_table(
+        index=by, columns=label_col, values="weighted_mean", sort=False
+    )
+    standard_errors = strata_statistics.pivot_table(
+        index=by, columns=label_col, values="standard_error", sort=False
+    ).reindex(index=means.index, columns=means.columns)
+
+    matched = areas[by].isin(means.index)
+    if not matched.all():
+        missing = sorted(map(str, area_strata[~matched].unique()))
+        warnings.warn(
+            f"{areas.loc[~matched, area_col].sum():.2f} ha in strata {missing} "
+            "have no statistics and are left out of the totals."
+        )
+        areas = areas[matched]
+
+    # groups x strata area matrix, with the project total as the last row
+    area_matrix = areas.pivot_table(
+        index=group_cols, columns=by, values=area_col, aggfunc="sum", fill_value=0
+    ).reindex(columns=means.index, fill_value=0)
+    groups = area_matrix.index.to_frame(index=False)
+    groups.loc[len(groups)] = total_label
+    area_matrix = area_matrix.to_numpy(dtype=np.float64)
+    area_matrix = np.vstack([area_matrix, area_matrix.sum(axis=0)])
+
+    # strata x pools cells without a mean are left out of the totals of that pool
+    mean_values = means.to_numpy(dtype=np.float64)
+    missing = np.isnan(mean_values)
+    strata_area = area_matrix[-1]
+    missing_cells = np.nonzero(missing & (strata_area > 0)[:, None])
+    if len(missing_cells[0]):
+        cells = [
+            f"{means.columns[j]} in strata {means.index[i]} ({strata_area[i]:.2f} ha)"
+            for i, j in zip(*missing_cells)
+        ]
+        warnings.warn(f"No mean for {cells}; that area is left out of the totals of the pool.")
+    covered = (~missing).astype(np.float64)
+    se_values = np.where(missing, 0.0, standard_errors.to_numpy(dtype=np.float64))
+
+    total = area_matrix @ np.where(missing, 0.0, mean_values)
+    variance = area_matrix**2 @ se_values**2
+    standard_error = np.sqrt(variance)
+    margin_of_error = norm.ppf(0.95) * standard_error
+    group_area = area_matrix @ covered
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats = {
+            area_col: group_area,
+            "total_tCO2e": total,
+            "standard_error": standard_error,
+            "weighted_mean": total / group_area,
+            "confidence_interval_lower": total - margin_of_error,
+            "confidence_interval_upper": total + margin_of_error,
+            "uncertainty_90": margin_of_error / total * 100,
+            "uncertainty_95": norm.ppf(0.975) * standard_error / total * 100,
+        }
+
+    table = groups.loc[groups.index.repeat(len(means.columns))].reset_index(drop=True)
+    table[label_col] = np.tile(np.asarray(means.columns), len(groups))
+    for name, values in stats.items():
+        table[name] = np.asarray(values).ravel()
+
+    return table
+
+
+class StatisticsCube:
+    """
+    Weighted sufficient statistics (n, sum of w, w * x and w * x^2) of each pool per cell, e.g. per
+    plot and strata. Cells can be added, removed and regrouped without going back to the plot
+    table, and calculate_statistics outputs are derived from the sums.
+
+    Missing pool values are left out of the sums of that pool (the notebook drops them beforehand).
+
+    Parameters:
+    - stats (pd.DataFrame): The sums, indexed by the cell keys, with (statistic, pool) columns.
+    """
+
+    SUMS = ["n", "sum_w", "sum_wx", "sum_wx2"]
+
+    def __init__(self, stats: pd.DataFrame):
+        self.stats = stats.sort_index()
+
+    @property
+    def keys(self) -> list:
+        return list(self.stats.index.names)
+
+    @property
+    def pools(self) -> list:
+        return list(self.stats["n"].columns)
+
+    @classmethod
+    def from_frame(
+        cls, df: pd.DataFrame, keys: list, value_cols: list, weight: str = "subplot_count"
+    ) -> "StatisticsCube":
+        """
+        Builds the cube of a plot table.
+
+        Parameters:
+        - df (pd.DataFrame): The plot level table.
+        - keys (list): The cell keys, e.g. ["Strata", "plot_code_nmbr"].
+        - value_cols (list): The pools, e.g. the CO2e per hectare columns.
+        - weight (str, optional): The column with the weights. Defaults to "subplot_count".
+
+        Returns:
+        - StatisticsCube: The sums of each cell and pool.
+        """
+        group_index = GroupIndex(df, keys)
+        values = df[value_cols].to_numpy(dtype=np.float64)
+        present = ~np.isnan(values)
+        weights = np.where(present, df[weight].to_numpy(dtype=np.float64)[:, None], 0)
+        weighted = np.where(present, weights * values, 0)
+
+        sums = {
+            "n": group_index.sum(present.astype(np.float64)),
+            "sum_w": group_index.sum(weights),
+            "sum_wx": group_index.sum(weighted),
+            "sum_wx2": group_index.sum(weighted * np.where(present, values, 0)),
+        }
+        stats = pd.concat(
+            {name: pd.DataFrame(sums[name], columns=value_cols) for name in cls.SUMS}, axis=1
+        )
+        stats.index = pd.MultiIndex.from_frame(group_index.key_frame)
+
+        return cls(stats)
+
+    def _combine(self, other: "StatisticsCube", sign: int) -> "StatisticsCube":
+        if other.keys != self.keys or other.pools != self.pools:
+            raise ValueError(
+                f"Cannot combine a cube of {other.keys} x {other.pools} with a cube of {self.keys} x {self.pools}."
+            )
+        stats = self.stats.add(sign * other.stats, fill_value=0)
+        if (stats["n"] < 0).any().any():
+            raise ValueError("Removing plots that are not in the cube.")
+        # drop the cells left without plots
+        stats = stats[stats["n"].sum(axis=1) > 0]
+
+        return StatisticsCube(stats)
+
+    def merge(self, other: "StatisticsCube") -> "StatisticsCube":
+        """
+        Adds the sums of another cube, e.g. of a new inventory campaign.
+        """
+        return self._combine(other, 1)
+
+    def add(self, df: pd.DataFrame, weight: str = "subplot_count") -> "StatisticsCube":
+        """
+        Adds plots to the cube.
+        """
+        return self.merge(StatisticsCube.from_frame(df, self.keys, self.pools, weight))
+
+    def remove(self, df: pd.DataFrame, weight: str = "subplot_count") -> "StatisticsCube":
+        """
+        Removes plots from the cube, e.g. before adding them back with a new strata.
+        """
+        return self._combine(StatisticsCube.from_frame(df, self.keys, self.pools, weight), -1)
+
+    def regroup(self, keys, mapping: dict = None) -> "StatisticsCube":
+        """
+        Sums the cells to coarser keys, optionally relabelling the values of a key first.
+
+        Parameters:
+        - keys (str or list): The keys to keep, e.g. "Strata".
+        - mapping (dict, optional): New values of the kept keys, by key, e.g. {"Strata": {5: 4}} to merge strata 5 into strata 4.
+
+        Returns:
+        - StatisticsCube: The cube of the new cells.
+        """
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        index = self.stats.index.to_frame(index=False)[keys]
+        for key, key_mapping in (mapping or {}).items():
+            index[key] = index[key].replace(key_mapping)
+
+        stats = self.stats.set_axis(pd.MultiIndex.from_frame(index), axis=0)
+        return StatisticsCube(stats.groupby(level=keys).sum())
+
+    def statistics(self, label_col: str = "tCO2e_per_ha") -> pd.DataFrame:
+        """
+        Derives the calculate_statistics outputs of every cell and pool.
+
+        Returns:
+        - pd.DataFrame: The layout of calculate_statistics_table, with one key column per cube key.
+        """
+        sum_w = self.stats["sum_w"].to_numpy()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weighted_mean = self.stats["sum_wx"].to_numpy() / sum_w
+            variance = np.maximum(self.stats["sum_wx2"].to_numpy() / sum_w - weighted_mean**2, 0)
+            stats = statistics_from_moments(sum_w, weighted_mean, variance)
+
+        group_keys = self.stats.index.to_frame(index=False)
+        return statistics_frame(group_keys, self.pools, stats, label_col)
+
+    def to_parquet(self, path) -> None:
+        """
+        Writes the cube to a Parquet file, with one "statistic:pool" column per sum.
+        """
+        table = self.stats.copy()
+        table.columns = [f"{name}:{pool}" for name, pool in table.columns]
+        table.reset_index().to_parquet(path, index=False)
+
+    @classmethod
+    def read_parquet(cls, path, keys: list) -> "StatisticsCube":
+        """
+        Reads a cube written by to_parquet.
+        """
+        table = pd.read_parquet(path).set_index(keys)
+        table.columns = pd.MultiIndex.from_tuples([tuple(col.split(":", 1)) for col in table.columns])
+        return cls(table)
@@ -0,0 +1,179 @@
+import warnings
+
+import pandas as pd
+
+from src.biomass_equations import calculate_statistics_table
+from src.carbon_stock import LIVING_TREE_PARAMS
+from src.outliers import handle_outliers
+from src.sweeps import sweep_living_trees
+
+# Living tree parameters that are broadcast over the nest sums instead of re-running the trees
+SWEEP_PARAMS = ["carbon_fraction", "root_shoot_ratio"]
+
+
+def plot_level_stock(
+    stock: pd.DataFrame,
+    plot_lookup: pd.DataFrame,
+    value_cols: list,
+    plot_col: str = "plot_code_nmbr",
+    by: str = "Strata",
+) -> pd.DataFrame:
+    """
+    Averages subplot results per plot, with the number of subplots of each plot as 'subplot_count',
+    as in the uncertainty per strata notebook. Plots without any value are dropped.
+
+    Parameters:
+    - stock (pd.DataFrame): The results per unique_id.
+    - plot_lookup (pd.DataFrame): The unique_id, plot and strata of every subplot.
+    - value_cols (list): The result columns to average.
+    - plot_col (str, optional): The plot column. Defaults to "plot_code_nmbr".
+    - by (str, optional): The strata column. Defaults to "Strata".
+
+    Returns:
+    - pd.DataFrame: One row per plot with `plot_col`, `by`, `value_cols` and subplot_count.
+    """
+    subplots = plot_lookup[["unique_id", plot_col, by]].merge(
+        stock[["unique_id"] + list(value_cols)], on="unique_id", how="left"
+    )
+    plot_stock = subplots.groupby([plot_col, by])[value_cols].mean().reset_index()
+    subplot_count = subplots.groupby(plot_col)["unique_id"].count().rename("subplot_count")
+    plot_stock = plot_stock.merge(subplot_count, on=plot_col, how="left")
+
+    return plot_stock.dropna(subset=value_cols, how="all")
+
+
+def attach_wood_density(
+    trees: pd.DataFrame,
+    wood_densities: pd.DataFrame,
+    keys: tuple = ("unique_id", "code_species", "code_family"),
+    value_cols: tuple = ("wood_density", "wood_density_sd"),
+) -> pd.DataFrame:
+    """
+    Adds the wood densities looked up by the living trees notebook (src/get_wood_density.R) to
+    raw tree rows, so that the variants start from the DBH before any outlier handling.
+
+    BIOMASS assigns the wood density from the taxonomy and the stand (subplot) of a tree only, so it
+    is matched by subplot and species rather than by row.
+
+    Parameters:
+    - trees (pd.DataFrame): The raw tree rows with the `keys` columns.
+    - wood_densities (pd.DataFrame): The trees with wood density, e.g. trees_with_wood_density.csv.
+    - keys (tuple, optional): The columns the wood density depends on.
+    - value_cols (tuple, optional): The wood density columns to add, those missing from `wood_densities` are skipped.
+
+    Returns:
+    - pd.DataFrame: `trees` with the wood density columns. Trees without a match get NaN, with a warning.
+    """
+    keys = list(keys)
+    value_cols = [col for col in value_cols if col in wood_densities]
+    lookup = wood_densities[keys + value_cols].drop_duplicates(subset=keys)
+    result = trees.drop(columns=value_cols, errors="ignore").merge(
+        lookup, on=keys, how="left", indicator=True
+    )
+
+    unmatched = int((result.pop("_merge") == "left_only").sum())
+    if unmatched:
+        warnings.warn(f"{unmatched} trees have no wood density for their subplot and species.")
+
+    return result
+
+
+def _outlier_spec(outliers) -> dict:
+    # a strategy name or a dict with "strategy" and its parameters
+    spec = {"strategy": outliers} if isinstance(outliers, str) else dict(outliers or {})
+    if spec and "strategy" not in spec:
+        raise ValueError(f"Outlier settings {spec} need a 'strategy'.")
+    return spec
+
+
+def run_variants(
+    trees: pd.DataFrame,
+    plot_index: pd.DataFrame,
+    plot_lookup: pd.DataFrame,
+    variants: dict,
+    value_cols: tuple = ("aboveground_CO2e_per_ha", "belowground_CO2e_per_ha"),
+    plot_col: str = "plot_code_nmbr",
+    by: str = "Strata",
+) -> tuple:
+    """
+    Runs several outlier or parameter variants of the living tree calculation in one process and
+    summarizes each of them with calculate_statistics_table.
+
+    The loaded trees, plot index and wood densities are shared. Variants with the same outlier
+    settings and allometry reuse one pass over the trees: their carbon fraction and root-shoot ratio
+    are broadcast over the nest sums (see src.sweeps.sweep_living_trees).
+
+    e.g. variants = {
+        "avg_substitution": {"outliers": "get_ave"},
+        "remove_trees_150": {"outliers": "drop_outliers"},
+        "capped_150": {"outliers": "eq_150"},
+        "mad": {"outliers": {"strategy": "mad", "k": 3}},
+        "cf_045": {"outliers": "get_ave", "params": {"carbon_fraction": 0.45}},
+    }
+
+    Parameters:
+    - trees (pd.DataFrame): The tree table with unique_id, nest, DBH, wood density and strata columns.
+    - plot_index (pd.DataFrame): The corrected nest areas from plot_area_index.
+    - plot_lookup (pd.DataFrame): The unique_id, plot and strata of every subplot.
+    - variants (dict): The settings of each variant by name: "outliers" (a strategy name or a dict
+      for handle_outliers, None to keep the trees as they are) and "params" (overrides of LIVING_TREE_PARAMS).
+    - value_cols (tuple, optional): The result columns to summarize. Defaults to the aboveground and
+      belowground CO2e per hectare.
+    - plot_col (str, optional): The plot column of `plot_lookup`. Defaults to "plot_code_nmbr".
+    - by (str, optional): The strata column of `plot_lookup`. Defaults to "Strata".
+
+    Returns:
+    - pd.DataFrame: The strata statistics of every variant, keyed by 'variant'.
+    - pd.DataFrame: The outlier report (stems replaced and dropped) of every variant.
+    """
+    value_cols = list(value_cols)
+    plot_strata = plot_lookup.drop_duplicates("unique_id").set_index("unique_id")[by]
+
+    # variants that only differ in the swept parameters share the outlier handling and allometry
+    batches = {}
+    for name, settings in variants.items():
+        unknown = sorted(set(settings) - {"outliers", "params"})
+        if unknown:
+            raise ValueError(f"Unknown settings {unknown} for variant '{name}'.")
+        outliers = _outlier_spec(settings.get("outliers"))
+        params = {**LIVING_TREE_PARAMS, **settings.get("params", {})}
+        shared = {key: value for key, value in params.items() if key not in SWEEP_PARAMS}
+        batch_key = repr((sorted(outliers.items()), sorted(shared.items(), key=lambda x: x[0])))
+        batch = batches.setdefault(
+            batch_key, {"outliers": outliers, "params": shared, "variants": []}
+        )
+        batch["variants"].append((name, [params[key] for key in SWEEP_PARAMS]))
+
+    statistics, reports = [], []
+    for batch in batches.values():
+        outliers = dict(batch["outliers"])
+        if outliers:
+            batch_trees, report = handle_outliers(
+                trees, outliers.pop("strategy"), batch["params"]["dbh_col"], **outliers
+            )
+        else:
+            batch_trees = trees
+            report = {"strategy": None, "stems": len(trees), "replaced": 0, "dropped": 0}
+
+        names = [name for name, _ in batch["variants"]]
+        grid = pd.DataFrame(
+            [values for _, values in batch["variants"]], columns=SWEEP_PARAMS
+        ).rename_axis("combination")
+        plot_results, _ = sweep_living_trees(
+            batch_trees, plot_index, plot_strata, grid, batch["params"]
+        )
+
+        for combination, name in enumerate(names):
+            stock = plot_results[plot_results["combination"] == combination]
+            plot_stock = plot_level_stock(stock, plot_lookup, value_cols, plot_col, by)
+            table = calculate_statistics_table(plot_stock, value_cols, by, "subplot_count")
+            table.insert(0, "variant", name)
+            statistics.append(table)
+            reports.append({"variant": name, **report})
+
+    order = {name: i for i, name in enumerate(variants)}
+    statistics = pd.concat(statistics, ignore_index=True)
+    statistics = statistics.sort_values("variant", key=lambda s: s.map(order), kind="stable")
+    reports = pd.DataFrame(reports).sort_values("variant", key=lambda s: s.map(order))
+
+    return statistics.reset_index(drop=True), reports.reset_index(drop=True)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def make_inventory():
+    """
+    A factory of synthetic tree inventories: make_inventory(n_trees, n_subplots, seed) returns
+    the trees (unique_id, nest, DBH, wood_density, Strata) and their plot_info.
+    """
+
+    def make(n_trees=500, n_subplots=20, seed=0):
+        rng = np.random.default_rng(seed)
+        unique_ids = np.array([f"{i}A1" for i in range(n_subplots)])
+        plot_info = pd.DataFrame(
+            {
+                "unique_id": unique_ids,
+                "corrected_plot_area_n2_m2": rng.uniform(78, 90, n_subplots),
+                "corrected_plot_area_n3_m2": rng.uniform(706, 800, n_subplots),
+                "corrected_plot_area_n4_m2": rng.uniform(1256, 1400, n_subplots),
+            }
+        )
+        trees = pd.DataFrame(
+            {
+                "unique_id": unique_ids[rng.integers(0, n_subplots, n_trees)],
+                "nest": rng.integers(2, 5, n_trees),
+                "DBH": rng.uniform(5, 120, n_trees),
+                "wood_density": rng.uniform(0.3, 0.9, n_trees),
+            }
+        )
+        # strata 7 is not mapped to any allometric equation
+        strata = pd.DataFrame({"unique_id": unique_ids, "Strata": rng.integers(1, 8, n_subplots)})
+        return trees.merge(strata, on="unique_id", how="left"), plot_info
+
+    return make
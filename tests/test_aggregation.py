@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.aggregation import GroupIndex
+from src.biomass_equations import vmd0001_eq2a, vmd0002_eq3
+
+
+def make_table(n_rows=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        {
+            "unique_id": rng.choice(["1A1", "1A2", "2B1", None], n_rows),
+            "nest": rng.integers(2, 5, n_rows),
+            "aboveground_carbon_tonnes": rng.uniform(0, 2, n_rows),
+            "tonnes_dry_matter": rng.uniform(0, 1, n_rows),
+        }
+    )
+    df.loc[::9, "tonnes_dry_matter"] = np.nan
+    return df
+
+
+def test_group_index_matches_groupby():
+    df = make_table()
+    keys = ["unique_id", "nest"]
+    value_cols = ["aboveground_carbon_tonnes", "tonnes_dry_matter"]
+    group_index = GroupIndex(df, keys)
+
+    for func in ["sum", "mean", "count"]:
+        expected = getattr(df.groupby(keys)[value_cols], func)().reset_index()
+        actual = group_index.aggregate(df, value_cols, func)
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False)
+
+
+def test_shared_group_index():
+    df = make_table()
+    keys = ["unique_id", "nest"]
+    group_index = GroupIndex(df, keys)
+
+    pd.testing.assert_frame_equal(
+        vmd0001_eq2a(df, keys, "aboveground_carbon_tonnes", group_index),
+        df.groupby(keys)[["aboveground_carbon_tonnes"]].sum().reset_index(),
+        check_exact=False,
+    )
+    pd.testing.assert_frame_equal(
+        vmd0002_eq3(df, keys, "tonnes_dry_matter", group_index),
+        df.groupby(keys)[["tonnes_dry_matter"]].sum().reset_index(),
+        check_exact=False,
+    )
+
+
+def test_group_index_check():
+    df = make_table()
+    keys = ["unique_id", "nest"]
+    group_index = GroupIndex(df, keys)
+    group_index.check(df.assign(tonnes_dry_matter=0.0), keys)
+    # other arrays with the same keys, e.g. a copy with another index
+    group_index.check(df.copy(deep=True).set_axis(range(1, len(df) + 1)), keys)
+
+    # a key changed in place no longer matches
+    changed = df.copy(deep=False)
+    changed.loc[changed.index[0], "nest"] = 99
+    with pytest.raises(ValueError, match="other"):
+        group_index.check(changed, keys)
+
+    # another table of the same length
+    with pytest.raises(ValueError, match="other"):
+        vmd0001_eq2a(make_table(seed=1), keys, "aboveground_carbon_tonnes", group_index)
+    with pytest.raises(ValueError):
+        group_index.check(df, ["unique_id"])
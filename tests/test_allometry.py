@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.allometry import (
+    ALLOMETRIC_MODELS,
+    allometric_by_strata,
+    register_allometric_model,
+)
+from src.biomass_equations import allometric_peatland_tree, allometric_tropical_tree
+
+
+def test_allometric_by_strata_matches_split_and_concat():
+    trees = pd.DataFrame(
+        {
+            "DBH": [10.0, 25.0, 40.0, 60.0],
+            "wood_density": [0.5, 0.6, np.nan, 0.7],
+            "height": [12.0, 18.0, 22.0, 26.0],
+            "Strata": [1, 4, 2, 6],
+        }
+    )
+    expected = pd.concat(
+        [
+            allometric_tropical_tree(
+                trees.loc[trees["Strata"].isin([1, 2, 3])], "wood_density", "DBH", "height"
+            ),
+            allometric_peatland_tree(trees.loc[trees["Strata"].isin([4, 5, 6])], "DBH"),
+        ]
+    ).sort_index()
+
+    actual = allometric_by_strata(trees, "Strata", "DBH", "wood_density", "height")
+
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_registered_model_and_unknown_strata():
+    register_allometric_model("constant", lambda dbh, value: np.full(len(dbh), value), ["dbh"], value=5.0)
+    trees = pd.DataFrame({"DBH": [10.0, 20.0, 30.0], "Strata": [1, 2, 9]})
+
+    try:
+        with pytest.warns(UserWarning, match="1 trees have no allometric model"):
+            actual = allometric_by_strata(trees, "Strata", "DBH", strata_models={1: "constant", 2: "alibo2012"})
+    finally:
+        ALLOMETRIC_MODELS.pop("constant")
+
+    assert actual["aboveground_biomass"].iloc[0] == 5.0
+    assert actual["aboveground_biomass"].iloc[1] == pytest.approx(21.297 - 67.953 * 20 + 0.74 * 400)
+    assert np.isnan(actual["aboveground_biomass"].iloc[2])
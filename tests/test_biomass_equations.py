@@ -0,0 +1,188 @@
+import numpy as np
+import pandas as pd
+
+from src.biomass_equations import (
+    STATISTICS_COLUMNS,
+    allometric_peatland_tree,
+    allometric_tropical_tree,
+    calculate_statistics,
+    calculate_statistics_table,
+    class_density,
+    get_solid_diamter,
+    calculate_tree_height,
+    height_trigonometric,
+    sapling_carbon,
+    vmd0001_eq1,
+    vmd0001_eq2b,
+    vmd0001_eq5,
+    vmd0002_eq1,
+    vmd0002_eq2,
+    vmd0002_eq7,
+    vmd0002_eq7_eq8a,
+    vmd0002_eq8a,
+)
+
+def make_trees():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "DBH": np.append(rng.uniform(5, 120, 50), np.nan),
+            "wood_density": np.append(rng.uniform(0.3, 0.9, 50), 0.5),
+            "count_saplings": np.append(rng.integers(0, 40, 50).astype(float), np.nan),
+            "area": 100.0,
+        }
+    )
+
+
+POOLS = ["belowground_CO2e_per_ha", "aboveground_CO2e_per_ha", "litter_CO2e_per_ha"]
+
+
+def test_calculate_statistics_table_matches_loop():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.gamma(2, 50, (200, len(POOLS))), columns=POOLS)
+    data["Strata"] = rng.integers(1, 5, 200)
+    data["subplot_count"] = rng.integers(1, 5, 200)
+
+    rows = []
+    for strata, group in data.groupby("Strata"):
+        for column in POOLS:
+            stats = calculate_statistics(group, column)
+            stats["Strata"] = strata
+            stats["tCO2e_per_ha"] = column.split("_")[0]
+            rows.append(stats)
+    expected = pd.DataFrame(rows)[["Strata", "tCO2e_per_ha"] + STATISTICS_COLUMNS]
+
+    actual = calculate_statistics_table(data, POOLS)
+    pd.testing.assert_frame_equal(actual, expected, check_exact=False)
+
+
+def test_density_class_lookup():
+    classes = pd.Series([1, 2.0, 3, np.nan, 4, -1, 1.5])
+    np.testing.assert_array_equal(
+        class_density(classes), [0.54, 0.35, 0.21, 0.21, 0.21, 0.21, 0.21]
+    )
+    np.testing.assert_array_equal(
+        class_density(classes, {1: 0.6, 4: 0.1}, 0.3)[:5], [0.6, 0.3, 0.3, 0.3, 0.1]
+    )
+
+    rng = np.random.default_rng(0)
+    ldw = pd.DataFrame(
+        {"diameter": rng.uniform(10, 150, 100), "density": rng.choice([1, 2, 3, np.nan], 100)}
+    )
+    expected = vmd0002_eq8a(vmd0002_eq7(ldw, "diameter", 80), "density")
+    pd.testing.assert_frame_equal(vmd0002_eq7_eq8a(ldw, "diameter", "density", 80), expected)
+
+
+def test_hollow_stumps_and_lying_deadwood():
+    rng = np.random.default_rng(0)
+    hollow = pd.Series(np.where(rng.random(100) < 0.5, np.nan, rng.uniform(0, 15, 100)))
+    pieces = pd.DataFrame(
+        {
+            "diameter": rng.uniform(20, 80, 100),
+            "top_diameter": rng.uniform(20, 80, 100),
+            "hollow_d1": hollow,
+            "hollow_d2": hollow.sample(frac=1, random_state=0).to_numpy(),
+            "height": rng.uniform(0.1, 1.3, 100),
+            "density": rng.choice([1, 2, 3], 100),
+        }
+    )
+
+    # stumps: the hollow dry matter is subtracted where it is positive
+    solid = vmd0002_eq2(pieces, "diameter", "top_diameter", "height", "density")
+    hollow_dm = vmd0002_eq2(pieces, "hollow_d1", "hollow_d2", "height", "density")
+    expected = solid["tonnes_dry_matter"].where(
+        ~(hollow_dm["tonnes_dry_matter"] > 0),
+        solid["tonnes_dry_matter"] - hollow_dm["tonnes_dry_matter"],
+    )
+    actual = vmd0002_eq2(
+        pieces,
+        "diameter",
+        "top_diameter",
+        "height",
+        "density",
+        hollow_base_diameter_col="hollow_d1",
+        hollow_top_diameter_col="hollow_d2",
+    )
+    np.testing.assert_allclose(actual["tonnes_dry_matter"], expected)
+
+    # hollow lying deadwood: the hollow is the mean of the available hollow diameters
+    hollow_mean = pieces[["hollow_d1", "hollow_d2"]].mean(axis=1)
+    expected = np.sqrt(pieces["diameter"] ** 2 - hollow_mean**2)
+    solid = get_solid_diamter(pieces, "hollow_d1", "hollow_d2", "diameter")
+    np.testing.assert_allclose(solid["solid_diameter"], expected)
+
+    expected = vmd0002_eq7_eq8a(solid, "solid_diameter", "density", 80)
+    actual = vmd0002_eq7_eq8a(
+        pieces, "diameter", "density", 80, hollow_diameter_cols=["hollow_d1", "hollow_d2"]
+    )
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_trigonometric_height():
+    distance = np.array([10.0, 10.0, 10.0, 0.0, 10.0])
+    top_degrees = np.array([45.0, 30.0, -10.0, 45.0, 95.0])
+    base_degrees = np.array([-10.0, 5.0, 20.0, -10.0, 0.0])
+
+    height = height_trigonometric(distance, top_degrees, base_degrees, "degrees")
+    expected = 10 * (np.tan(np.radians(top_degrees[:2])) - np.tan(np.radians(base_degrees[:2])))
+    np.testing.assert_allclose(height[:2], expected)
+    # top below base, no distance and a vertical sight line are impossible
+    assert np.isnan(height[2:]).all()
+
+    percent = np.tan(np.radians(top_degrees[:2])) * 100, np.tan(np.radians(base_degrees[:2])) * 100
+    np.testing.assert_allclose(height_trigonometric(distance[:2], *percent), expected)
+
+
+def test_array_kernels_match_the_column_formulas():
+    trees = make_trees()
+    result = calculate_tree_height(trees, "DBH")
+    result = allometric_tropical_tree(result, "wood_density", "DBH", "height")
+    result = vmd0001_eq5(vmd0001_eq1(result))
+    result = vmd0001_eq2b(result, area_col="area")
+
+    height = np.minimum(35.83 - 31.15 * np.exp(-0.029 * trees["DBH"]), 30)
+    biomass = 0.0673 * (trees["wood_density"] * height * trees["DBH"] ** 2) ** 0.976
+    carbon = biomass * 0.47
+    np.testing.assert_allclose(result["height"], height)
+    np.testing.assert_allclose(result["aboveground_biomass"], biomass)
+    np.testing.assert_allclose(result["belowground_carbon_tonnes"], carbon * 0.36)
+    np.testing.assert_allclose(result["CO2e_per_ha"], carbon / 100 * 44 / 12)
+
+    peat = allometric_peatland_tree(trees, "DBH")["aboveground_biomass"]
+    np.testing.assert_allclose(peat, 21.297 - 67.953 * trees["DBH"] + 0.74 * trees["DBH"] ** 2)
+    dead = vmd0002_eq1(trees.assign(height=height), "DBH", "height", "wood_density")
+    np.testing.assert_allclose(
+        dead["tonnes_dry_matter"],
+        np.pi / 3 * (trees["DBH"] / 200) ** 2 * height * trees["wood_density"],
+    )
+
+    # float32 inputs stay float32
+    assert calculate_tree_height(trees.astype("float32"), "DBH")["height"].dtype == np.float32
+
+
+def test_sapling_carbon_only_fills_missing_counts():
+    counts = pd.Series([10.0, np.nan, np.inf])
+    carbon = sapling_carbon(counts)
+    expected = (counts * 0.000184 * 0.25 * 0.47).fillna(0)
+    np.testing.assert_array_equal(carbon, expected)
+    assert np.isinf(carbon[2])
+
+    saplings = vmd0001_eq1(make_trees(), is_sapling=True)
+    assert saplings["aboveground_carbon_tonnes"].iloc[-1] == 0
+
+
+def test_copy_false_adds_the_column_in_place():
+    trees = make_trees()
+    copied = calculate_tree_height(trees, "DBH")
+    assert "height" not in trees
+
+    in_place = calculate_tree_height(trees, "DBH", copy=False)
+    assert in_place is trees
+    pd.testing.assert_series_equal(trees["height"], copied["height"])
+    for step in [
+        lambda df: allometric_tropical_tree(df, "wood_density", "DBH", "height", copy=False),
+        lambda df: vmd0001_eq1(df, copy=False),
+        lambda df: vmd0001_eq5(df, copy=False),
+    ]:
+        assert step(trees) is trees
+    assert "belowground_carbon_tonnes" in trees
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.cache import TableCache, cache_key
+
+
+def make_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"nest": rng.integers(2, 5, n_rows), "DBH": rng.uniform(5, 120, n_rows)})
+
+
+def test_cache_key_follows_contents(tmp_path):
+    species = tmp_path / "trees_with_names.csv"
+    species.write_text("scientific_name\nShorea\n")
+    key = cache_key("trees_with_wood_density", species, {"campaign": 1})
+
+    assert key == cache_key("trees_with_wood_density", species, {"campaign": 1})
+    assert key != cache_key("trees_with_wood_density", species, {"campaign": 2})
+    assert cache_key(make_table(10)) == cache_key(make_table(10))
+    species.write_text("scientific_name\nParashorea\n")
+    assert key != cache_key("trees_with_wood_density", species, {"campaign": 1})
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    tables = {name: make_table(2_000, seed) for seed, name in enumerate("abc")}
+    probe = TableCache(tmp_path / "probe")
+    probe.put("probe", tables["a"])
+    size = probe.stats()["bytes"]
+
+    # room for two tables
+    cache = TableCache(tmp_path / "cache", max_bytes=int(size * 2.5))
+    assert cache.get("a") is None
+    cache.put("a", tables["a"], "a")
+    time.sleep(0.01)
+    cache.put("b", tables["b"], "b")
+    time.sleep(0.01)
+    pd.testing.assert_frame_equal(cache.get("a"), tables["a"])
+    time.sleep(0.01)
+    cache.put("c", tables["c"], "c")
+
+    assert "b" not in cache and "a" in cache and "c" in cache
+    assert list(cache.entries()["name"]) == ["c", "a"]
+    nest_2 = cache.get("c", columns=["DBH"], filters=[("nest", "=", 2)])
+    assert list(nest_2.columns) == ["DBH"] and len(nest_2) == (tables["c"]["nest"] == 2).sum()
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (2, 1, 1, 2)
+    assert stats["bytes"] <= cache.max_bytes
+
+    # a new instance on the same directory sees the same tables
+    calls = []
+    compute = lambda: calls.append(1) or tables["b"]
+    reopened = TableCache(tmp_path / "cache", max_bytes=cache.max_bytes)
+    pd.testing.assert_frame_equal(reopened.get_or_compute("a", compute), tables["a"])
+    pd.testing.assert_frame_equal(reopened.get_or_compute("b", compute), tables["b"])
+    assert calls == [1]
+
+    with pytest.warns(UserWarning):
+        TableCache(tmp_path / "tiny", max_bytes=1).put("a", tables["a"])
+    reopened.clear()
+    assert reopened.stats()["entries"] == 0
+
+
+def put_tables(cache_dir, worker, n_tables):
+    cache = TableCache(cache_dir)
+    for i in range(n_tables):
+        cache.put(f"{worker}_{i}", make_table(100, i), f"table {i} of worker {worker}")
+
+
+def test_cache_keeps_the_tables_of_parallel_writers(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=4, mp_context=context) as executor:
+        futures = [executor.submit(put_tables, tmp_path, worker, 10) for worker in range(4)]
+        for future in futures:
+            future.result()
+
+    entries = TableCache(tmp_path).entries()
+    assert len(entries) == 40
+    assert entries.loc["3_9", "name"] == "table 9 of worker 3"
+
+
+def test_cache_counts_tables_without_metadata(tmp_path):
+    table = make_table(2_000)
+    cache = TableCache(tmp_path)
+    cache.put("a", table, "a")
+    size = cache.stats()["bytes"]
+
+    # e.g. a writer interrupted after the table was written
+    (tmp_path / "a.json").unlink()
+    assert "a" in cache and cache.stats()["bytes"] == size
+    time.sleep(0.01)
+
+    cache.max_bytes = int(size * 1.5)
+    cache.put("b", table, "b")
+    assert "a" not in cache and list(cache.entries()["name"]) == ["b"]
+
+
+def test_cache_removes_unfinished_writes(tmp_path):
+    cache = TableCache(tmp_path)
+    cache.put("a", make_table(100))
+
+    # the temporary files of a process that has exited, of this process and an old one
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    gone = [tmp_path / f"b.{exited.pid}.tmp", tmp_path / f"b.json.{exited.pid}.tmp"]
+    running = tmp_path / f"c.{os.getpid()}.tmp"
+    old = tmp_path / f"d.{os.getpid()}.tmp"
+    for path in gone + [running, old]:
+        path.write_bytes(b"partial")
+    os.utime(old, (time.time() - 2 * 24 * 3600,) * 2)
+
+    assert cache.stats()["entries"] == 1
+    assert sorted(path.name for path in tmp_path.glob("*.tmp")) == [running.name]
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import carbon_stock
+from src.biomass_equations import (
+    allometric_peatland_tree,
+    allometric_tropical_tree,
+    calculate_tree_height,
+    vmd0001_eq1,
+    vmd0001_eq2a,
+    vmd0001_eq2b,
+    vmd0001_eq5,
+)
+from src.carbon_stock import living_tree_stock, plot_area_index
+
+
+def notebook_chain(trees, plot_info):
+    area = plot_area_index(plot_info)
+    trees = calculate_tree_height(trees, "DBH")
+    trees = pd.concat(
+        [
+            allometric_tropical_tree(
+                trees.loc[trees["Strata"].isin([1, 2, 3])], "wood_density", "DBH", "height"
+            ),
+            allometric_peatland_tree(trees.loc[trees["Strata"].isin([4, 5, 6])], "DBH"),
+        ]
+    )
+    trees["aboveground_biomass"] = trees["aboveground_biomass"] / 1000
+    trees = vmd0001_eq5(vmd0001_eq1(trees, 0.47))
+
+    results = []
+    for pool in ["aboveground", "belowground"]:
+        agg = vmd0001_eq2a(trees, ["unique_id", "nest"], f"{pool}_carbon_tonnes")
+        agg["corrected_area_m2"] = [area.at[u, n] for u, n in zip(agg["unique_id"], agg["nest"])]
+        agg = vmd0001_eq2b(agg, f"{pool}_carbon_tonnes", "corrected_area_m2")
+        agg["CO2e_per_ha"] = agg["CO2e_per_ha"] * 10_000
+        agg["tC_per_ha"] = (agg[f"{pool}_carbon_tonnes"] / agg["corrected_area_m2"]) * 10_000
+        agg = agg.groupby("unique_id")[["CO2e_per_ha", "tC_per_ha"]].mean()
+        results.append(agg.add_prefix(f"{pool}_"))
+
+    return pd.concat(results, axis=1).reset_index()
+
+
+def test_living_tree_stock_matches_notebook_chain(make_inventory):
+    trees, plot_info = make_inventory()
+    expected = notebook_chain(trees, plot_info)
+    with pytest.warns(UserWarning, match="no allometric model"):
+        actual = living_tree_stock(trees, plot_area_index(plot_info))
+
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_exact=False)
+
+
+def test_living_tree_stock_nest_sums(make_inventory):
+    trees, plot_info = make_inventory()
+    trees = trees[trees["Strata"] != 7]
+    _, nest_stock = living_tree_stock(trees, plot_area_index(plot_info), return_nests=True)
+
+    assert not nest_stock.duplicated(subset=["unique_id", "nest"]).any()
+    np.testing.assert_allclose(
+        nest_stock["belowground_carbon_tonnes"], nest_stock["aboveground_carbon_tonnes"] * 0.36
+    )
+
+
+def test_living_tree_stock_float32_within_bound(make_inventory):
+    trees, plot_info = make_inventory()
+    trees = trees[trees["Strata"] != 7]
+    plot_index = plot_area_index(plot_info)
+    expected = living_tree_stock(trees, plot_index)
+    actual = living_tree_stock(trees, plot_index, params={"dtype": np.float32})
+
+    pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-4)
+    with pytest.raises(ValueError, match="Relative error"):
+        living_tree_stock(trees, plot_index, params={"dtype": np.float32, "verify_rtol": 1e-12})
+
+
+def test_float32_check_recomputes_a_sample_of_plots(monkeypatch, make_inventory):
+    trees, plot_info = make_inventory()
+    trees = trees[trees["Strata"] != 7]
+    plot_index = plot_area_index(plot_info)
+    recomputed = []
+    compute = carbon_stock._living_tree_stock
+
+    def record(sample, *args):
+        recomputed.append(sample["unique_id"].nunique())
+        return compute(sample, *args)
+
+    monkeypatch.setattr(carbon_stock, "_living_tree_stock", record)
+    living_tree_stock(trees, plot_index, params={"dtype": np.float32, "verify_plots": 5})
+    living_tree_stock(trees, plot_index, params={"dtype": np.float32, "verify_plots": None})
+    assert recomputed == [trees["unique_id"].nunique(), 5] + [trees["unique_id"].nunique()] * 2
+    with pytest.raises(ValueError, match="Relative error"):
+        living_tree_stock(
+            trees, plot_index, params={"dtype": np.float32, "verify_plots": 5, "verify_rtol": 1e-12}
+        )
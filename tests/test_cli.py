@@ -0,0 +1,24 @@
+import pytest
+
+from src.cli import main, parse_params
+
+
+def test_parse_params_reads_literals():
+    params = parse_params(
+        ["living_trees.OUTLIER_REMOVAL=mad", "living_trees.MONTE_CARLO_DRAWS=1000", "deadwood.USE_LOCAL_HEIGHT_MODELS=False"]
+    )
+    assert params == {
+        "living_trees": {"OUTLIER_REMOVAL": "mad", "MONTE_CARLO_DRAWS": 1000},
+        "deadwood": {"USE_LOCAL_HEIGHT_MODELS": False},
+    }
+    with pytest.raises(ValueError):
+        parse_params(["OUTLIER_REMOVAL=mad"])
+
+
+def test_dry_run_lists_the_stages(tmp_path, capsys):
+    assert main(["run", "--stage", "living_trees", "--dry-run", "--state", str(tmp_path / "state.json")]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[1] for line in lines] == ["carbon_pools", "height_models", "living_trees"]
+
+    with pytest.raises(SystemExit):
+        main(["run", "--jobs", "0"])
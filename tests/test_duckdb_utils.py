@@ -0,0 +1,63 @@
+import duckdb
+import pytest
+
+from src.duckdb_utils import strata_areas
+
+
+def square(lon, lat, size=0.01):
+    return (
+        f"POLYGON(({lon} {lat}, {lon + size} {lat}, {lon + size} {lat + size}, "
+        f"{lon} {lat + size}, {lon} {lat}))"
+    )
+
+
+@pytest.fixture
+def activity_area_db(tmp_path):
+    db = duckdb.connect(str(tmp_path / "activity_area.db"))
+    try:
+        db.load_extension("spatial")
+    except duckdb.Error:
+        try:
+            db.install_extension("spatial")
+            db.load_extension("spatial")
+        except duckdb.Error:
+            db.close()
+            pytest.skip("the DuckDB spatial extension is not available")
+
+    # two strata side by side; the APD area covers both halves, the ARR area only the first
+    db.execute("CREATE TABLE caraga_strata (strata VARCHAR, geometry GEOMETRY)")
+    db.execute(
+        "INSERT INTO caraga_strata VALUES "
+        f"('pre_strata_1', ST_GeomFromText('{square(125.50, 8.90)}')), "
+        f"('pre_strata_2', ST_GeomFromText('{square(125.51, 8.90)}')), "
+        f"('pre_strata_3', ST_GeomFromText('{square(126.00, 9.50)}'))"
+    )
+    db.execute("CREATE TABLE activity_area (CADT VARCHAR, ELI_TYPE VARCHAR, geometry GEOMETRY)")
+    db.execute(
+        "INSERT INTO activity_area VALUES "
+        f"('1', 'APD', ST_GeomFromText('{square(125.505, 8.90)}')), "
+        f"('1', 'ARR', ST_GeomFromText('{square(125.50, 8.90, 0.005)}'))"
+    )
+    yield db
+    db.close()
+
+
+def test_strata_areas(activity_area_db):
+    areas = strata_areas(activity_area_db)
+
+    assert areas[["CADT", "ELI_TYPE", "strata"]].values.tolist() == [
+        ["1", "APD", "pre_strata_1"],
+        ["1", "APD", "pre_strata_2"],
+        ["1", "ARR", "pre_strata_1"],
+    ]
+    # 0.005 x 0.01 degrees at 8.9 N is about 0.55 x 1.1 km
+    apd = areas.loc[areas["ELI_TYPE"] == "APD", "area_ha"]
+    assert apd.tolist() == pytest.approx([60.8, 60.8], rel=0.02)
+    assert areas.loc[areas["ELI_TYPE"] == "ARR", "area_ha"].iloc[0] == pytest.approx(30.4, rel=0.02)
+
+
+def test_strata_areas_needs_the_tables(tmp_path):
+    with duckdb.connect(str(tmp_path / "activity_area.db")) as db:
+        db.execute("CREATE TABLE activity_area (CADT VARCHAR, ELI_TYPE VARCHAR)")
+        with pytest.raises(ValueError, match="caraga_strata"):
+            strata_areas(db)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from src.biomass_equations import height_feldpausch
+from src.cache import TableCache
+from src.height_models import HEIGHT_MODELS, fit_height_models, michaelis_menten, predict_height
+
+
+def test_fit_per_strata_with_feldpausch_fallback(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    dbh = rng.uniform(10, 100, 205)
+    trees = pd.DataFrame(
+        {
+            "DBH": dbh,
+            "height": michaelis_menten(dbh, 40, 25) * rng.normal(1, 0.05, 205),
+            # strata 2 has too few measured heights for a local model
+            "Strata": [1] * 200 + [2] * 5,
+        }
+    )
+
+    fits = fit_height_models(trees, "DBH", "height", cache=TableCache(tmp_path))
+    assert list(fits["model"]) == ["michaelis_menten", "feldpausch"]
+    np.testing.assert_allclose(fits.loc[0, ["a", "b"]].astype(float), [40, 25], rtol=0.1)
+
+    # refitting the same measurements, e.g. in the next run, comes from the cache
+    calls = []
+    fit = HEIGHT_MODELS["michaelis_menten"]["fit"]
+    monkeypatch.setitem(
+        HEIGHT_MODELS["michaelis_menten"], "fit", lambda *args: calls.append(1) or fit(*args)
+    )
+    pd.testing.assert_frame_equal(
+        fit_height_models(trees, "DBH", "height", cache=TableCache(tmp_path)), fits
+    )
+    assert calls == []
+    # other measurements have another hash and are fitted again
+    changed = trees.assign(height=trees["height"] * 1.01)
+    refit = fit_height_models(changed, "DBH", "height", cache=TableCache(tmp_path))
+    assert calls == [1]
+    assert refit.loc[0, "data_hash"] != fits.loc[0, "data_hash"]
+    assert refit.loc[1, "data_hash"] != fits.loc[1, "data_hash"]
+
+    fits = pd.concat([fits, fit_height_models(trees, "DBH", "height", model="loglog").iloc[:1]])
+    fits["Strata"] = [1, 2, 3]
+    dbh = np.array([20.0, 80.0, 20.0, 80.0, 20.0, 80.0, 20.0])
+    height = predict_height(dbh, [1, 1, 2, 2, 3, 3, 4], fits, max_height=100)
+    a, b = fits.iloc[0][["a", "b"]]
+    np.testing.assert_allclose(height[:2], michaelis_menten(dbh[:2], a, b))
+    np.testing.assert_allclose(height[2:4], height_feldpausch(dbh[2:4], 100))
+    np.testing.assert_allclose(height[6:], height_feldpausch(dbh[6:], 100))
+    assert (height[4:6] > 0).all()
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from src import kernel_backend
+from src.kernel_backend import (
+    KERNEL_BACKENDS,
+    chave2014_tree_carbon,
+    deadwood_dry_matter,
+    hollow_deadwood_dry_matter,
+    hollow_stump_dry_matter,
+    set_kernel_backend,
+)
+
+
+@pytest.mark.parametrize("backend", KERNEL_BACKENDS)
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_fused_kernels_match_numpy(backend, dtype):
+    rng = np.random.default_rng(0)
+    dbh = rng.uniform(5, 120, 1000).astype(dtype)
+    wood_density = rng.uniform(0.3, 0.9, 1000).astype(dtype)
+    hollow = np.where(rng.random(1000) < 0.5, np.nan, dbh * rng.uniform(0, 0.5, 1000))
+    hollow = hollow.astype(dtype)
+    dbh[0] = np.nan
+
+    def run_kernels():
+        return (
+            chave2014_tree_carbon(wood_density, dbh)
+            + deadwood_dry_matter(dbh, wood_density, 80)
+            + hollow_deadwood_dry_matter(dbh, hollow, hollow[::-1], wood_density, 80)
+            + (hollow_stump_dry_matter(dbh, dbh, hollow, hollow[::-1], wood_density, wood_density),)
+        )
+
+    default = kernel_backend.get_kernel_backend()
+    try:
+        set_kernel_backend("numpy")
+        expected = run_kernels()
+        set_kernel_backend(backend)
+        actual = run_kernels()
+    finally:
+        set_kernel_backend(default)
+
+    for values, reference in zip(actual, expected):
+        assert values.dtype == dtype
+        np.testing.assert_allclose(values, reference, rtol=1e-5 if dtype == np.float32 else 1e-12)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError, match="not available"):
+        set_kernel_backend("cupy")
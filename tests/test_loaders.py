@@ -0,0 +1,116 @@
+import duckdb
+import pandas as pd
+import pytest
+
+import src.loaders
+from src.loaders import TABLE_SOURCES, filters_sql, load_table, register_table, table_metadata
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    return {
+        "pools_dir": tmp_path / "pools",
+        "tables_dir": tmp_path / "tables",
+        "warehouse_db": tmp_path / "warehouse.duckdb",
+        "metadata_dir": tmp_path / "metadata",
+    }
+
+
+@pytest.fixture
+def table(tmp_path):
+    stock = pd.DataFrame({"unique_id": ["a", "b", "c"], "nest": [1, 2, 2], "CO2e": [1.0, 2.5, 4.0]})
+    register_table("test_stock", "carbon_stock")
+    register_table("test_stock_csv", "carbon_stock", tmp_path / "test_stock.csv")
+    yield stock
+    TABLE_SOURCES.pop("test_stock")
+    TABLE_SOURCES.pop("test_stock_csv")
+
+
+def test_filters_sql():
+    assert filters_sql(None) == "TRUE"
+    assert (
+        filters_sql([("nest", "=", 2), ("campaign", "in", ["7639'32"])])
+        == "(\"nest\" = 2 AND \"campaign\" IN ('7639''32'))"
+    )
+    assert filters_sql([[("nest", ">", 1)], [("Strata", "!=", 3)]], quote="`") == (
+        "(`nest` > 1) OR (`Strata` != 3)"
+    )
+    with pytest.raises(ValueError):
+        filters_sql([("nest", "like", 2)])
+    with pytest.raises(ValueError):
+        filters_sql([("nest; DROP TABLE trees", "=", 2)])
+
+
+def test_csv_is_parsed_once(table, dirs, monkeypatch):
+    csv = TABLE_SOURCES["test_stock_csv"]["csv"]
+    table.to_csv(csv, index=False)
+    pd.testing.assert_frame_equal(load_table("test_stock_csv", **dirs), table)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pd, "read_csv", lambda *args, **kwargs: pytest.fail("CSV parsed again"))
+        subset = load_table("test_stock_csv", columns=["unique_id"], filters=[("nest", "=", 2)], **dirs)
+    assert subset["unique_id"].tolist() == ["b", "c"]
+
+    # a new CSV replaces the copy
+    table.assign(CO2e=0.0).to_csv(csv, index=False)
+    assert load_table("test_stock_csv", **dirs)["CO2e"].sum() == 0
+    assert table_metadata(dirs["metadata_dir"]).loc["test_stock_csv", "source"] == "csv"
+
+
+def test_sources_in_order(table, dirs, monkeypatch):
+    queries = []
+
+    def read_bigquery(name, dataset, columns, filters):
+        queries.append((dataset, columns, filters))
+        return table
+
+    monkeypatch.setattr(src.loaders, "_read_bigquery", read_bigquery)
+    assert len(load_table("test_stock", **dirs)) == 3
+    assert queries == [("carbon_stock", None, None)]
+    assert table_metadata(dirs["metadata_dir"]).loc["test_stock", "rows"] == 3
+    # each table has its own metadata file, so parallel loads of other tables never drop it
+    assert sorted(path.name for path in dirs["metadata_dir"].iterdir()) == ["test_stock.json"]
+
+    # the warehouse serves the filtered reads before BigQuery, the copy serves everything else
+    with duckdb.connect(str(dirs["warehouse_db"])) as db:
+        db.register("stock", table)
+        db.execute("CREATE TABLE test_stock AS SELECT * FROM stock")
+    served = load_table("test_stock", columns=["CO2e"], filters=[("nest", "=", 2)], refresh=True, **dirs)
+    assert served.columns.tolist() == ["CO2e"]
+    assert served["CO2e"].tolist() == [2.5, 4.0]
+    assert len(queries) == 1
+
+    load_table("test_stock", refresh=True, **dirs)
+    assert table_metadata(dirs["metadata_dir"]).loc["test_stock", "source"] == "warehouse"
+    dirs["warehouse_db"].unlink()
+    assert load_table("test_stock", filters=[("unique_id", "in", ["a"])], **dirs)["CO2e"].tolist() == [1.0]
+    assert len(queries) == 1
+
+    with pytest.raises(ValueError):
+        load_table("not_a_table", **dirs)
+
+
+def test_pool_table_fallback(dirs, monkeypatch):
+    trees = pd.DataFrame(
+        {"unique_id": ["a", "b", "c"], "nest": [1, 2, 2], "DBH": [12.0, 25.0, 31.0], "campaign": "763932"}
+    )
+    queries = []
+
+    def read_bigquery(name, dataset, columns, filters):
+        queries.append(name)
+        return trees
+
+    monkeypatch.setattr(src.loaders, "_read_bigquery", read_bigquery)
+    assert len(load_table("trees", **dirs)) == 3
+    assert (dirs["pools_dir"] / "trees" / "campaign=763932" / "nest=2").is_dir()
+    nest_2 = load_table("trees", filters=[("nest", "=", 2)], **dirs)
+    assert sorted(nest_2["DBH"]) == [25.0, 31.0]
+    assert queries == ["trees"]
+
+    # without a campaign the table cannot be partitioned, so it is returned without a copy
+    monkeypatch.setattr(src.loaders, "_read_bigquery", lambda *args: trees.drop(columns="campaign"))
+    with pytest.warns(UserWarning, match="no campaign column"):
+        stumps = load_table("stumps", **dirs)
+    assert len(stumps) == 3
+    assert not (dirs["pools_dir"] / "stumps").exists()
+    assert "stumps" not in table_metadata(dirs["metadata_dir"]).index
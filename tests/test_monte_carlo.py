@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.carbon_stock import living_tree_stock, plot_area_index
+from src.monte_carlo import monte_carlo_living_trees
+
+NO_ERRORS = {"allometry_rse": {}, "height_sd_log": 0.0}
+
+
+def test_monte_carlo_without_errors_matches_living_tree_stock(make_inventory):
+    trees, plot_info = make_inventory()
+    plot_index = plot_area_index(plot_info)
+    plot_strata = trees.groupby("unique_id")["Strata"].first()
+
+    with pytest.warns(UserWarning):
+        expected = living_tree_stock(trees, plot_index)
+    plot_summary, strata_summary = monte_carlo_living_trees(
+        trees, plot_index, plot_strata, n_draws=5, errors=NO_ERRORS, max_bytes=1
+    )
+
+    assert len(plot_summary) == len(expected)
+    for col in ["aboveground_CO2e_per_ha", "belowground_tC_per_ha"]:
+        np.testing.assert_allclose(plot_summary[f"{col}_mean"], expected[col], rtol=1e-12)
+        np.testing.assert_allclose(plot_summary[f"{col}_sd"], 0, atol=1e-9)
+        expected_strata = expected.groupby(expected["unique_id"].map(plot_strata))[col].mean()
+        np.testing.assert_allclose(strata_summary[f"{col}_mean"], expected_strata, rtol=1e-12)
+
+
+def test_monte_carlo_errors_are_reproducible_and_widen_the_interval(make_inventory):
+    trees, plot_info = make_inventory(n_trees=300)
+    trees["wood_density_sd"] = 0.1
+    plot_index = plot_area_index(plot_info)
+    plot_strata = trees.groupby("unique_id")["Strata"].first()
+
+    # 250 draws span three tasks and the blocks split the nests
+    args = (trees, plot_index, plot_strata, 250)
+    plot_summary, strata_summary = monte_carlo_living_trees(*args, seed=3, max_bytes=50_000)
+    repeat, _ = monte_carlo_living_trees(*args, seed=3)
+    pd.testing.assert_frame_equal(plot_summary, repeat)
+
+    col = "aboveground_CO2e_per_ha"
+    chave = plot_summary["unique_id"].map(plot_strata).isin([1, 2, 3])
+    assert (plot_summary.loc[chave, f"{col}_sd"] > 0).all()
+    # alibo2012 has no registered error, so those plots do not vary
+    np.testing.assert_allclose(plot_summary.loc[~chave, f"{col}_sd"].dropna(), 0, atol=1e-9)
+    strata_summary = strata_summary.dropna()
+    assert (strata_summary[f"{col}_ci_lower"] <= strata_summary[f"{col}_mean"]).all()
+    assert (strata_summary[f"{col}_ci_upper"] >= strata_summary[f"{col}_mean"]).all()
+
+    with pytest.raises(ValueError):
+        monte_carlo_living_trees(trees, plot_index, plot_strata, n_draws=1)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.outliers import handle_outliers
+
+
+def make_trees(n_trees=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    trees = pd.DataFrame(
+        {
+            "unique_id": rng.integers(0, 100, n_trees).astype(str),
+            "nest": rng.integers(2, 5, n_trees),
+            "DBH": rng.lognormal(3.5, 0.7, n_trees),
+        }
+    )
+    trees.loc[rng.random(n_trees) < 0.02, "DBH"] = np.nan
+    return trees
+
+
+def test_strategies_match_pandas():
+    trees = make_trees()
+    outlier = trees["DBH"] >= 150
+
+    result, report = handle_outliers(trees, "get_ave")
+    group_mean = trees.groupby(["unique_id", "nest"])["DBH"].transform("mean")
+    expected = trees["DBH"].mask(outlier, group_mean)
+    pd.testing.assert_series_equal(result["DBH"], expected)
+    assert report["replaced"] == (outlier & (group_mean != trees["DBH"])).sum()
+
+    result, report = handle_outliers(trees, "drop_outliers")
+    pd.testing.assert_frame_equal(result, trees[trees["DBH"] < 150])
+    assert report["dropped"] == len(trees) - len(result)
+
+    result, report = handle_outliers(trees, "eq_150")
+    assert result["DBH"].max() == 150
+    assert report["replaced"] == (trees["DBH"] > 150).sum()
+
+    result, _ = handle_outliers(trees, "percentile", q=0.95)
+    cap = trees.groupby("nest")["DBH"].transform(lambda dbh: dbh.quantile(0.95))
+    np.testing.assert_allclose(result["DBH"], trees["DBH"].where(~(trees["DBH"] > cap), cap))
+
+    result, report = handle_outliers(trees, "mad", keys=["nest"], k=3)
+    median = trees.groupby("nest")["DBH"].transform("median")
+    mad = (trees["DBH"] - median).abs().groupby(trees["nest"]).transform("median")
+    upper = median + 3 * 1.4826 * mad
+    np.testing.assert_allclose(result["DBH"], trees["DBH"].where(~(trees["DBH"] > upper), upper))
+    assert report["replaced"] == (trees["DBH"] > upper).sum()
+
+    with pytest.raises(ValueError):
+        handle_outliers(trees, "median")
@@ -0,0 +1,144 @@
+import functools
+
+import jupytext
+import nbformat
+import pytest
+
+from src.pipeline import (
+    PIPELINE_STAGES,
+    parameters_cell,
+    plan_pipeline,
+    register_stage,
+    run_pipeline,
+    stage_order,
+)
+
+
+def make_stages(tmp_path, calls):
+    names = ["raw", "clean", "report", "other"]
+    raw, clean, report, other = (tmp_path / f"{name}.csv" for name in names)
+    raw.write_text("a\n1\n")
+
+    def clean_stage(scale=1):
+        calls.append("clean")
+        clean.write_text(raw.read_text().replace("1", str(scale)))
+
+    def report_stage():
+        calls.append("report")
+        report.write_text(clean.read_text() + other.read_text())
+
+    def other_stage():
+        calls.append("other")
+        other.write_text("b\n2\n")
+
+    register_stage("test_report", report_stage, [clean, other], [report])
+    register_stage("test_clean", clean_stage, [raw], [clean])
+    register_stage("test_other", other_stage, [], [other])
+    stages = {name: PIPELINE_STAGES.pop(f"test_{name}") for name in ["report", "clean", "other"]}
+    return stages, raw, report
+
+
+def test_pipeline_only_reruns_affected_stages(tmp_path):
+    calls = []
+    stages, raw, report = make_stages(tmp_path, calls)
+    state = tmp_path / "state.json"
+
+    assert stage_order(stages) == [["clean", "other"], ["report"]]
+    assert stage_order(stages, ["clean"]) == [["clean"]]
+
+    run_pipeline(stages=stages, state_path=state)
+    assert sorted(calls) == ["clean", "other", "report"]
+
+    calls.clear()
+    assert {row["status"] for row in run_pipeline(stages=stages, state_path=state)} == {"skipped"}
+    assert calls == []
+
+    # a changed input re-runs its stage and the stages reading its outputs
+    raw.write_text("a\n3\n")
+    plan = {row["stage"]: row["status"] for row in plan_pipeline(stages=stages, state_path=state)}
+    assert plan == {"clean": "changed", "other": "unchanged", "report": "pending"}
+    run_pipeline(stages=stages, state_path=state)
+    assert calls == ["clean", "report"]
+
+    # a parameter change that gives the same output stops at the stage itself
+    calls.clear()
+    raw.write_text("a\n2\n")
+    run_pipeline(stages=stages, state_path=state)
+    calls.clear()
+    run_pipeline(params={"clean": {"scale": 1}}, stages=stages, state_path=state)
+    assert calls == ["clean"]
+
+    # a missing output re-runs the stage that writes it
+    calls.clear()
+    report.unlink()
+    run_pipeline(params={"clean": {"scale": 1}}, stages=stages, state_path=state)
+    assert calls == ["report"]
+
+
+def write_text(path, text):
+    path.write_text(text)
+
+
+def fail():
+    raise ValueError("no data")
+
+
+def test_pipeline_runs_independent_stages_in_workers(tmp_path):
+    pools = {name: tmp_path / f"{name}.csv" for name in ["litter", "trees", "deadwood"]}
+    summary = tmp_path / "summary.csv"
+    for name, path in pools.items():
+        register_stage(f"test_{name}", functools.partial(write_text, path, name), [], [path])
+    register_stage(
+        "test_summary", functools.partial(write_text, summary, "all"), list(pools.values()), [summary]
+    )
+    register_stage("test_failing", fail, [], [tmp_path / "failing.csv"])
+    stages = {
+        name: PIPELINE_STAGES.pop(f"test_{name}")
+        for name in ["litter", "trees", "deadwood", "summary", "failing"]
+    }
+    state = tmp_path / "state.json"
+
+    report = run_pipeline(["summary"], stages=stages, state_path=state, jobs=2)
+    assert [(row["stage"], row["level"]) for row in report] == [
+        ("litter", 0),
+        ("trees", 0),
+        ("deadwood", 0),
+        ("summary", 1),
+    ]
+    assert summary.read_text() == "all"
+
+    # the stages that succeed are recorded even if another stage of the level fails
+    pools["trees"].unlink()
+    with pytest.raises(RuntimeError, match="failing"):
+        run_pipeline(stages=stages, state_path=state, jobs=2)
+    assert pools["trees"].exists()
+    # trees re-ran to the same output, so the summary is still up to date
+    plan = plan_pipeline(["summary"], stages=stages, state_path=state)
+    assert {row["status"] for row in plan} == {"unchanged"}
+
+
+def test_height_models_run_before_their_consumers():
+    levels = {name: level for level, names in enumerate(stage_order()) for name in names}
+    assert levels["height_models"] < min(levels["living_trees"], levels["deadwood"])
+
+
+def test_every_notebook_stage_takes_parameters():
+    for name, stage in PIPELINE_STAGES.items():
+        notebook = stage["func"].args[0]
+        nb = jupytext.read(notebook)
+        position = parameters_cell(nb)
+        assert position is not None, f"{name}: {notebook.name} has no parameters cell"
+        assert nb.cells[position].source.startswith("# Variables")
+
+    # a cell tagged "parameters" comes first
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [
+        nbformat.v4.new_code_cell("# Variables\nA = 1"),
+        nbformat.v4.new_code_cell("B = 2", metadata={"tags": ["parameters"]}),
+    ]
+    assert parameters_cell(nb) == 1
+
+
+def test_rscript_is_part_of_the_stage_code():
+    for name in ["living_trees", "deadwood"]:
+        assert "get_wood_density.R" in [path.name for path in PIPELINE_STAGES[name]["code"]]
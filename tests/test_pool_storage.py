@@ -0,0 +1,63 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from src.pool_storage import read_pool_table, write_pool_table
+
+
+def make_trees(campaign):
+    return pd.DataFrame(
+        {
+            "unique_id": ["a", "a", "b", "c"],
+            "nest": [1, 2, 2, None],
+            "DBH": [12.0, 25.0, 31.0, 8.0],
+            "campaign": campaign,
+        }
+    )
+
+
+def test_write_and_read_back(tmp_path):
+    trees = make_trees("763932")
+    write_pool_table(trees, "trees", outdir=tmp_path)
+
+    # the nest without a value goes to the default partition and is read back as missing
+    assert (tmp_path / "trees" / "campaign=763932" / "nest=__HIVE_DEFAULT_PARTITION__").is_dir()
+    result = read_pool_table("trees", outdir=tmp_path).sort_values("DBH").reset_index(drop=True)
+    expected = trees.sort_values("DBH").reset_index(drop=True)
+    assert result["unique_id"].tolist() == expected["unique_id"].tolist()
+    assert result["nest"].isna().tolist() == expected["nest"].isna().tolist()
+    assert (result["campaign"] == "763932").all()
+
+
+def test_partition_pruning(tmp_path):
+    write_pool_table(make_trees("763932"), "trees", outdir=tmp_path)
+    # a file in a partition outside the filter fails the read if it is scanned
+    missing_nest = tmp_path / "trees" / "campaign=763932" / "nest=__HIVE_DEFAULT_PARTITION__"
+    (missing_nest / "part-0.parquet").write_text("not parquet")
+    with pytest.raises(pa.ArrowInvalid):
+        read_pool_table("trees", outdir=tmp_path)
+
+    nest_2 = read_pool_table("trees", filters=[("nest", "=", 2)], columns=["DBH"], outdir=tmp_path)
+    assert sorted(nest_2["DBH"]) == [25.0, 31.0]
+    assert nest_2.columns.tolist() == ["DBH"]
+
+
+def test_rewrite_replaces_only_the_partitions_written(tmp_path):
+    write_pool_table(make_trees("763932"), "trees", outdir=tmp_path)
+    write_pool_table(make_trees("800000"), "trees", outdir=tmp_path)
+
+    # rewrite nest 2 of the second campaign
+    rewrite = make_trees("800000").query("nest == 2")
+    write_pool_table(rewrite.assign(DBH=rewrite["DBH"] + 1), "trees", outdir=tmp_path)
+
+    trees = read_pool_table("trees", outdir=tmp_path)
+    assert sorted(trees.loc[trees["campaign"] == "763932", "DBH"]) == [8.0, 12.0, 25.0, 31.0]
+    assert sorted(trees.loc[trees["campaign"] == "800000", "DBH"]) == [8.0, 12.0, 26.0, 32.0]
+
+
+def test_write_needs_a_campaign(tmp_path):
+    trees = make_trees("763932").drop(columns="campaign")
+    with pytest.raises(ValueError):
+        write_pool_table(trees, "trees", outdir=tmp_path)
+    write_pool_table(trees, "trees", campaign=763932, outdir=tmp_path)
+    assert (read_pool_table("trees", outdir=tmp_path)["campaign"] == "763932").all()
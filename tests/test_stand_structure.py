@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from src.carbon_stock import living_tree_stock, plot_area_index
+from src.stand_structure import dbh_class_labels, stand_structure
+
+
+def test_stand_structure_matches_tree_table(make_inventory):
+    trees, plot_info = make_inventory()
+    trees.loc[:4, "DBH"] = np.nan
+    plot_index = plot_area_index(plot_info)
+
+    with pytest.warns(UserWarning):
+        plot_structure, nest_structure = stand_structure(trees, plot_index)
+
+    labels = dbh_class_labels()
+    assert labels[:2] == ["0-10", "10-20"] and labels[-1] == "100+"
+    assert len(plot_structure) == trees["unique_id"].nunique() * len(labels)
+    assert nest_structure["stems"].sum() == trees["DBH"].notna().sum()
+
+    # stems per hectare of one nest against a groupby on the tree table
+    row = nest_structure[nest_structure["stems"] > 0].iloc[0]
+    nest_trees = trees[(trees["unique_id"] == row["unique_id"]) & (trees["nest"] == row["nest"])]
+    lower = float(row["dbh_class"].split("-")[0])
+    count = nest_trees["DBH"].between(lower, lower + 10, inclusive="left").sum()
+    area = plot_index.loc[row["unique_id"], row["nest"]]
+    assert row["stems"] == count
+    assert row["stems_per_ha"] == pytest.approx(count / area * 10_000)
+
+    # the biomass over all classes matches the living tree stock
+    trees_with_dbh = trees.dropna(subset=["DBH"])
+    with pytest.warns(UserWarning):
+        stock = living_tree_stock(trees_with_dbh, plot_index)
+    biomass = plot_structure.groupby("unique_id")["aboveground_biomass_t_per_ha"].sum(min_count=1)
+    expected = stock.set_index("unique_id")["aboveground_tC_per_ha"] / 0.47
+    np.testing.assert_allclose(biomass.reindex(expected.index), expected, rtol=1e-10)
+
+    with pytest.raises(ValueError):
+        stand_structure(trees, plot_index, dbh_edges=[10, 5])
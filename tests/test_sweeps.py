@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.biomass_equations import vmd0002_eq8a, vmd0002_eq8b, vmd0003_eq1
+from src.carbon_stock import living_tree_stock, plot_area_index
+from src.sweeps import parameter_grid, sweep_litter, sweep_living_trees, sweep_lying_deadwood
+
+
+def test_sweep_living_trees_matches_single_runs(make_inventory):
+    trees, plot_info = make_inventory()
+    plot_index = plot_area_index(plot_info)
+    plot_strata = trees.groupby("unique_id")["Strata"].first()
+    grid = parameter_grid(carbon_fraction=[0.45, 0.47, 0.5], root_shoot_ratio=[0.24, 0.36])
+
+    with pytest.warns(UserWarning):
+        # a tiny memory guard runs one combination per chunk
+        plot_results, strata_results = sweep_living_trees(
+            trees, plot_index, plot_strata, grid, max_bytes=1
+        )
+
+    for combination, row in grid.iterrows():
+        with pytest.warns(UserWarning):
+            expected = living_tree_stock(trees, plot_index, params=row.to_dict())
+        actual = plot_results[plot_results["combination"] == combination]
+        assert len(actual) == len(expected)
+        pd.testing.assert_frame_equal(
+            actual[expected.columns].reset_index(drop=True), expected, rtol=1e-12
+        )
+
+        expected_strata = expected.groupby(expected["unique_id"].map(plot_strata)).mean(
+            numeric_only=True
+        )
+        actual_strata = strata_results[strata_results["combination"] == combination]
+        np.testing.assert_allclose(
+            actual_strata["aboveground_CO2e_per_ha"],
+            expected_strata["aboveground_CO2e_per_ha"],
+            rtol=1e-12,
+        )
+
+
+def test_sweep_litter_and_lying_deadwood_match_single_runs():
+    rng = np.random.default_rng(1)
+    unique_ids = np.array([f"{i}A1" for i in range(10)])
+    plot_strata = pd.Series(rng.integers(1, 4, 10), index=unique_ids)
+    litter = pd.DataFrame({"unique_id": unique_ids, "kdm": rng.uniform(0, 1, 10)})
+    ldw = pd.DataFrame(
+        {
+            "unique_id": unique_ids[rng.integers(0, 10, 200)],
+            "density": rng.choice([1, 2, 3, np.nan], 200),
+            "deadwood_volume": rng.uniform(0, 5, 200),
+        }
+    )
+
+    grid = parameter_grid(water_content=[0.1, 0.15], carbon_fraction=[0.37, 0.47])
+    plot_results, _ = sweep_litter(litter, "kdm", plot_strata, grid)
+    for combination, row in grid.iterrows():
+        expected = vmd0003_eq1(litter, "kdm", row["water_content"], row["carbon_fraction"])
+        actual = plot_results[plot_results["combination"] == combination]
+        np.testing.assert_allclose(actual["CO2e_per_ha"], expected["CO2e_per_ha"])
+
+    maps = [{1: 0.54, 2: 0.35, 3: 0.21}, {1: 0.6, 2: 0.4}]
+    grid = parameter_grid(density_equivalent=maps, default_density=[0.21, 0.3])
+    plot_results, strata_results = sweep_lying_deadwood(ldw, "density", plot_strata, grid)
+    assert len(strata_results) == len(grid) * plot_strata.nunique()
+    for combination, row in grid.iterrows():
+        expected = vmd0002_eq8b(
+            vmd0002_eq8a(ldw, "density", row["density_equivalent"], row["default_density"]),
+            ["unique_id"],
+        )
+        actual = plot_results[plot_results["combination"] == combination]
+        np.testing.assert_allclose(
+            actual["tonnes_dry_matter_ha"], expected["tonnes_dry_matter_ha"]
+        )
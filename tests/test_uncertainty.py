@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.biomass_equations import calculate_statistics_table
+from src.uncertainty import (
+    BOOTSTRAP_COLUMNS,
+    StatisticsCube,
+    bootstrap_statistics,
+    propagate_pool_uncertainty,
+    stratified_totals,
+)
+
+POOLS = ["aboveground_CO2e_per_ha", "litter_CO2e_per_ha"]
+
+
+def make_plots(n_plots=120, seed=0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(rng.gamma(2, 50, (n_plots, len(POOLS))), columns=POOLS)
+    data["Strata"] = rng.integers(1, 4, n_plots)
+    data["subplot_count"] = rng.integers(1, 5, n_plots)
+    return data
+
+
+def test_bootstrap_statistics_is_reproducible():
+    data = make_plots()
+    result = bootstrap_statistics(data, POOLS, n_resamples=500, seed=7)
+    blocked = bootstrap_statistics(data, POOLS, n_resamples=500, seed=7, block_bytes=1, n_jobs=2)
+
+    pd.testing.assert_frame_equal(result, bootstrap_statistics(data, POOLS, n_resamples=500, seed=7))
+    pd.testing.assert_frame_equal(
+        result.drop(columns=BOOTSTRAP_COLUMNS), calculate_statistics_table(data, POOLS)
+    )
+    assert blocked[BOOTSTRAP_COLUMNS].notna().all().all()
+    assert (result["percentile_ci_lower"] < result["weighted_mean"]).all()
+    assert (result["bca_ci_upper"] > result["weighted_mean"]).all()
+
+
+def test_bootstrap_standard_error_matches_resampling_loop():
+    data = make_plots()
+    strata = data[data["Strata"] == 1]
+    rng = np.random.default_rng(0)
+    means = []
+    for _ in range(2000):
+        sample = strata.iloc[rng.integers(0, len(strata), len(strata))]
+        means.append(np.average(sample[POOLS[0]], weights=sample["subplot_count"]))
+
+    result = bootstrap_statistics(data, POOLS, n_resamples=2000, seed=0)
+    np.testing.assert_allclose(result.loc[0, "bootstrap_se"], np.std(means, ddof=1), rtol=0.1)
+
+
+def test_statistics_cube_updates_and_regroups():
+    data = make_plots()
+    data["plot_code_nmbr"] = np.arange(len(data))
+    keys = ["Strata", "plot_code_nmbr"]
+    first, second = data.iloc[:100], data.iloc[100:]
+
+    cube = StatisticsCube.from_frame(first, keys, POOLS).add(second)
+    pd.testing.assert_frame_equal(
+        cube.regroup("Strata").statistics(), calculate_statistics_table(data, POOLS), check_exact=False
+    )
+
+    merged = cube.remove(second).regroup("Strata", {"Strata": {3: 2}})
+    expected = calculate_statistics_table(first.replace({"Strata": {3: 2}}), POOLS)
+    pd.testing.assert_frame_equal(merged.statistics(), expected, check_exact=False)
+
+
+def test_pool_uncertainty_matches_summed_column():
+    data = make_plots()
+    totals, contributions = propagate_pool_uncertainty(data, POOLS)
+    expected = calculate_statistics_table(data.assign(all_CO2e_per_ha=data[POOLS].sum(axis=1)), ["all_CO2e_per_ha"])
+
+    pd.testing.assert_frame_equal(totals, expected, check_exact=False)
+    np.testing.assert_allclose(
+        contributions.groupby("Strata")["variance_contribution"].sum(), totals["weighted_std"] ** 2
+    )
+
+
+def test_stratified_totals_weight_strata_by_area():
+    statistics = calculate_statistics_table(make_plots(), POOLS)
+    areas = pd.DataFrame(
+        {
+            "CADT": [1, 1, 2, 2, 2],
+            "ELI_TYPE": ["APD", "APD", "APD", "ARR", "ARR"],
+            "strata": ["pre_strata_1", "pre_strata_2", "pre_strata_2", "pre_strata_3", "pre_strata_9"],
+            "area_ha": [100.0, 50.0, 20.0, 10.0, 5.0],
+        }
+    )
+    areas = areas.rename(columns={"strata": "Strata"})
+    strata_map = {f"pre_strata_{i}": i for i in [1, 2, 3, 9]}
+
+    # strata 9 has area but no plots
+    with pytest.warns(UserWarning, match="pre_strata_9"):
+        totals = stratified_totals(statistics, areas, strata_map=strata_map)
+    # a strata missing from the map is an error rather than area silently left out
+    with pytest.raises(ValueError, match="pre_strata_9"):
+        stratified_totals(statistics, areas, strata_map={f"pre_strata_{i}": i for i in range(1, 4)})
+
+    assert len(totals) == 4 * 2
+    stats = statistics.set_index(["Strata", "tCO2e_per_ha"])
+    row = totals[(totals["CADT"] == 1) & (totals["tCO2e_per_ha"] == "aboveground")].iloc[0]
+    mean, se = stats["weighted_mean"], stats["standard_error"]
+    expected = 100 * mean[(1, "aboveground")] + 50 * mean[(2, "aboveground")]
+    expected_se = np.hypot(100 * se[(1, "aboveground")], 50 * se[(2, "aboveground")])
+    assert row["area_ha"] == 150
+    assert row["total_tCO2e"] == pytest.approx(expected)
+    assert row["standard_error"] == pytest.approx(expected_se)
+
+    # the project total adds the area of each strata over the groups
+    project = totals[(totals["CADT"] == "all") & (totals["tCO2e_per_ha"] == "litter")].iloc[0]
+    expected = sum(
+        area * mean[(strata, "litter")] for strata, area in [(1, 100), (2, 70), (3, 10)]
+    )
+    assert project["total_tCO2e"] == pytest.approx(expected)
+    assert project["weighted_mean"] == pytest.approx(expected / 180)
+
+
+def test_stratified_totals_leave_out_pools_without_a_mean():
+    statistics = calculate_statistics_table(make_plots(), POOLS)
+    statistics = statistics[~((statistics["Strata"] == 3) & (statistics["tCO2e_per_ha"] == "litter"))]
+    areas = pd.DataFrame(
+        {"CADT": [1, 1], "ELI_TYPE": ["APD", "APD"], "Strata": [1, 3], "area_ha": [100.0, 40.0]}
+    )
+
+    with pytest.warns(UserWarning, match=r"litter in strata 3 \(40.00 ha\)"):
+        totals = stratified_totals(statistics, areas).set_index(["CADT", "tCO2e_per_ha"])
+
+    stats = statistics.set_index(["Strata", "tCO2e_per_ha"])
+    litter = totals.loc[(1, "litter")]
+    assert litter["area_ha"] == 100
+    assert litter["total_tCO2e"] == pytest.approx(100 * stats.loc[(1, "litter"), "weighted_mean"])
+    assert litter["weighted_mean"] == pytest.approx(stats.loc[(1, "litter"), "weighted_mean"])
+    assert totals.loc[(1, "aboveground"), "area_ha"] == 140
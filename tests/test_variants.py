@@ -0,0 +1,86 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.biomass_equations import calculate_statistics_table
+from src.carbon_stock import living_tree_stock, plot_area_index
+from src.outliers import handle_outliers
+from src.variants import attach_wood_density, plot_level_stock, run_variants
+
+
+def test_run_variants_matches_separate_runs(make_inventory):
+    trees, plot_info = make_inventory(n_trees=2000)
+    trees.loc[trees.index[:20], "DBH"] = 200
+    plot_index = plot_area_index(plot_info)
+    plot_lookup = trees[["unique_id", "Strata"]].drop_duplicates()
+    plot_lookup["plot_code_nmbr"] = plot_lookup["unique_id"].str[:1]
+
+    variants = {
+        "avg_substitution": {"outliers": "get_ave"},
+        "remove_trees_150": {"outliers": "drop_outliers"},
+        "cf_045": {"outliers": "get_ave", "params": {"carbon_fraction": 0.45}},
+        "mad": {"outliers": {"strategy": "mad", "k": 3}},
+    }
+    value_cols = ["aboveground_CO2e_per_ha", "belowground_CO2e_per_ha"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        statistics, reports = run_variants(trees, plot_index, plot_lookup, variants)
+
+        assert list(statistics["variant"].unique()) == list(variants)
+        assert list(reports["variant"]) == list(variants)
+        assert reports.set_index("variant").loc["remove_trees_150", "dropped"] == 20
+
+        for name, settings in variants.items():
+            outliers = settings["outliers"]
+            outliers = {"strategy": outliers} if isinstance(outliers, str) else dict(outliers)
+            variant_trees, _ = handle_outliers(trees, outliers.pop("strategy"), **outliers)
+            stock = living_tree_stock(variant_trees, plot_index, settings.get("params"))
+            plot_stock = plot_level_stock(stock, plot_lookup, value_cols)
+            expected = calculate_statistics_table(plot_stock, value_cols)
+            actual = statistics[statistics["variant"] == name].drop(columns="variant")
+            pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected, rtol=1e-10)
+
+
+def test_variants_differ_on_raw_trees_with_outliers(make_inventory):
+    raw, plot_info = make_inventory(n_trees=2000)
+    raw["code_species"] = np.arange(len(raw)) % 7
+    raw["code_family"] = np.nan
+    raw.loc[raw.index[:30], "DBH"] = np.linspace(160, 400, 30)
+    plot_index = plot_area_index(plot_info)
+    plot_lookup = raw[["unique_id", "Strata"]].drop_duplicates()
+    plot_lookup["plot_code_nmbr"] = plot_lookup["unique_id"].str[:1]
+
+    # the notebook wood densities are per subplot and species; the outliers are already averaged there
+    wood_densities = raw.drop_duplicates(["unique_id", "code_species"])
+    wood_densities = handle_outliers(wood_densities, "get_ave")[0]
+    trees = attach_wood_density(raw.drop(columns="wood_density"), wood_densities)
+    assert trees["DBH"].max() == 400
+    assert trees["wood_density"].notna().all()
+
+    variants = {
+        "avg_substitution": {"outliers": "get_ave"},
+        "remove_trees_150": {"outliers": "drop_outliers"},
+        "capped_150": {"outliers": "eq_150"},
+        "percentile_99": {"outliers": {"strategy": "percentile", "q": 0.99}},
+        "mad": {"outliers": "mad"},
+    }
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        statistics, reports = run_variants(trees, plot_index, plot_lookup, variants)
+
+    assert (reports["replaced"] + reports["dropped"] > 0).all()
+    means = statistics.pivot_table(index=["Strata", "tCO2e_per_ha"], columns="variant", values="weighted_mean")
+    aboveground = means.xs("aboveground", level="tCO2e_per_ha").sum()
+    assert aboveground.round(6).nunique() == len(variants)
+
+    # on trees whose outliers were already averaged, the 150 cm strategies cannot differ
+    cleaned = handle_outliers(trees, "get_ave")[0]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        statistics, _ = run_variants(cleaned, plot_index, plot_lookup, dict(list(variants.items())[:3]))
+    assert statistics.groupby("variant")["weighted_mean"].sum().round(6).nunique() == 1
+
+    with pytest.warns(UserWarning, match="no wood density"):
+        attach_wood_density(raw.assign(code_species=99), wood_densities)